@@ -1,11 +1,19 @@
 import os
+import re
+import math
+import asyncio
 import httpx
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 
+from telemetry import REGISTRY
+from facility_index import FacilityIndex, load_index
+from cancellation import remaining_timeout
+
 load_dotenv()
 
 GOOGLE_PLACES_API_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+GOOGLE_PLACES_PHOTO_URL = "https://maps.googleapis.com/maps/api/place/photo"
 GOOGLE_MAPS_API_KEY = os.getenv("Maps_API_KEY", "")
 
 FACILITY_TYPE_MAP = {
@@ -24,6 +32,38 @@ RADIUS_MAP = {
     "clinic": 5000,
 }
 
+# Optional httpx transport override. Left as None in production; the benchmark
+# suite swaps in a local stand-in so Places traffic never leaves the process.
+http_transport: Optional[httpx.AsyncBaseTransport] = None
+
+# Offline OpenStreetMap index (FACILITY_INDEX_PATH). When loaded, nearby
+# searches are answered from it and Places is only used to add ratings,
+# open_now and photos to the results.
+facility_index: Optional[FacilityIndex] = load_index()
+
+FACILITY_ENRICH = os.getenv("FACILITY_ENRICH", "true").lower() in ("1", "true", "yes")
+FACILITY_ENRICH_TIMEOUT_SECONDS = float(os.getenv("FACILITY_ENRICH_TIMEOUT_SECONDS", "2"))
+# Cap on offline results when no limit is given (Places returns at most 20 per page)
+FACILITY_INDEX_MAX_RESULTS = int(os.getenv("FACILITY_INDEX_MAX_RESULTS", "60"))
+
+# A Places result enriches an OSM facility when it is this close and the names agree
+ENRICH_MATCH_METERS = 150
+ENRICH_SAME_SPOT_METERS = 30
+
+FACILITY_ENRICHMENT = REGISTRY.counter(
+    "doctorx_facility_enrichment_total", "Offline facilities by Places enrichment outcome.", ("result",),
+)
+
+
+def _http_client(timeout: float = 10.0) -> httpx.AsyncClient:
+    """Build the AsyncClient used for every Google Places request."""
+    return httpx.AsyncClient(timeout=remaining_timeout("places", timeout), transport=http_transport)
+
+
+def has_offline_index() -> bool:
+    """True when nearby searches are answered by the offline index."""
+    return facility_index is not None
+
 
 def _extract_open_status(facility: Dict[str, Any]) -> Optional[bool]:
     """Safely extract open_now status from Google Places opening_hours."""
@@ -65,48 +105,21 @@ def _extract_photo_reference(facility: Dict[str, Any]) -> Optional[str]:
     return None
 
 
-async def get_nearby_facilities(
-    latitude: float,
-    longitude: float,
-    facility_type: str = "hospital",
-    radius: Optional[int] = None,
-) -> List[Dict[str, Any]]:
-    """
-    Fetch nearby medical facilities using Google Places Nearby Search API.
-
-    Args:
-        latitude:      User's current latitude
-        longitude:     User's current longitude
-        facility_type: One of 'hospital', 'pharmacy', 'doctor', 'emergency', 'clinic'
-        radius:        Search radius in meters (defaults per facility type)
-
-    Returns:
-        Cleaned list of facility dicts in DoctorXCare format.
-
-    Raises:
-        ValueError:   If API key is missing or facility_type is unsupported.
-        RuntimeError: If Google Places API returns an error status.
-    """
-    if not GOOGLE_MAPS_API_KEY:
-        raise ValueError(
-            "Maps_API_KEY environment variable is not set. "
-            "Please add it to your .env file."
-        )
-
+def _normalize_type(facility_type: str) -> str:
     normalized_type = facility_type.lower().strip()
     if normalized_type not in FACILITY_TYPE_MAP:
         raise ValueError(
             f"Unsupported facility_type '{facility_type}'. "
             f"Allowed values: {list(FACILITY_TYPE_MAP.keys())}"
         )
+    return normalized_type
 
-    places_type = FACILITY_TYPE_MAP[normalized_type]
-    search_radius = radius or RADIUS_MAP.get(normalized_type, 5000)
 
+def _search_params(latitude: float, longitude: float, normalized_type: str, radius: Optional[int]) -> Dict[str, Any]:
     params = {
         "location": f"{latitude},{longitude}",
-        "radius": search_radius,
-        "type": places_type,
+        "radius": radius or RADIUS_MAP.get(normalized_type, 5000),
+        "type": FACILITY_TYPE_MAP[normalized_type],
         "key": GOOGLE_MAPS_API_KEY,
     }
 
@@ -115,23 +128,26 @@ async def get_nearby_facilities(
         params["keyword"] = "emergency hospital"
     elif normalized_type == "clinic":
         params["keyword"] = "clinic specialist"
+    return params
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            response = await client.get(GOOGLE_PLACES_API_URL, params=params)
-            response.raise_for_status()
-        except httpx.TimeoutException:
-            raise RuntimeError(
-                "Google Places API request timed out. Please try again."
-            )
-        except httpx.HTTPStatusError as e:
-            raise RuntimeError(
-                f"Google Places API returned HTTP {e.response.status_code}: {e.response.text}"
-            )
-        except httpx.RequestError as e:
-            raise RuntimeError(
-                f"Network error while contacting Google Places API: {str(e)}"
-            )
+
+async def _nearby_search(client: httpx.AsyncClient, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One Nearby Search request; returns the raw results."""
+    try:
+        response = await client.get(GOOGLE_PLACES_API_URL, params=params)
+        response.raise_for_status()
+    except httpx.TimeoutException:
+        raise RuntimeError(
+            "Google Places API request timed out. Please try again."
+        )
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(
+            f"Google Places API returned HTTP {e.response.status_code}: {e.response.text}"
+        )
+    except httpx.RequestError as e:
+        raise RuntimeError(
+            f"Network error while contacting Google Places API: {str(e)}"
+        )
 
     data = response.json()
     api_status = data.get("status", "UNKNOWN")
@@ -152,17 +168,254 @@ async def get_nearby_facilities(
             f"Google Places API error: {api_status}. {error_msg}"
         )
 
-    raw_results: List[Dict[str, Any]] = data.get("results", [])
+    return data.get("results", [])
 
-    # Parse + filter each facility into the clean DoctorXCare shape
-    cleaned_facilities = [_parse_facility(facility) for facility in raw_results]
 
+def _rating_key(facility: Dict[str, Any]):
     # Sort by rating descending (None ratings go last)
-    cleaned_facilities.sort(
-        key=lambda f: (f["rating"] is None, -(f["rating"] or 0))
-    )
+    return (facility["rating"] is None, -(facility["rating"] or 0))
+
+
+def _rank_key(facility: Dict[str, Any]):
+    # Offline index results carry distance_m and stay nearest-first; rating only breaks ties.
+    # Places results have no distance and are ranked by rating.
+    distance = facility.get("distance_m")
+    return (distance if distance is not None else 0.0, *_rating_key(facility))
+
+
+def _require_api_key() -> None:
+    if not GOOGLE_MAPS_API_KEY:
+        raise ValueError(
+            "Maps_API_KEY environment variable is not set. "
+            "Please add it to your .env file."
+        )
+
+
+# ── Offline index + enrichment ───────────────────────────────────────────────
+
+_NAME_STOPWORDS = {"the", "and", "of", "hospital", "hospitals", "clinic", "pharmacy", "medical", "centre", "center", "dr"}
+
+
+def _name_tokens(name: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", (name or "").lower())) - _NAME_STOPWORDS
+
+
+def _distance_m(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """Equirectangular distance between two ``geometry`` dicts; fine at enrichment range."""
+    if None in (a.get("lat"), a.get("lng"), b.get("lat"), b.get("lng")):
+        return math.inf
+    mean_lat = math.radians((a["lat"] + b["lat"]) / 2)
+    dx = math.radians(b["lng"] - a["lng"]) * math.cos(mean_lat)
+    dy = math.radians(b["lat"] - a["lat"])
+    return 6371008.8 * math.hypot(dx, dy)
+
+
+def _enrich(facilities: List[Dict[str, Any]], raw_results: List[Dict[str, Any]]) -> None:
+    """
+    Copy Places-only fields onto the OSM facilities they describe. A Places
+    result matches the closest facility within ``ENRICH_MATCH_METERS`` whose
+    name shares words with it (or any facility on the same spot). Matched
+    facilities take the Google ``place_id`` as ``id``, so the details
+    endpoint works for them; unmatched Places results are not added.
+    """
+    places = [_parse_facility(raw) for raw in raw_results]
+    taken = set()
+    for facility in facilities:
+        tokens = _name_tokens(facility["name"])
+        best = None
+        for place in places:
+            if place["id"] in taken:
+                continue
+            distance = _distance_m(facility["geometry"], place["geometry"])
+            if distance > ENRICH_MATCH_METERS:
+                continue
+            other = _name_tokens(place["name"])
+            overlap = len(tokens & other) / len(tokens | other) if tokens and other else 0.0
+            if overlap < 0.3 and distance > ENRICH_SAME_SPOT_METERS:
+                continue
+            key = (overlap, -distance)
+            if best is None or key > best[0]:
+                best = (key, place)
+        if best is None:
+            FACILITY_ENRICHMENT.inc(result="unmatched")
+            continue
+        place = best[1]
+        taken.add(place["id"])
+        facility.update(
+            id=place["id"],
+            rating=place["rating"],
+            user_ratings_total=place["user_ratings_total"],
+            open_now=place["open_now"],
+            photo_reference=place["photo_reference"],
+            source="osm+places",
+        )
+        FACILITY_ENRICHMENT.inc(result="matched")
+
+
+async def _facilities_for_type(
+    client: httpx.AsyncClient,
+    latitude: float,
+    longitude: float,
+    normalized_type: str,
+    radius: Optional[int],
+    limit: Optional[int],
+    enrich: bool,
+) -> List[Dict[str, Any]]:
+    """Cleaned, ranked facilities of one type: from the offline index if loaded, else Places."""
+    params = _search_params(latitude, longitude, normalized_type, radius)
+
+    if facility_index is None:
+        raw_results = await _nearby_search(client, params)
+        # Parse + filter each facility into the clean DoctorXCare shape
+        facilities = [_parse_facility(facility) for facility in raw_results]
+    else:
+        facilities = facility_index.search(
+            latitude, longitude, normalized_type, params["radius"], limit or FACILITY_INDEX_MAX_RESULTS,
+        )
+        if enrich and facilities and GOOGLE_MAPS_API_KEY and FACILITY_ENRICH:
+            try:
+                _enrich(facilities, await _nearby_search(client, params))
+            except RuntimeError as e:
+                # Enrichment is optional; the offline answer stands on its own
+                FACILITY_ENRICHMENT.inc(len(facilities), result="failed")
+                print(f"Facility enrichment skipped: {e}")
+
+    facilities.sort(key=_rank_key)
+    return facilities[:limit] if limit else facilities
 
-    return cleaned_facilities
+
+def _places_timeout() -> float:
+    return FACILITY_ENRICH_TIMEOUT_SECONDS if facility_index is not None else 10.0
+
+
+async def get_nearby_facilities(
+    latitude: float,
+    longitude: float,
+    facility_type: str = "hospital",
+    radius: Optional[int] = None,
+    limit: Optional[int] = None,
+    enrich: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Fetch nearby medical facilities using Google Places Nearby Search API,
+    or from the offline OpenStreetMap index when one is loaded.
+
+    Args:
+        latitude:      User's current latitude
+        longitude:     User's current longitude
+        facility_type: One of 'hospital', 'pharmacy', 'doctor', 'emergency', 'clinic'
+        radius:        Search radius in meters (defaults per facility type)
+        limit:         Return at most this many (the nearest ones, with the index)
+        enrich:        With the index, add ratings/open_now from Places if it answers
+
+    Returns:
+        Cleaned list of facility dicts in DoctorXCare format.
+
+    Raises:
+        ValueError:   If API key is missing or facility_type is unsupported.
+        RuntimeError: If Google Places API returns an error status.
+    """
+    if facility_index is None:
+        _require_api_key()
+    normalized_type = _normalize_type(facility_type)
+
+    async with _http_client(_places_timeout()) as client:
+        return await _facilities_for_type(client, latitude, longitude, normalized_type, radius, limit, enrich)
+
+
+async def search_facility_types(
+    latitude: float,
+    longitude: float,
+    facility_types: List[str],
+    radius: Optional[int] = None,
+    limit: Optional[int] = None,
+    enrich: bool = True,
+) -> Dict[str, Any]:
+    """
+    Run one Nearby Search per facility type concurrently and merge them.
+
+    A place returned by several searches appears once, with every type that
+    found it in ``matched_types``. The merged list is ranked by the first
+    requested type that matched (so ``["emergency", "hospital"]`` lists
+    emergency results first), then by how many types matched, then by
+    distance with the offline index (rating breaks ties) or by rating
+    without it. If some searches fail the others are still returned, with the
+    failures reported per type.
+
+    Args:
+        latitude:       User's current latitude
+        longitude:      User's current longitude
+        facility_types: Types in priority order; duplicates are ignored
+        radius:         Search radius in meters (defaults per facility type)
+        limit:          At most this many facilities in total, after merging
+        enrich:         With the offline index, add Places ratings/open_now
+
+    Returns:
+        Dict with the normalized ``facility_types``, ``facilities``
+        (merged, ranked), ``per_type`` result counts and ``failed_types``
+        ({type: error}).
+
+    Raises:
+        ValueError:   If API key is missing or a facility_type is unsupported.
+        RuntimeError: If every search failed.
+    """
+    if facility_index is None:
+        _require_api_key()
+    types: List[str] = []
+    for facility_type in facility_types:
+        normalized_type = _normalize_type(facility_type)
+        if normalized_type not in types:
+            types.append(normalized_type)
+    if not types:
+        raise ValueError("At least one facility_type is required.")
+
+    # One client, so the searches share a connection pool (and TLS handshake)
+    async with _http_client(_places_timeout()) as client:
+        outcomes = await asyncio.gather(
+            *(_facilities_for_type(client, latitude, longitude, t, radius, limit, enrich) for t in types),
+            return_exceptions=True,
+        )
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    rank: Dict[str, int] = {}
+    per_type: Dict[str, int] = {}
+    failed_types: Dict[str, str] = {}
+    for index, (facility_type, outcome) in enumerate(zip(types, outcomes)):
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, RuntimeError):
+                raise outcome
+            failed_types[facility_type] = str(outcome)
+            continue
+        per_type[facility_type] = len(outcome)
+        for facility in outcome:
+            # OSM ids are stable even when only some searches got Places enrichment
+            key = (
+                facility.get("osm_id") or facility["id"]
+                or f"{facility['name']}@{facility['geometry']['lat']},{facility['geometry']['lng']}"
+            )
+            if key in merged:
+                if facility_type not in merged[key]["matched_types"]:
+                    merged[key]["matched_types"].append(facility_type)
+                continue
+            facility["matched_types"] = [facility_type]
+            merged[key] = facility
+            rank[key] = index
+
+    if not per_type:
+        raise RuntimeError(next(iter(failed_types.values())))
+
+    ranked_keys = sorted(
+        merged,
+        key=lambda k: (rank[k], -len(merged[k]["matched_types"]), *_rank_key(merged[k])),
+    )
+    if limit:
+        ranked_keys = ranked_keys[:limit]
+    return {
+        "facility_types": types,
+        "facilities": [merged[k] for k in ranked_keys],
+        "per_type": per_type,
+        "failed_types": failed_types,
+    }
 
 
 async def get_place_details(place_id: str) -> Dict[str, Any]:
@@ -189,7 +442,7 @@ async def get_place_details(place_id: str) -> Dict[str, Any]:
         "key": GOOGLE_MAPS_API_KEY,
     }
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    async with _http_client() as client:
         try:
             response = await client.get(details_url, params=params)
             response.raise_for_status()
@@ -220,4 +473,40 @@ async def get_place_details(place_id: str) -> Dict[str, Any]:
             if result.get("opening_hours")
             else None
         ),
-    }
\ No newline at end of file
+    }
+
+
+async def fetch_place_photo(photo_reference: str, max_width: int) -> bytes:
+    """
+    Download one Places photo. Google answers with a redirect to the image
+    host, which is followed; the key never reaches the caller.
+
+    Args:
+        photo_reference: photo_reference from a Nearby Search / Details result
+        max_width: largest width Google should return (1-1600)
+
+    Returns:
+        The raw image bytes.
+    """
+    _require_api_key()
+
+    params = {
+        "photo_reference": photo_reference,
+        "maxwidth": max(1, min(int(max_width), 1600)),
+        "key": GOOGLE_MAPS_API_KEY,
+    }
+
+    async with _http_client() as client:
+        try:
+            response = await client.get(GOOGLE_PLACES_PHOTO_URL, params=params, follow_redirects=True)
+            response.raise_for_status()
+        except httpx.TimeoutException:
+            raise RuntimeError("Google Places photo request timed out. Please try again.")
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError(f"Google Places photo request returned HTTP {e.response.status_code}.")
+        except httpx.RequestError as e:
+            raise RuntimeError(f"Failed to fetch place photo: {str(e)}")
+
+    if not response.headers.get("content-type", "").startswith("image/"):
+        raise RuntimeError("Google Places photo request did not return an image.")
+    return response.content
@@ -0,0 +1,38 @@
+"""
+Access control for operator endpoints that return patient data across
+patients or in bulk (the usage ledger, exports).
+
+The service has no user accounts, so these endpoints are gated by one
+shared secret sent as ``Authorization: Bearer <ADMIN_API_TOKEN>``. When no
+token is configured they are disabled (403) rather than left open.
+
+Configuration:
+    ADMIN_API_TOKEN   bearer token for operator endpoints (unset: endpoints disabled)
+"""
+
+import os
+import hmac
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+load_dotenv()
+
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+
+def require_admin(request: Request) -> None:
+    """
+    FastAPI dependency: let the request through only with the admin token.
+
+    Raises:
+        HTTPException: 403 when no token is configured, 401 on a missing or wrong one.
+    """
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="This endpoint is disabled; set ADMIN_API_TOKEN to enable it.")
+    scheme, _, supplied = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.strip().encode("utf-8"), ADMIN_API_TOKEN.encode("utf-8")):
+        raise HTTPException(
+            status_code=401, detail="A valid admin bearer token is required.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -2,16 +2,27 @@
 AI Doctor Agent — Groq-powered conversational diagnostic assistant.
 Conducts a structured audio-style consultation: 5-7 targeted questions,
 then delivers a diagnosis, emergency level, and next-step recommendations.
+
+Turns go through the AI Doctor LLM route: Groq first, failing over to a
+smaller Groq model and then Gemini, with a hedged request on slow turns.
+The scripted opening (language question, greeting and first clinical
+question) is served from templates without calling a model.
 """
 
 import os
 import json
 import re
+import uuid
 from typing import Optional
 from datetime import datetime
 from groq import Groq
 from dotenv import load_dotenv
 
+from telemetry import span, REGISTRY
+from usage import record_groq_completion, record_agent_run, timed
+from llm_router import DOCTOR_ROUTE, agent_model
+from cancellation import remaining_timeout
+
 load_dotenv()
 
 # ── Groq setup ───────────────────────────────────────────────────────────────
@@ -21,6 +32,14 @@ groq_client = Groq(api_key=GROQ_API_KEY)
 # ── Model to use ─────────────────────────────────────────────────────────────
 GROQ_MODEL = "llama-3.3-70b-versatile"
 
+# Gemini fallback for when Groq is down or slow
+GEMINI_API_KEY = os.getenv("AI_DOCTOR_GEMINI_API_KEY") or os.getenv("TRACKING_SERVICE_API_KEY", "")
+
+
+def gemini_chat_model(model_id: str):
+    """phi Gemini model used for AI Doctor turns routed to Gemini."""
+    return agent_model(f"gemini:{model_id}", GEMINI_API_KEY)
+
 # ── Conversation state ────────────────────────────────────────────────────────
 EMERGENCY_LEVELS = {
     1: {"label": "Non-Urgent",    "color": "#22c55e", "icon": "🟢", "action": "Schedule a routine appointment within a week."},
@@ -77,62 +96,132 @@ RULES:
 """
 
 
-def _call_groq(messages: list) -> str:
+def _call_groq(messages: list, model: str = GROQ_MODEL) -> str:
     """
     Send a list of messages to Groq and return the assistant's reply text.
 
     Args:
         messages: Full conversation history in OpenAI-compatible format
                   [{"role": "system"|"user"|"assistant", "content": "..."}]
+        model:    Groq model id (a cheaper one is passed when over budget)
 
     Returns:
         Raw text string from the model.
     """
-    completion = groq_client.chat.completions.create(
-        model=GROQ_MODEL,
-        messages=messages,
-        temperature=0.4,
-        max_tokens=1024,
-    )
+    with span("llm_call"), timed() as elapsed:
+        completion = groq_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.4,
+            max_tokens=1024,
+            # Groq's default, cut short by the request's deadline
+            timeout=remaining_timeout("groq", 60.0),
+        )
+    record_groq_completion(completion, model, elapsed["seconds"])
     return completion.choices[0].message.content.strip()
 
 
-def start_consultation() -> dict:
+def _call_gemini(messages: list, model: str) -> str:
+    """Same contract as ``_call_groq``, answered by a Gemini model via phi."""
+    from phi.model.message import Message
+
+    chat_messages = [Message(role=m["role"], content=m["content"]) for m in messages]
+    chat = gemini_chat_model(model)
+    with span("llm_call"), timed() as elapsed:
+        response = chat.response(messages=chat_messages)
+    # phi appends the assistant message, carrying the token metrics, to the list
+    record_agent_run(chat_messages[-1], model, elapsed["seconds"])
+    return (response.content or "").strip()
+
+
+_PROVIDER_CALLS = {"groq": _call_groq, "gemini": _call_gemini}
+
+
+def turn_provider(model: str = GROQ_MODEL) -> str:
+    """The provider ``DOCTOR_ROUTE`` will try first for a turn, for admission control."""
+    targets = DOCTOR_ROUTE.candidates(prefer=model, providers=_PROVIDER_CALLS.keys())
+    return targets[0].provider if targets else "groq"
+
+
+def _call_llm(messages: list, model: str = GROQ_MODEL) -> str:
     """
-    Initialize a new consultation session.
-    Returns the doctor's opening greeting asking for language preference.
+    Run one consultation turn through ``DOCTOR_ROUTE``. ``model`` is tried
+    first (it may be a budget-degraded Groq model); on errors or a slow
+    answer the router moves on to the next configured provider.
     """
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": (
-                "Start the consultation. First ask the patient whether they prefer "
-                "to speak in English or Hindi (हिंदी). "
-                "Respond in the JSON format with assessment_ready: false."
-            ),
-        },
-    ]
+    return DOCTOR_ROUTE.call(
+        lambda target: _PROVIDER_CALLS[target.provider](messages, target.model),
+        prefer=model,
+        providers=_PROVIDER_CALLS.keys(),
+    )
 
-    raw = _call_groq(messages)
-    parsed = _safe_parse(raw)
 
-    # Store the opening exchange in history
-    history = [
-        {"role": "user", "content": messages[1]["content"]},
-        {"role": "assistant", "content": raw},
-    ]
+def start_consultation(language: Optional[str] = None, patient_name: Optional[str] = None) -> dict:
+    """
+    Initialize a new consultation session from templates (no LLM call).
+    Returns the language question, or — when ``language`` is already
+    known ("en"/"hi", "English"/"हिंदी") — the greeting and first question.
+    """
+    session_id = _new_session_id()
+    if language:
+        language = language.lower() if language.lower() in OPENING_TURNS else detect_language(language)
+
+    if language is None:
+        response = dict(LANGUAGE_PROMPT)
+        history = [{"role": "user", "content": START_INSTRUCTION}]
+        TEMPLATED_TURNS.inc(kind="language_prompt", language="any")
+    else:
+        response = _opening_turn(language, patient_name)
+        history = [{"role": "user", "content": f"{START_INSTRUCTION} {LANGUAGE_CHOSEN[language]}"}]
+        TEMPLATED_TURNS.inc(kind="greeting", language=language)
+
+    # Same shape as a model-generated exchange, so later Groq turns see a normal history
+    raw = json.dumps(response, ensure_ascii=False)
+    history.append({"role": "assistant", "content": raw})
 
     return {
-        "session_id": _new_session_id(),
+        "session_id": session_id,
         "turn": 0,
-        "response": parsed,
+        "response": response,
         "raw": raw,
         "history": history,
+        "language": language,
     }
 
 
-def continue_consultation(patient_message: str, history: list, turn: int) -> dict:
+def scripted_turn(patient_message: str, history: list, turn: int, patient_name: Optional[str] = None) -> Optional[dict]:
+    """
+    Answer the language-selection reply from templates when possible.
+
+    Returns None (use the model) unless the last doctor turn was the
+    templated language question and the reply is a bare language choice
+    such as "Hindi", "English please" or "हिंदी में".
+    """
+    if not history or history[-1].get("content") != _LANGUAGE_PROMPT_RAW:
+        return None
+    language = detect_language(patient_message)
+    if language is None or not _is_bare_choice(patient_message):
+        return None
+
+    response = _opening_turn(language, patient_name)
+    raw = json.dumps(response, ensure_ascii=False)
+    TEMPLATED_TURNS.inc(kind="greeting", language=language)
+    return {
+        "turn": turn + 1,
+        "response": response,
+        "raw": raw,
+        "history": history + [
+            {"role": "user", "content": patient_message},
+            {"role": "assistant", "content": raw},
+        ],
+        "assessment_ready": False,
+        "language": language,
+    }
+
+
+def continue_consultation(
+    patient_message: str, history: list, turn: int, model: str = GROQ_MODEL, patient_name: Optional[str] = None,
+) -> dict:
     """
     Continue an existing consultation.
 
@@ -140,10 +229,16 @@ def continue_consultation(patient_message: str, history: list, turn: int) -> dic
         patient_message: What the patient just said.
         history: Previous chat history (list of {role, content}).
         turn: Current question number (0-indexed).
+        model: Groq model id to use for this turn.
+        patient_name: Name used in a templated greeting.
 
     Returns:
         Dict with doctor response, parsed JSON, and updated history.
     """
+    scripted = scripted_turn(patient_message, history, turn, patient_name)
+    if scripted is not None:
+        return scripted
+
     # After 5 turns push toward assessment
     suffix = ""
     if turn >= 5:
@@ -159,8 +254,9 @@ def continue_consultation(patient_message: str, history: list, turn: int) -> dic
     messages.extend(history)
     messages.append({"role": "user", "content": user_message})
 
-    raw = _call_groq(messages)
-    parsed = _safe_parse(raw)
+    raw = _call_llm(messages, model)
+    with span("json_parse"):
+        parsed = _safe_parse(raw)
 
     # Append the new exchange to history
     updated_history = history + [
@@ -177,6 +273,97 @@ def continue_consultation(patient_message: str, history: list, turn: int) -> dic
     }
 
 
+# ── Scripted opening ─────────────────────────────────────────────────────────
+
+TEMPLATED_TURNS = REGISTRY.counter(
+    "doctorx_ai_doctor_templated_turns_total", "AI Doctor turns answered from templates instead of a model.",
+    ("kind", "language"),
+)
+
+START_INSTRUCTION = (
+    "Start the consultation. First ask the patient whether they prefer "
+    "to speak in English or Hindi (हिंदी). "
+    "Respond in the JSON format with assessment_ready: false."
+)
+
+LANGUAGE_CHOSEN = {
+    "en": "The patient has chosen English.",
+    "hi": "The patient has chosen Hindi (हिंदी).",
+}
+
+LANGUAGE_PROMPT = {
+    "assessment_ready": False,
+    "question": (
+        "Hello, I'm Doctorxcare Assistance, your AI doctor. Namaste! 🙏 "
+        "Which language would you prefer for this consultation: English or Hindi (हिंदी)?"
+    ),
+    "empathy_note": "I'm here to help you.",
+}
+_LANGUAGE_PROMPT_RAW = json.dumps(LANGUAGE_PROMPT, ensure_ascii=False)
+
+OPENING_TURNS = {
+    "en": {
+        "assessment_ready": False,
+        "question": (
+            "Thank you{name}. I'm an AI doctor, so please confirm any advice with a real doctor. "
+            "What is the main health problem or symptom that brings you here today?"
+        ),
+        "empathy_note": "Take your time, I'm listening.",
+    },
+    "hi": {
+        "assessment_ready": False,
+        "question": (
+            "धन्यवाद{name}। मैं एक AI डॉक्टर हूँ, इसलिए कृपया किसी भी सलाह की पुष्टि किसी वास्तविक डॉक्टर से अवश्य करें। "
+            "आज आपको कौन सी मुख्य स्वास्थ्य समस्या या लक्षण परेशान कर रहा है?"
+        ),
+        "empathy_note": "आराम से बताइए, मैं आपकी मदद के लिए यहाँ हूँ।",
+    },
+}
+
+_DEVANAGARI_RE = re.compile(r"[\u0900-\u097F]")
+_WORD_RE = re.compile(r"[a-z0-9\u0900-\u097F']+")
+
+_HINDI_WORDS = {"hindi", "hindee", "hindhi", "हिंदी", "हिन्दी"}
+_ENGLISH_WORDS = {"english", "eng", "angrezi", "inglish", "अंग्रेज़ी", "अंग्रेजी", "इंग्लिश"}
+
+# Words that may surround a language choice without adding clinical content
+_CHOICE_FILLER = {
+    "i", "i'd", "id", "prefer", "please", "in", "speak", "talk", "want", "would", "like", "to",
+    "let's", "lets", "use", "ok", "okay", "yes", "language", "is", "fine", "me", "my", "sir", "doctor",
+    "mein", "main", "mai", "baat", "karo", "karein", "karte", "hain", "chahta", "chahti", "hu", "hoon",
+    "में", "मैं", "बात", "करें", "करो", "करना", "चाहता", "चाहती", "हूँ", "हूं", "भाषा", "हाँ", "जी", "कृपया",
+}
+
+
+def detect_language(text: str) -> Optional[str]:
+    """
+    "hi" or "en" from an explicit choice ("Hindi", "english please") or,
+    failing that, Devanagari script. None when it cannot tell.
+    """
+    words = set(_WORD_RE.findall((text or "").lower()))
+    hindi, english = bool(words & _HINDI_WORDS), bool(words & _ENGLISH_WORDS)
+    if hindi != english:
+        return "hi" if hindi else "en"
+    if _DEVANAGARI_RE.search(text or ""):
+        return "hi"
+    return None
+
+
+def _is_bare_choice(text: str) -> bool:
+    """True when the reply is only a language choice (plus polite filler)."""
+    words = _WORD_RE.findall(text.lower())
+    return bool(words) and all(
+        w in _HINDI_WORDS or w in _ENGLISH_WORDS or w in _CHOICE_FILLER for w in words
+    )
+
+
+def _opening_turn(language: str, patient_name: Optional[str] = None) -> dict:
+    turn = dict(OPENING_TURNS[language])
+    name = f", {patient_name.strip()}" if patient_name and patient_name.strip() not in ("", "Patient") else ""
+    turn["question"] = turn["question"].format(name=name)
+    return turn
+
+
 # ── Helpers ──────────────────────────────────────────────────────────────────
 
 def _safe_parse(text: str) -> dict:
@@ -198,8 +385,43 @@ def _safe_parse(text: str) -> dict:
     }
 
 
+# ── Triage for admission priority ────────────────────────────────────────────
+
+# Symptoms that make a turn emergency-class before the model has assessed it
+# (English, Hindi and romanised Hindi)
+_RED_FLAG_RE = re.compile(
+    r"chest (pain|tightness|pressure)|crushing (chest|pain)|heart attack|"
+    r"can'?t breathe|cannot breathe|unable to breathe|not able to breathe|struggling to breathe|gasping|"
+    r"(severe|extreme) (shortness of breath|breathlessness|bleeding|allergic)|"
+    r"unconscious|unresponsive|passed out|fainted|collapsed|seizure|convulsion|\b(having|had|getting) (a )?fits?\b|"
+    r"\bstroke|face (is )?droop|slurred speech|(weak|numb)(ness)? (on|in) one side|paraly[sz]|"
+    r"vomiting blood|coughing (up )?blood|blood in vomit|won'?t stop bleeding|"
+    r"suicid|kill myself|end my life|overdose|\b(swallowed|drank|drunk|took|ate|consumed) (some )?poison|"
+    r"\b(been|was|got) poisoned|anaphyla|throat (is )?(swelling|closing)|swollen tongue|"
+    r"worst headache|"
+    r"seene me[in]* dard|chhati me[in]* dard|saans nahi|behosh|"
+    r"सीने में दर्द|छाती में दर्द|सांस नहीं|साँस नहीं|सांस लेने में (तकलीफ|दिक्कत)|बेहोश|दौरा पड़|लकवा|"
+    r"खून की उल्टी|आत्महत्या",
+    re.IGNORECASE,
+)
+
+
+def turn_priority(patient_message: str) -> str:
+    """
+    Admission class for a consultation turn: "emergency" when the patient's
+    message describes a red-flag symptom, otherwise "interactive". Only the
+    current message is read: the history is sent back by the client, so
+    anything in it (including earlier assessments) could be forged to buy
+    emergency priority.
+    """
+    if _RED_FLAG_RE.search(patient_message or ""):
+        return "emergency"
+    return "interactive"
+
+
 def _new_session_id() -> str:
-    return f"doc_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    # Random suffix so concurrent consultations never share an id (usage is tracked per session)
+    return f"doc_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
 
 
 def get_emergency_info(level: int) -> dict:
@@ -0,0 +1,395 @@
+"""
+Per-patient analysis snapshots for incremental chronic-care re-analysis.
+
+Patients re-submit their whole history to /api/health-tracking/analyze every
+few days. Each finished analysis is stored as a snapshot keyed by a hash of
+the reading set, with the readings' digests and a structured summary:
+
+- identical submission (same readings, condition, symptoms, lifestyle notes
+  and medications): the stored analysis is returned without an LLM call;
+- only new readings added since a snapshot: the agent gets the prior
+  structured summary, the prior key findings and just the new readings;
+- anything else (edited or removed readings, a different condition, a long
+  chain of incremental updates): a full analysis, which starts a new chain.
+
+Snapshots are kept in shared_state.py, like jobs and the usage ledger, so
+a patient's next submission finds them on whichever worker it reaches.
+Expired snapshots and the least recently analysed patients beyond
+ANALYSIS_SNAPSHOT_MAX_PATIENTS are deleted once a minute. Columnar
+submissions (``columnar.ColumnarHealthTrackingData``) are fingerprinted and
+summarised straight from their arrays; their reading digests differ from
+the row format's, so switching formats starts a new chain.
+
+Configuration:
+    ANALYSIS_SNAPSHOT_TTL_SECONDS   how long a snapshot can be reused (default 30 days)
+    ANALYSIS_SNAPSHOT_MAX_PATIENTS  patients with snapshots; least recently analysed dropped (default 10000)
+    ANALYSIS_SNAPSHOTS_PER_PATIENT  snapshots kept per patient       (default 3)
+    ANALYSIS_MAX_DELTA_CHAIN        incremental updates before a full re-analysis (default 5)
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from http_encoding import dumps
+from columnar import ColumnarHealthTrackingData, reading_digests
+from shared_state import SharedDB
+
+load_dotenv()
+
+ANALYSIS_SNAPSHOT_TTL_SECONDS = float(os.getenv("ANALYSIS_SNAPSHOT_TTL_SECONDS", str(30 * 86400)))
+ANALYSIS_SNAPSHOT_MAX_PATIENTS = int(os.getenv("ANALYSIS_SNAPSHOT_MAX_PATIENTS", "10000"))
+ANALYSIS_SNAPSHOTS_PER_PATIENT = int(os.getenv("ANALYSIS_SNAPSHOTS_PER_PATIENT", "3"))
+ANALYSIS_MAX_DELTA_CHAIN = int(os.getenv("ANALYSIS_MAX_DELTA_CHAIN", "5"))
+
+# How often expired snapshots and surplus patients are deleted
+_PRUNE_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    patient_id   TEXT NOT NULL,
+    set_hash     TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    condition    TEXT NOT NULL,
+    digests      BLOB NOT NULL,
+    summary      BLOB NOT NULL,
+    result       BLOB NOT NULL,
+    created_at   REAL NOT NULL,
+    chain        INTEGER NOT NULL,
+    PRIMARY KEY (patient_id, set_hash)
+);
+CREATE INDEX IF NOT EXISTS snapshots_patient_created ON snapshots (patient_id, created_at);
+CREATE INDEX IF NOT EXISTS snapshots_created ON snapshots (created_at);
+"""
+
+_DB = SharedDB("analysis_snapshots", _SCHEMA)
+
+ANALYSIS_REQUESTS = REGISTRY.counter(
+    "doctorx_analysis_requests_total", "Health-tracking analyses by mode (cached, incremental, full).", ("mode",),
+)
+ANALYSIS_PROMPT_CHARS = REGISTRY.histogram(
+    "doctorx_analysis_prompt_chars", "Size of the prompt sent to the tracking agent.", ("mode",),
+    buckets=(500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 250000),
+)
+
+# Reading series of HealthTrackingData: label, numeric fields worth summarising,
+# unit when readings don't carry one
+SERIES: Dict[str, Tuple[str, Tuple[str, ...], Optional[str]]] = {
+    "blood_pressure": ("Blood pressure", ("systolic", "diastolic", "pulse"), "mmHg"),
+    "blood_glucose": ("Blood glucose", ("value",), None),
+    "heart_rate": ("Heart rate", ("value",), None),
+    "weight": ("Weight", ("value",), None),
+    "oxygen_saturation": ("Oxygen saturation (SpO2)", ("value",), "%"),
+    "tsh": ("TSH", ("value",), None),
+    "t3": ("T3", ("value",), None),
+    "t4": ("Free T4", ("value",), None),
+}
+
+# Report sections carried forward as "key findings" into an incremental prompt
+_FINDING_HEADINGS = ("STATUS OVERVIEW", "TREND ANALYSIS", "RED FLAGS")
+_FINDINGS_MAX_CHARS = 3000
+_HEADING_RE = re.compile(r"^##\s", re.MULTILINE)
+
+
+# ── Fingerprints ─────────────────────────────────────────────────────────────
+
+def _digest(*parts: Any) -> int:
+    return int.from_bytes(hashlib.blake2b(dumps(parts), digest_size=8).digest(), "little")
+
+
+@dataclass
+class Fingerprint:
+    set_hash: str            # hash of the reading set (order-independent) and condition
+    context_hash: str        # symptoms, lifestyle notes, medications
+    digests: np.ndarray      # sorted uint64 digest per reading
+    series_digests: Dict[str, np.ndarray]
+    total: int
+
+
+def fingerprint(data) -> Fingerprint:
+    series_digests: Dict[str, np.ndarray] = {}
+    for name in SERIES:
+        if isinstance(data, ColumnarHealthTrackingData):
+            series_digests[name] = reading_digests(name, data.columns.get(name))
+            continue
+        readings = getattr(data, name, None) or []
+        # __dict__ holds a pydantic model's field values; much cheaper than model_dump()
+        series_digests[name] = np.fromiter(
+            (_digest(name, r.__dict__) for r in readings), dtype=np.uint64, count=len(readings),
+        )
+
+    digests = np.sort(np.concatenate(list(series_digests.values())))
+    set_hash = hashlib.blake2b(digests.tobytes() + data.condition.lower().encode("utf-8"), digest_size=16).hexdigest()
+    context_hash = hashlib.blake2b(
+        dumps([data.symptoms, data.lifestyle_changes, data.medications]), digest_size=16,
+    ).hexdigest()
+    return Fingerprint(set_hash, context_hash, digests, series_digests, len(digests))
+
+
+# ── Structured summary ───────────────────────────────────────────────────────
+
+def summarize(data) -> Dict[str, Any]:
+    """Per-series counts, date range and min/avg/max/latest of each numeric field."""
+    if isinstance(data, ColumnarHealthTrackingData):
+        return _summarize_columns(data)
+    summary: Dict[str, Any] = {}
+    for name, (_, fields, default_unit) in SERIES.items():
+        readings = sorted(getattr(data, name, None) or [], key=lambda r: r.date)
+        if not readings:
+            continue
+        entry: Dict[str, Any] = {
+            "count": len(readings),
+            "first_date": readings[0].date,
+            "last_date": readings[-1].date,
+            "unit": getattr(readings[-1], "unit", None) or default_unit,
+        }
+        for field in fields:
+            values = [getattr(r, field) for r in readings if getattr(r, field, None) is not None]
+            if values:
+                entry[field] = {
+                    "avg": round(sum(values) / len(values), 1),
+                    "min": round(min(values), 2),
+                    "max": round(max(values), 2),
+                    "latest": round(values[-1], 2),
+                }
+        summary[name] = entry
+    return summary
+
+
+def _summarize_columns(data: ColumnarHealthTrackingData) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {}
+    for name, (_, fields, default_unit) in SERIES.items():
+        cols = data.columns.get(name)
+        if cols is None or len(cols) == 0:
+            continue
+        dates = cols.dates()
+        entry: Dict[str, Any] = {
+            "count": len(cols),
+            "first_date": str(dates[0]),
+            "last_date": str(dates[-1]),
+            "unit": cols.labels("unit")[-1] or default_unit,
+        }
+        for field in fields:
+            values = cols.fields.get(field)
+            if values is None:
+                continue
+            values = values[~np.isnan(values)]
+            if len(values):
+                entry[field] = {
+                    "avg": round(float(values.mean()), 1),
+                    "min": round(float(values.min()), 2),
+                    "max": round(float(values.max()), 2),
+                    "latest": round(float(values[-1]), 2),
+                }
+        summary[name] = entry
+    return summary
+
+
+def render_summary(summary: Dict[str, Any]) -> str:
+    lines = []
+    for name, entry in summary.items():
+        label = SERIES[name][0]
+        unit = f" {entry['unit']}" if entry.get("unit") else ""
+        stats = []
+        for field in SERIES[name][1]:
+            s = entry.get(field)
+            if s:
+                # Pulse shares the BP readings but is in bpm
+                field_unit = " bpm" if field == "pulse" else unit
+                prefix = f"{field} " if field != "value" else ""
+                stats.append(f"{prefix}avg {s['avg']}{field_unit} (min {s['min']}, max {s['max']}, latest {s['latest']})")
+        lines.append(
+            f"- **{label}**: {entry['count']} readings, {entry['first_date']} to {entry['last_date']}; "
+            + "; ".join(stats)
+        )
+    return "\n".join(lines)
+
+
+def key_findings(analysis: str) -> str:
+    """The status, trend and red-flag sections of a previous report, trimmed."""
+    starts = [m.start() for m in _HEADING_RE.finditer(analysis)] + [len(analysis)]
+    kept = []
+    for start, end in zip(starts, starts[1:]):
+        section = analysis[start:end].strip()
+        heading = section.split("\n", 1)[0].upper()
+        if any(h in heading for h in _FINDING_HEADINGS):
+            kept.append(section)
+    findings = "\n\n".join(kept)
+    if len(findings) > _FINDINGS_MAX_CHARS:
+        findings = findings[:_FINDINGS_MAX_CHARS].rsplit("\n", 1)[0] + "\n[...]"
+    return findings
+
+
+# ── Snapshots ────────────────────────────────────────────────────────────────
+
+@dataclass
+class Snapshot:
+    set_hash: str
+    context_hash: str
+    condition: str
+    digests: np.ndarray
+    summary: Dict[str, Any]
+    result: Dict[str, Any]
+    created_at: float
+    chain: int               # incremental updates since the last full analysis
+
+
+@dataclass
+class Plan:
+    mode: str                # "cached", "incremental" or "full"
+    fingerprint: Fingerprint
+    base: Optional[Snapshot] = None
+    delta: Any = None        # copy of the submission holding only the new readings
+    new_readings: int = 0
+
+
+class SnapshotStore:
+    """Recent snapshots per patient in the shared table, newest first."""
+
+    def __init__(
+        self,
+        ttl: float = ANALYSIS_SNAPSHOT_TTL_SECONDS,
+        max_patients: int = ANALYSIS_SNAPSHOT_MAX_PATIENTS,
+        per_patient: int = ANALYSIS_SNAPSHOTS_PER_PATIENT,
+    ):
+        self.ttl = ttl
+        self.max_patients = max_patients
+        self.per_patient = per_patient
+        self._last_prune = 0.0
+
+    def _recent(self, patient_id: str) -> List[Snapshot]:
+        rows = _DB.execute(
+            "SELECT set_hash, context_hash, condition, digests, summary, result, created_at, chain "
+            "FROM snapshots WHERE patient_id = ? AND created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (patient_id, time.time() - self.ttl, self.per_patient),
+        ).fetchall()
+        return [
+            Snapshot(
+                set_hash=set_hash,
+                context_hash=context_hash,
+                condition=condition,
+                digests=np.frombuffer(digests, dtype=np.uint64),
+                summary=json.loads(summary),
+                result=json.loads(result),
+                created_at=created_at,
+                chain=chain,
+            )
+            for set_hash, context_hash, condition, digests, summary, result, created_at, chain in rows
+        ]
+
+    def _prune(self, conn, now: float) -> None:
+        if now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        conn.execute("DELETE FROM snapshots WHERE created_at < ?", (now - self.ttl,))
+        conn.execute(
+            "DELETE FROM snapshots WHERE patient_id IN (SELECT patient_id FROM snapshots "
+            "GROUP BY patient_id ORDER BY MAX(created_at) DESC LIMIT -1 OFFSET ?)",
+            (self.max_patients,),
+        )
+
+    def plan(self, data) -> Plan:
+        """Decide how to analyse a submission against the patient's snapshots."""
+        fp = fingerprint(data)
+        snapshots = self._recent(data.patient_id)
+
+        for snapshot in snapshots:
+            if snapshot.set_hash == fp.set_hash and snapshot.context_hash == fp.context_hash:
+                return Plan("cached", fp, base=snapshot)
+
+        condition = data.condition.lower()
+        for snapshot in snapshots:   # newest first, so the largest usable base wins
+            if (
+                snapshot.condition != condition
+                or snapshot.chain >= ANALYSIS_MAX_DELTA_CHAIN
+                or len(snapshot.digests) == 0
+                or len(snapshot.digests) >= fp.total
+            ):
+                continue
+            if not _member(fp.digests, snapshot.digests).all():
+                continue     # a previously analysed reading was edited or removed
+            new_count = fp.total - len(snapshot.digests)
+            if new_count > len(snapshot.digests):
+                break        # mostly new data; a full analysis costs about the same
+            keep = {name: ~_member(snapshot.digests, fp.series_digests[name]) for name in SERIES}
+            if isinstance(data, ColumnarHealthTrackingData):
+                delta = data.select(keep)
+            else:
+                delta = data.model_copy(update={
+                    name: [r for r, new in zip(getattr(data, name, None) or [], keep[name]) if new]
+                    for name in SERIES
+                })
+            return Plan("incremental", fp, base=snapshot, delta=delta, new_readings=new_count)
+
+        return Plan("full", fp, new_readings=fp.total)
+
+    def save(self, data, plan: Plan, result: Dict[str, Any]) -> None:
+        now = time.time()
+        with _DB.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    data.patient_id,
+                    plan.fingerprint.set_hash,
+                    plan.fingerprint.context_hash,
+                    data.condition.lower(),
+                    plan.fingerprint.digests.astype(np.uint64).tobytes(),
+                    dumps(summarize(data)),
+                    dumps(result),
+                    now,
+                    plan.base.chain + 1 if plan.mode == "incremental" else 0,
+                ),
+            )
+            conn.execute(
+                "DELETE FROM snapshots WHERE patient_id = ? AND set_hash NOT IN (SELECT set_hash FROM snapshots "
+                "WHERE patient_id = ? ORDER BY created_at DESC LIMIT ?)",
+                (data.patient_id, data.patient_id, self.per_patient),
+            )
+            self._prune(conn, now)
+
+    def clear(self) -> None:
+        _DB.execute("DELETE FROM snapshots")
+
+
+def _member(sorted_digests: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Vectorised membership test against a sorted digest array."""
+    if len(sorted_digests) == 0:
+        return np.zeros(len(values), dtype=bool)
+    idx = np.minimum(np.searchsorted(sorted_digests, values), len(sorted_digests) - 1)
+    return sorted_digests[idx] == values
+
+
+def render_incremental_prompt(plan: Plan, new_data_summary: str) -> str:
+    """Prompt for an incremental update: prior summary and findings plus only the new readings."""
+    base = plan.base
+    analysed_at = datetime.fromtimestamp(base.created_at).strftime("%Y-%m-%d %H:%M")
+    return f"""
+## INCREMENTAL HEALTH TRACKING UPDATE
+
+This patient's readings were analysed on {analysed_at}. Below are a structured summary of the
+{len(base.digests)} readings analysed then, the key findings of that analysis, and only the
+{plan.new_readings} readings added since. Produce the complete report in the usual format for the
+ENTIRE history: use the summary for the earlier period and the new readings for recent changes,
+and state whether the new readings improve, maintain or worsen the earlier picture.
+**Total Readings Analyzed** is {plan.fingerprint.total}.
+
+### PREVIOUSLY ANALYSED READINGS (SUMMARY)
+{render_summary(base.summary)}
+
+### KEY FINDINGS FROM THE PREVIOUS ANALYSIS
+{key_findings(base.result.get("analysis") or "") or "- Not available"}
+
+### NEW DATA SINCE THE PREVIOUS ANALYSIS
+{new_data_summary}"""
+
+
+SNAPSHOTS = SnapshotStore()
@@ -0,0 +1,311 @@
+"""
+Streaming anomaly detection for vitals logged through quick-log.
+
+Every reading updates a small per-patient, per-metric state in O(1) and is
+checked, without any LLM call, for:
+
+- absolute thresholds: a reading in an "emergency" or "alert" zone of the
+  tracking agent's reference ranges (hypertensive crisis, glucose < 54 mg/dL,
+  SpO2 < 90 %, ...) fires immediately, even on the first reading;
+- spikes: rolling z-score against the last ANOMALY_WINDOW readings;
+- shifts: two-sided CUSUM on the same z-scores, for a sustained move that no
+  single reading would flag;
+- sustained levels: the EWMA of recent readings entering an alert zone.
+
+The statistical checks need ANOMALY_MIN_READINGS readings first. Glucose in
+mmol/L is converted to mg/dL, so mixed-unit logs share one baseline.
+Fasting and post-meal glucose are tracked as separate streams.
+
+Stream states are kept in shared_state.py, so every worker process updates
+the same baseline, and a recycled worker loses nothing. Each reading is one
+read-update-write transaction on its stream's row. The least recently
+updated streams beyond ANOMALY_MAX_STREAMS are deleted once a minute.
+
+Configuration:
+    ANOMALY_WINDOW          readings in the rolling z-score window (default 30)
+    ANOMALY_MIN_READINGS    readings before statistical checks apply (default 5)
+    ANOMALY_Z_THRESHOLD     |z| that counts as a spike (default 3.0)
+    ANOMALY_CUSUM_K         CUSUM slack, in standard deviations (default 0.5)
+    ANOMALY_CUSUM_H         CUSUM decision threshold (default 5.0)
+    ANOMALY_EWMA_ALPHA      smoothing factor of the EWMA baseline (default 0.2)
+    ANOMALY_MAX_STREAMS     (patient, metric) states kept, LRU (default 50000)
+"""
+
+import os
+import json
+import math
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from shared_state import SharedDB
+from tracking_agent import REFERENCE_ZONES, REFERENCE_UNITS, in_zone
+from vitals_series import zone_key
+
+load_dotenv()
+
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "30"))
+ANOMALY_MIN_READINGS = int(os.getenv("ANOMALY_MIN_READINGS", "5"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+ANOMALY_CUSUM_K = float(os.getenv("ANOMALY_CUSUM_K", "0.5"))
+ANOMALY_CUSUM_H = float(os.getenv("ANOMALY_CUSUM_H", "5.0"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.2"))
+ANOMALY_MAX_STREAMS = int(os.getenv("ANOMALY_MAX_STREAMS", "50000"))
+
+# How often streams beyond ANOMALY_MAX_STREAMS are deleted
+_PRUNE_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    patient_id TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    updated    REAL NOT NULL,
+    PRIMARY KEY (patient_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS streams_updated ON streams (updated);
+"""
+
+_DB = SharedDB("anomaly", _SCHEMA)
+
+ANOMALY_ALERTS = REGISTRY.counter(
+    "doctorx_anomaly_alerts_total", "Alerts raised on logged vitals.", ("metric", "kind", "severity"),
+)
+ANOMALY_STREAMS = REGISTRY.gauge(
+    "doctorx_anomaly_streams", "Per-patient, per-metric detector states stored (as of the last prune).",
+)
+
+# quick-log metric names -> reference-range series
+_METRIC_ALIASES = {
+    "blood_pressure": "systolic",
+    "bp_systolic": "systolic",
+    "bp_diastolic": "diastolic",
+    "glucose": "blood_glucose",
+    "blood_sugar": "blood_glucose",
+    "pulse": "heart_rate",
+    "spo2": "oxygen_saturation",
+}
+
+
+def canonical_metric(metric_type: str) -> str:
+    """Metric name used by the detector and the vitals store ("glucose" -> "blood_glucose")."""
+    return _METRIC_ALIASES.get(metric_type.lower(), metric_type.lower())
+
+
+# Zone level -> (alert severity, AI Doctor emergency level). Only emergency
+# zones map to a level; "alert" zones (e.g. high TSH) need follow-up, not urgent care.
+_THRESHOLD_SEVERITY = {
+    "emergency": ("emergency", 5),
+    "alert": ("warning", None),
+}
+
+# One reading can't move CUSUM by more than this, so a lone spike isn't also a "shift"
+_CUSUM_Z_CAP = 3.0
+
+_MGDL_PER_MMOL_GLUCOSE = 18.0
+
+
+def classify(key: str, value: float) -> Optional[Tuple[str, str]]:
+    """``(label, level)`` of the reference zone containing ``value``, if the series has zones."""
+    for label, low, high, level, high_inclusive in REFERENCE_ZONES.get(key, ()):
+        if in_zone(value, low, high, high_inclusive):
+            return label, level
+    return None
+
+
+# ── Per-stream state ─────────────────────────────────────────────────────────
+
+class _Stream:
+    """Fixed-size detector state for one (patient, series)."""
+
+    __slots__ = ("n", "ewma", "ewma_level", "window", "w_sum", "w_sumsq", "cusum_pos", "cusum_neg")
+
+    def __init__(self):
+        self.n = 0
+        self.ewma = 0.0
+        self.ewma_level = "normal"
+        self.window: deque = deque(maxlen=ANOMALY_WINDOW)
+        self.w_sum = 0.0
+        self.w_sumsq = 0.0
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+
+    def to_json(self) -> str:
+        return json.dumps({name: list(self.window) if name == "window" else getattr(self, name) for name in self.__slots__})
+
+    @classmethod
+    def from_json(cls, text: str) -> "_Stream":
+        stream = cls()
+        for name, value in json.loads(text).items():
+            if name == "window":
+                # A smaller ANOMALY_WINDOW keeps the newest readings, with the sums to match
+                stream.window.extend(value)
+                stream.w_sum = sum(stream.window)
+                stream.w_sumsq = sum(v * v for v in stream.window)
+            elif name not in ("w_sum", "w_sumsq"):
+                setattr(stream, name, value)
+        return stream
+
+    def update(self, key: str, value: float, unit: Optional[str]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        alerts: List[Dict[str, Any]] = []
+        zone = classify(key, value)
+
+        # Absolute thresholds, independent of history
+        if zone and zone[1] in _THRESHOLD_SEVERITY:
+            severity, level = _THRESHOLD_SEVERITY[zone[1]]
+            alerts.append(_alert(
+                key, "threshold", severity, value, unit,
+                f"{_sentence(_series_name(key))} of {_fmt(value)} {unit} is in the {zone[0]} range.",
+                **({"emergency_level": level} if level else {}),
+            ))
+
+        # Spike and shift, against the window *before* this reading
+        z = None
+        k = len(self.window)
+        if k >= ANOMALY_MIN_READINGS:
+            mean = self.w_sum / k
+            std = math.sqrt(max(self.w_sumsq / k - mean * mean, 0.0))
+            # Floor the spread so near-identical readings don't turn noise into alerts
+            std = max(std, 0.02 * abs(mean), 1e-6)
+            z = (value - mean) / std
+
+            if abs(z) >= ANOMALY_Z_THRESHOLD:
+                direction = "above" if z > 0 else "below"
+                alerts.append(_alert(
+                    key, "spike", "notice", value, unit,
+                    f"{_sentence(_series_name(key))} of {_fmt(value)} {unit} is {abs(z):.1f} SD {direction} "
+                    f"your recent average of {_fmt(mean)} {unit}.",
+                    z_score=round(z, 2),
+                ))
+
+            capped = max(-_CUSUM_Z_CAP, min(_CUSUM_Z_CAP, z))
+            self.cusum_pos = max(0.0, self.cusum_pos + capped - ANOMALY_CUSUM_K)
+            self.cusum_neg = max(0.0, self.cusum_neg - capped - ANOMALY_CUSUM_K)
+            if self.cusum_pos > ANOMALY_CUSUM_H or self.cusum_neg > ANOMALY_CUSUM_H:
+                direction = "up" if self.cusum_pos > ANOMALY_CUSUM_H else "down"
+                alerts.append(_alert(
+                    key, "shift", "notice", value, unit,
+                    f"Your {_series_name(key)} readings have shifted {direction} from "
+                    f"their usual level of about {_fmt(mean)} {unit}.",
+                ))
+                self.cusum_pos = self.cusum_neg = 0.0
+
+        # Rolling window and EWMA absorb the reading
+        if k == self.window.maxlen:
+            oldest = self.window[0]
+            self.w_sum -= oldest
+            self.w_sumsq -= oldest * oldest
+        self.window.append(value)
+        self.w_sum += value
+        self.w_sumsq += value * value
+
+        self.ewma = value if self.n == 0 else self.ewma + ANOMALY_EWMA_ALPHA * (value - self.ewma)
+        self.n += 1
+
+        if self.n >= ANOMALY_MIN_READINGS:
+            ewma_zone = classify(key, self.ewma)
+            level = ewma_zone[1] if ewma_zone else "normal"
+            # Edge-triggered: only when the smoothed level first enters an alert zone
+            if level in _THRESHOLD_SEVERITY and level != self.ewma_level:
+                alerts.append(_alert(
+                    key, "sustained", "warning", value, unit,
+                    f"Your recent {_series_name(key)} readings average about "
+                    f"{_fmt(self.ewma)} {unit}, which is in the {ewma_zone[0]} range.",
+                ))
+            self.ewma_level = level
+
+        status = {
+            "zone": zone[0] if zone else None,
+            "level": zone[1] if zone else None,
+            "baseline": round(self.ewma, 2),
+            "z_score": round(z, 2) if z is not None else None,
+            "readings_seen": self.n,
+        }
+        return alerts, status
+
+
+_SERIES_NAMES = {
+    "systolic": "systolic BP",
+    "diastolic": "diastolic BP",
+    "blood_glucose": "blood glucose",
+    "blood_glucose_post_meal": "post-meal blood glucose",
+    "oxygen_saturation": "SpO2",
+    "tsh": "TSH",
+}
+
+
+def _series_name(key: str) -> str:
+    return _SERIES_NAMES.get(key, key.replace("_", " "))
+
+
+def _sentence(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.1f}".rstrip("0").rstrip(".")
+
+
+def _alert(key: str, kind: str, severity: str, value: float, unit: Optional[str], message: str, **extra) -> Dict[str, Any]:
+    ANOMALY_ALERTS.inc(metric=key, kind=kind, severity=severity)
+    return {"metric": key, "kind": kind, "severity": severity, "value": value, "unit": unit, "message": message, **extra}
+
+
+# ── Detector ─────────────────────────────────────────────────────────────────
+
+class AnomalyDetector:
+    """Detector states for every (patient, series), in the shared streams table."""
+
+    def __init__(self, max_streams: int = ANOMALY_MAX_STREAMS):
+        self.max_streams = max_streams
+        self._last_prune = 0.0
+
+    def _prune(self, conn, now: float) -> None:
+        if now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        conn.execute(
+            "DELETE FROM streams WHERE (patient_id, key) IN "
+            "(SELECT patient_id, key FROM streams ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_streams,),
+        )
+        ANOMALY_STREAMS.set(conn.execute("SELECT COUNT(*) FROM streams").fetchone()[0])
+
+    def observe(
+        self,
+        patient_id: str,
+        metric_type: str,
+        value: float,
+        unit: Optional[str] = None,
+        context: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Update the stream for one reading; returns ``(alerts, status)``."""
+        metric = canonical_metric(metric_type)
+        key = zone_key(metric, "value", context)
+
+        if key.startswith("blood_glucose") and unit and unit.replace(" ", "").lower() == "mmol/l":
+            value, unit = value * _MGDL_PER_MMOL_GLUCOSE, "mg/dL"
+        unit = unit or REFERENCE_UNITS.get(key, "")
+
+        now = time.time()
+        # One transaction, so readings logged through two workers at once both count
+        with _DB.transaction() as conn:
+            row = conn.execute("SELECT state FROM streams WHERE patient_id = ? AND key = ?", (patient_id, key)).fetchone()
+            stream = _Stream.from_json(row[0]) if row else _Stream()
+            alerts, status = stream.update(key, value, unit)
+            conn.execute(
+                "INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?)", (patient_id, key, stream.to_json(), now),
+            )
+            self._prune(conn, now)
+
+        return alerts, {"metric": key, **status}
+
+    def clear(self) -> None:
+        _DB.execute("DELETE FROM streams")
+        ANOMALY_STREAMS.set(0)
+
+
+DETECTOR = AnomalyDetector()
@@ -0,0 +1,727 @@
+"""
+Offline benchmark and load-test suite for the DoctorX Care API.
+
+All three providers (Gemini, Groq, Google Places) are replaced with the
+local stand-ins from ``fake_providers`` so runs cost nothing and are
+repeatable. With ``--cassette`` they are instead answered from a cassette
+recorded against the live APIs (see ``cassettes``), replayed with the
+recorded latencies scaled by ``--latency-scale``. Two kinds of measurements are produced:
+
+- micro: CPU-only hot paths (prompt building, full vs incremental
+  re-analysis prompts, ``_safe_parse``, facility parsing/sorting and
+  offline facility index queries,
+  Pydantic validation of large payloads, row vs columnar ingest)
+- load:  concurrent requests against every endpoint in-process via
+  httpx's ASGI transport, including multi-turn AI Doctor sessions
+- encoding: JSON encode time (stdlib vs orjson) and bytes on the wire
+  (identity vs gzip vs brotli) for the largest response shapes
+- priority: admission wait per priority class when routine analyses flood
+  a rate-limited provider while interactive and emergency calls arrive
+
+Usage:
+    python benchmark.py micro
+    python benchmark.py encoding
+    python benchmark.py priority --concurrency 32
+    python benchmark.py load --concurrency 32 --requests 400 --gemini-latency-ms 800
+    PROVIDER_CASSETTE_KEY=... python benchmark.py load --cassette provider_cassette.jsonl --latency-scale 1
+    python benchmark.py all --json bench_output.json
+
+Regression gate: ``--save-baseline`` stores the run's summaries, and
+``--baseline`` compares a run against them and exits 1 when any scenario's
+``--regression-metric`` (p50 by default; the tails of short runs are noisy)
+grew by more than ``--tolerance`` (fraction, default 0.25) and by at least
+``--min-delta-ms``, or when it had more errors than the baseline. Baselines are machine-specific; record one on
+the machine that runs the gate, with the same options:
+    python benchmark.py load --save-baseline benchmark_baseline.json
+    python benchmark.py load --baseline benchmark_baseline.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Any, Awaitable
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Admission control would throttle the load generator itself; switch it off
+# unless limits were configured explicitly in the environment.
+for _var in ("RATE_LIMIT_CLIENT_RPM", "RATE_LIMIT_PATIENT_RPM", "GEMINI_RPS", "GROQ_RPS", "PLACES_RPS"):
+    os.environ.setdefault(_var, "0")
+# Jobs, snapshots and budgets persist in the shared state files; start every
+# run empty so a previous run's snapshots don't turn full analyses into cache hits
+if "SHARED_STATE_DIR" not in os.environ:
+    os.environ["SHARED_STATE_DIR"] = tempfile.mkdtemp(prefix="bench_state_")
+
+import httpx
+
+from fake_providers import FakeProviderConfig, install_fake_providers, fake_places_results, FAKE_AGENT_MARKDOWN
+from cassettes import install_cassette
+
+
+# ── Reporting ────────────────────────────────────────────────────────────────
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(name: str, samples_ms: List[float], wall_seconds: float, errors: int = 0) -> Dict[str, Any]:
+    """Build a p50/p95/p99 + throughput summary for one scenario."""
+    ordered = sorted(samples_ms)
+    return {
+        "name": name,
+        "count": len(ordered),
+        "errors": errors,
+        "mean_ms": round(statistics.fmean(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(_percentile(ordered, 50), 3),
+        "p95_ms": round(_percentile(ordered, 95), 3),
+        "p99_ms": round(_percentile(ordered, 99), 3),
+        "rps": round(len(ordered) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+    }
+
+
+def print_report(title: str, rows: List[Dict[str, Any]]) -> None:
+    print(f"\n=== {title} ===")
+    print(f"{'scenario':<40}{'n':>7}{'err':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'rps':>11}")
+    for r in rows:
+        print(
+            f"{r['name']:<40}{r['count']:>7}{r['errors']:>6}"
+            f"{r['p50_ms']:>11.3f}{r['p95_ms']:>11.3f}{r['p99_ms']:>11.3f}{r['rps']:>11.1f}"
+        )
+
+
+# Sections whose rows come from summarize() and can be compared
+BASELINE_SECTIONS = ("micro", "load", "priority")
+# Options that change what a scenario measures; a baseline is only comparable if they match
+BASELINE_CONFIG_KEYS = (
+    "readings", "requests", "concurrency", "session_turns", "gemini_latency_ms", "groq_latency_ms",
+    "places_latency_ms", "jitter_ms", "error_rate", "cassette", "latency_scale",
+)
+
+
+def save_baseline(path: str, report: Dict[str, Any]) -> None:
+    baseline = {
+        "generated_at": report["generated_at"],
+        "config": {key: report["config"].get(key) for key in BASELINE_CONFIG_KEYS},
+    }
+    baseline.update({section: report[section] for section in BASELINE_SECTIONS if section in report})
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"\nWrote baseline {path}")
+
+
+def compare_to_baseline(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    metric: str = "p50_ms",
+    tolerance: float = 0.25,
+    min_delta_ms: float = 1.0,
+) -> List[Dict[str, Any]]:
+    """
+    Scenario-by-scenario comparison of a run with a saved baseline. A row
+    regresses when ``metric`` grew by more than ``tolerance`` (a fraction)
+    and by at least ``min_delta_ms`` — so sub-millisecond noise never
+    fails a run — or when it saw more errors than the baseline did.
+    """
+    mismatched = [
+        key for key in BASELINE_CONFIG_KEYS
+        if key in baseline.get("config", {}) and baseline["config"][key] != report["config"].get(key)
+    ]
+    if mismatched:
+        print(f"\nwarning: baseline was recorded with different {', '.join(mismatched)}; comparison may not be fair")
+
+    rows = []
+    for section in BASELINE_SECTIONS:
+        before = {r["name"]: r for r in baseline.get(section, [])}
+        for current in report.get(section, []):
+            previous = before.get(current["name"])
+            if previous is None:
+                continue
+            old, new = previous[metric], current[metric]
+            slower = new - old >= min_delta_ms and new > old * (1.0 + tolerance)
+            rows.append({
+                "section": section,
+                "name": current["name"],
+                "baseline_ms": old,
+                "current_ms": new,
+                "change": round(new / old - 1.0, 3) if old else None,
+                "regressed": slower or current["errors"] > previous["errors"],
+            })
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], metric: str) -> None:
+    print(f"\n=== Baseline comparison ({metric}) ===")
+    print(f"{'scenario':<48}{'baseline':>11}{'current':>11}{'change':>9}")
+    for r in rows:
+        change = f"{r['change'] * 100:+.0f}%" if r["change"] is not None else "n/a"
+        flag = "  REGRESSED" if r["regressed"] else ""
+        print(f"{r['section'] + ': ' + r['name']:<48}{r['baseline_ms']:>11.3f}{r['current_ms']:>11.3f}{change:>9}{flag}")
+
+
+# ── Payload builders ─────────────────────────────────────────────────────────
+
+def make_tracking_payload(readings_per_metric: int = 500, patient_id: str = "bench_patient") -> Dict[str, Any]:
+    """A large HealthTrackingData body with every vital populated."""
+    start = datetime(2025, 1, 1, 7, 0, 0)
+    dates = [(start + timedelta(hours=6 * i)).isoformat() for i in range(readings_per_metric)]
+
+    def vitals(base: float, unit: str, context: str = None) -> List[Dict[str, Any]]:
+        return [
+            {"date": d, "value": base + (i % 17) - 8, "unit": unit, "context": context, "notes": None}
+            for i, d in enumerate(dates)
+        ]
+
+    return {
+        "patient_id": patient_id,
+        "condition": "Thyroid",
+        "blood_pressure": [
+            {"date": d, "systolic": 120 + (i % 30), "diastolic": 78 + (i % 15), "pulse": 70 + (i % 10), "context": "Morning"}
+            for i, d in enumerate(dates)
+        ],
+        "blood_glucose": vitals(105, "mg/dL", "Fasting"),
+        "heart_rate": vitals(72, "bpm", "Resting"),
+        "weight": vitals(72, "kg"),
+        "oxygen_saturation": vitals(97, "%"),
+        "tsh": vitals(2.5, "mIU/L"),
+        "t3": vitals(120, "ng/dL"),
+        "t4": vitals(1.2, "ng/dL"),
+        "medications": [{"name": "Metformin", "dosage": "500mg", "frequency": "BID"}],
+        "symptoms": "Occasional fatigue",
+        "lifestyle_changes": "Walking 30 minutes daily",
+    }
+
+
+def make_columnar_payload(readings_per_metric: int = 500, patient_id: str = "bench_patient") -> Dict[str, Any]:
+    """``make_tracking_payload`` in the columnar format (epoch-second timestamps)."""
+    rows = make_tracking_payload(readings_per_metric, patient_id)
+    epoch = datetime(1970, 1, 1)
+    series = {}
+    for name in ("blood_pressure", "blood_glucose", "heart_rate", "weight", "oxygen_saturation", "tsh", "t3", "t4"):
+        readings = rows[name]
+        columns: Dict[str, Any] = {"t": [int((datetime.fromisoformat(r["date"]) - epoch).total_seconds()) for r in readings]}
+        if name == "blood_pressure":
+            for field in ("systolic", "diastolic", "pulse"):
+                columns[field] = [r[field] for r in readings]
+        else:
+            columns["value"] = [r["value"] for r in readings]
+            columns["units"] = [readings[0]["unit"]]
+        context = readings[0].get("context")
+        if context:
+            columns["contexts"] = [context]
+        series[name] = columns
+    return {
+        "format": "columnar",
+        "patient_id": patient_id,
+        "condition": rows["condition"],
+        "series": series,
+        "medications": rows["medications"],
+        "symptoms": rows["symptoms"],
+        "lifestyle_changes": rows["lifestyle_changes"],
+    }
+
+
+def make_trend_payload(readings: int = 365) -> Dict[str, Any]:
+    start = datetime(2025, 1, 1)
+    return {
+        "patient_id": "bench_patient",
+        "metric_type": "blood_glucose",
+        "time_range": readings,
+        "readings": [
+            {"date": (start + timedelta(days=i)).isoformat(), "value": 100 + (i % 40), "unit": "mg/dL"}
+            for i in range(readings)
+        ],
+    }
+
+
+def make_facility_index(count: int, out_dir: str, seed: int = 0):
+    """Build an offline facility index of ``count`` synthetic OSM facilities around Delhi."""
+    import random
+    from facility_index import build_index, FacilityIndex, KINDS
+
+    rng = random.Random(seed)
+    source = out_dir + ".geojsonl"
+    with open(source, "w") as f:
+        for i in range(count):
+            lat, lng = rng.gauss(28.61, 0.3), rng.gauss(77.21, 0.3)
+            f.write(json.dumps({
+                "type": "Feature", "id": f"node/{i}",
+                "properties": {"amenity": KINDS[i % len(KINDS)], "name": f"Facility {i}", "addr:city": "Delhi"},
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+            }) + "\n")
+    build_index(source, out_dir)
+    os.remove(source)
+    return FacilityIndex(out_dir)
+
+
+# ── Microbenchmarks ──────────────────────────────────────────────────────────
+
+def _time_callable(name: str, fn: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    samples = []
+    wall_start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return summarize(name, samples, time.perf_counter() - wall_start)
+
+
+def run_microbenchmarks(iterations: int = 200, readings_per_metric: int = 500) -> List[Dict[str, Any]]:
+    import main
+    from ai_doctor_agent import _safe_parse
+    from DoctorFinder import _parse_facility
+
+    payload = make_tracking_payload(readings_per_metric)
+    tracking_data = main.HealthTrackingData(**payload)
+
+    fenced_output = "Sure, here is the assessment:\n```json\n" + json.dumps({
+        "assessment_ready": True,
+        "possible_conditions": ["A", "B", "C"],
+        "emergency_level": 3,
+        "summary": "x" * 4000,
+    }) + "\n```\nLet me know if you need anything else." * 3
+    unparseable_output = "I could not format that as JSON. " * 200
+
+    raw_places = fake_places_results(count=60)
+
+    # Re-analysis after a few more days of readings, against a stored snapshot
+    from analysis_snapshots import SnapshotStore, render_incremental_prompt
+    snapshots = SnapshotStore()
+    base_plan = snapshots.plan(tracking_data)
+    snapshots.save(tracking_data, base_plan, {"analysis": FAKE_AGENT_MARKDOWN})
+    extended_data = main.HealthTrackingData(**make_tracking_payload(readings_per_metric + 12))
+
+    def incremental_prompt():
+        plan = snapshots.plan(extended_data)
+        return render_incremental_prompt(plan, main._build_tracking_summary(plan.delta))
+
+    full_chars = len(main._build_tracking_summary(extended_data))
+    incremental_chars = len(incremental_prompt())
+
+    # Everything that happens to a submission before the prompt: validation, fingerprint, summary
+    from analysis_snapshots import fingerprint, summarize
+    from columnar import ColumnarHealthTrackingData
+    columnar_payload = make_columnar_payload(readings_per_metric)
+
+    def ingest_rows():
+        data = main.HealthTrackingData(**payload)
+        return fingerprint(data), summarize(data)
+
+    def ingest_columnar():
+        data = ColumnarHealthTrackingData(**columnar_payload)
+        return fingerprint(data), summarize(data)
+
+    # Offline nearby search: tree walk alone, and the full DoctorFinder-shaped answer
+    import tempfile
+    index_dir = tempfile.mkdtemp(prefix="bench_facilities_")
+    facilities = make_facility_index(100_000, os.path.join(index_dir, "index"))
+    query_points = itertools.cycle([(28.61 + 0.01 * (i % 7), 77.21 - 0.01 * (i % 5)) for i in range(35)])
+
+    def parse_and_sort():
+        cleaned = [_parse_facility(f) for f in raw_places]
+        cleaned.sort(key=lambda f: (f["rating"] is None, -(f["rating"] or 0)))
+        return cleaned
+
+    results = [
+        _time_callable(f"build_tracking_summary[{readings_per_metric}x8]", lambda: main._build_tracking_summary(tracking_data), iterations),
+        _time_callable(
+            f"incremental_prompt[+12x8, {incremental_chars} vs {full_chars} chars]", incremental_prompt, iterations,
+        ),
+        _time_callable("safe_parse[fenced]", lambda: _safe_parse(fenced_output), iterations * 10),
+        _time_callable("safe_parse[fallback]", lambda: _safe_parse(unparseable_output), iterations * 10),
+        _time_callable("parse_facility+sort[60]", parse_and_sort, iterations * 10),
+        _time_callable(
+            "facility_index.within[5 km, 100k]", lambda: facilities.within(*next(query_points), 5000, ("hospital",)),
+            iterations * 10,
+        ),
+        _time_callable(
+            "facility_index.search[20 nearest, 100k]",
+            lambda: facilities.search(*next(query_points), "hospital", 5000, 20), iterations * 10,
+        ),
+        _time_callable(f"validate_tracking_data[{readings_per_metric}x8]", lambda: main.HealthTrackingData(**payload), iterations),
+        _time_callable(f"ingest[rows, {readings_per_metric}x8]", ingest_rows, iterations),
+        _time_callable(f"ingest[columnar, {readings_per_metric}x8]", ingest_columnar, iterations),
+    ]
+    shutil.rmtree(index_dir, ignore_errors=True)
+    return results
+
+
+# ── Encoding benchmarks ──────────────────────────────────────────────────────
+
+def make_encoding_payloads() -> Dict[str, Any]:
+    """Representative bodies for the heaviest responses."""
+    from DoctorFinder import _parse_facility
+
+    history = []
+    for i in range(7):
+        history.append({"role": "user", "content": f"मुझे {i + 1} दिन से सिरदर्द और हल्का बुखार है, रात में ज़्यादा होता है।"})
+        history.append({"role": "assistant", "content": json.dumps({
+            "assessment_ready": False,
+            "question": f"प्रश्न {i + 1}: क्या आपको मतली, उल्टी या रोशनी से परेशानी होती है?",
+            "empathy_note": "मैं समझ सकता हूँ, यह असहज होगा।",
+        }, ensure_ascii=False)})
+
+    facilities = [_parse_facility(f) for f in fake_places_results(count=20)]
+    analysis = FAKE_AGENT_MARKDOWN + "\n".join(
+        f"- **{(datetime(2025, 1, 1) + timedelta(hours=7 * i)).strftime('%d %b %H:%M')}**: "
+        f"BP {118 + (i * 7) % 31}/{76 + (i * 5) % 17} mmHg, glucose {92 + (i * 13) % 71} mg/dL"
+        for i in range(60)
+    )
+    return {
+        "ai-doctor/respond[14 msgs, hi]": {
+            "success": True, "turn": 7, "assessment_ready": False,
+            "response": json.loads(history[-1]["content"]), "history": history,
+        },
+        "health-tracking/analyze[markdown]": {
+            "success": True, "patient_id": "bench_patient", "condition": "diabetes",
+            "analysis": analysis, "analyzed_at": datetime.now().isoformat(),
+        },
+        "nearby-finder[20 facilities]": {
+            "success": True, "count": len(facilities), "facilities": facilities,
+        },
+    }
+
+
+def run_encoding_benchmarks(iterations: int = 200) -> List[Dict[str, Any]]:
+    from starlette.responses import JSONResponse
+    from http_encoding import dumps, compress, orjson, brotli
+
+    rows = []
+    for name, payload in make_encoding_payloads().items():
+        stdlib = _time_callable("stdlib", lambda: JSONResponse(payload).body, iterations * 10)
+        fast = _time_callable("fast", lambda: dumps(payload), iterations * 10)
+        raw_std = JSONResponse(payload).body
+        raw_fast = dumps(payload)
+        gz = _time_callable("gzip", lambda: compress(raw_fast, "gzip"), iterations)
+        row = {
+            "name": name,
+            "stdlib_us": round(stdlib["mean_ms"] * 1000.0, 1),
+            "orjson_us": round(fast["mean_ms"] * 1000.0, 1) if orjson is not None else None,
+            "bytes_stdlib": len(raw_std),
+            "bytes_identity": len(raw_fast),
+            "bytes_gzip": len(compress(raw_fast, "gzip")),
+            "gzip_us": round(gz["mean_ms"] * 1000.0, 1),
+            "bytes_br": None,
+            "br_us": None,
+        }
+        if brotli is not None:
+            br = _time_callable("br", lambda: compress(raw_fast, "br"), iterations)
+            row["bytes_br"] = len(compress(raw_fast, "br"))
+            row["br_us"] = round(br["mean_ms"] * 1000.0, 1)
+        rows.append(row)
+    return rows
+
+
+def print_encoding_report(rows: List[Dict[str, Any]]) -> None:
+    print("\n=== Encoding (encode us; bytes on wire) ===")
+    print(f"{'response':<36}{'json us':>9}{'orjson us':>11}{'json B':>9}{'orjson B':>10}"
+          f"{'gzip B':>9}{'gzip us':>9}{'br B':>8}{'br us':>8}")
+    for r in rows:
+        print(
+            f"{r['name']:<36}{r['stdlib_us']:>9}{str(r['orjson_us']):>11}{r['bytes_stdlib']:>9}"
+            f"{r['bytes_identity']:>10}{r['bytes_gzip']:>9}{r['gzip_us']:>9}{str(r['bytes_br']):>8}{str(r['br_us']):>8}"
+        )
+
+
+# ── Priority scheduling ──────────────────────────────────────────────────────
+
+async def run_priority_scenario(
+    concurrency: int = 32, seconds: float = 5.0, rate: float = 20.0, burst: int = 20,
+) -> List[Dict[str, Any]]:
+    """
+    ``concurrency`` routine callers hammer one provider bucket for ``seconds``;
+    an interactive call arrives every 100 ms and an emergency call every 500 ms.
+    Reports the admission wait of each class (429s count as errors).
+    """
+    from ratelimit import ProviderLimiter, RateLimited, PROVIDER_MAX_WAIT_SECONDS
+
+    limiter = ProviderLimiter("bench", rate, burst, max_queue=concurrency * 2, max_wait=PROVIDER_MAX_WAIT_SECONDS)
+    waits: Dict[str, List[float]] = {"emergency": [], "interactive": [], "routine": []}
+    rejected = {name: 0 for name in waits}
+    stop = time.perf_counter() + seconds
+
+    async def call(priority: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            await limiter.acquire(priority)
+            waits[priority].append((time.perf_counter() - t0) * 1000.0)
+        except RateLimited as exc:
+            rejected[priority] += 1
+            await asyncio.sleep(min(exc.retry_after, 0.5))
+
+    async def flood() -> None:
+        while time.perf_counter() < stop:
+            await call("routine")
+
+    async def every(priority: str, interval: float) -> None:
+        while time.perf_counter() < stop:
+            await asyncio.sleep(interval)
+            asyncio.ensure_future(call(priority))
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(flood() for _ in range(concurrency)), every("interactive", 0.1), every("emergency", 0.5))
+    await asyncio.sleep(PROVIDER_MAX_WAIT_SECONDS)   # let the last arrivals finish
+    wall = time.perf_counter() - wall
+    return [
+        summarize(f"admit[{name}]", samples, wall, rejected[name])
+        for name, samples in waits.items()
+    ]
+
+
+# ── Load scenarios ───────────────────────────────────────────────────────────
+
+async def _drive(
+    name: str,
+    client: httpx.AsyncClient,
+    request_fn: Callable[[httpx.AsyncClient], Awaitable[None]],
+    total: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Run ``total`` invocations of ``request_fn`` with at most ``concurrency`` in flight."""
+    samples: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                await request_fn(client)
+            except Exception:
+                errors += 1
+            samples.append((time.perf_counter() - t0) * 1000.0)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, samples, time.perf_counter() - wall_start, errors)
+
+
+def _check(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return
+    body = response.json()
+    if isinstance(body, dict) and (body.get("error") or body.get("success") is False):
+        raise RuntimeError(str(body.get("error")))
+
+
+async def run_load_scenarios(
+    total: int = 200,
+    concurrency: int = 16,
+    session_turns: int = 6,
+    readings_per_metric: int = 200,
+) -> List[Dict[str, Any]]:
+    import main
+
+    tracking_payload = make_tracking_payload(readings_per_metric)
+    # Same history plus a few more days, for the incremental and repeat scenarios
+    extended_payload = make_tracking_payload(readings_per_metric + 12)
+    full_ids, incremental_ids = itertools.count(), itertools.count()
+    trend_payload = make_trend_payload()
+    image_bytes = b"\x89PNG\r\n\x1a\n" + b"\x00" * 2048
+
+    async def medical_analysis(c):
+        _check(await c.post("/api/medical-analysis", files={"file": ("scan.png", image_bytes, "image/png")}))
+
+    async def scan_report(c):
+        _check(await c.post("/api/health-tracking/scan-report", files={"file": ("report.png", image_bytes, "image/png")}))
+
+    async def analyze(c):
+        # A new patient every time, so each request is a full (uncached) analysis
+        body = {**tracking_payload, "patient_id": f"bench_patient_{next(full_ids)}"}
+        _check(await c.post("/api/health-tracking/analyze", json=body))
+
+    async def analyze_incremental(c):
+        # Patients analysed by the previous scenario come back with new readings
+        body = {**extended_payload, "patient_id": f"bench_patient_{next(incremental_ids)}"}
+        _check(await c.post("/api/health-tracking/analyze", json=body))
+
+    async def analyze_repeat(c):
+        body = {**extended_payload, "patient_id": "bench_patient_0"}
+        _check(await c.post("/api/health-tracking/analyze", json=body))
+
+    async def trend(c):
+        _check(await c.post("/api/health-tracking/trend-analysis", json=trend_payload))
+
+    async def quick_log(c):
+        _check(await c.post("/api/health-tracking/quick-log", params={
+            "patient_id": "bench_patient", "metric_type": "blood_glucose", "value": 110, "unit": "mg/dL",
+        }))
+
+    async def nearby(c):
+        _check(await c.get("/api/v1/nearby-finder", params={"latitude": 28.61, "longitude": 77.21, "facility_type": "emergency"}))
+
+    async def nearby_multi(c):
+        _check(await c.get("/api/v1/nearby-finder/multi", params={
+            "latitude": 28.61, "longitude": 77.21, "facility_types": "emergency,hospital,clinic",
+        }))
+
+    async def details(c):
+        _check(await c.get("/api/v1/facility-details/fake_place_0001"))
+
+    photo_run = uuid.uuid4().hex[:8]
+    photo_ids = itertools.count()
+
+    async def photo(c):
+        # Ten photos per run: the first request for each goes to Places, the rest are cache hits
+        reference = f"fake_photo_{photo_run}_{next(photo_ids) % 10}"
+        _check(await c.get(f"/api/v1/facility-photo/{reference}", params={"width": 200}))
+
+    async def doctor_session(c):
+        r = await c.post("/api/ai-doctor/start", json={"patient_name": "Bench"})
+        _check(r)
+        body = r.json()
+        history, turn, session_id = body["history"], body["turn"], body["session_id"]
+        replies = ["English", "Headache since two days", "6 out of 10", "No fever", "No medications", "No allergies", "Nothing else"]
+        for i in range(session_turns):
+            r = await c.post("/api/ai-doctor/respond", json={
+                "patient_message": replies[i % len(replies)], "history": history, "turn": turn,
+                "session_id": session_id, "patient_id": "bench_patient",
+            })
+            _check(r)
+            body = r.json()
+            history, turn = body["history"], body["turn"]
+            if body["assessment_ready"]:
+                break
+
+    scenarios = [
+        ("POST /api/medical-analysis", medical_analysis),
+        ("POST /health-tracking/scan-report", scan_report),
+        ("POST /health-tracking/analyze[full]", analyze),
+        ("POST /health-tracking/analyze[incremental]", analyze_incremental),
+        ("POST /health-tracking/analyze[repeat]", analyze_repeat),
+        ("POST /health-tracking/trend-analysis", trend),
+        ("POST /health-tracking/quick-log", quick_log),
+        ("GET /api/v1/nearby-finder", nearby),
+        ("GET /api/v1/nearby-finder/multi[3 types]", nearby_multi),
+        ("GET /api/v1/facility-details", details),
+        ("GET /api/v1/facility-photo[10 photos]", photo),
+        (f"AI Doctor session[{session_turns} turns]", doctor_session),
+    ]
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name, fn in scenarios:
+            # Sessions are many requests each, so run fewer of them
+            n = max(1, total // session_turns) if name.startswith("AI Doctor") else total
+            results.append(await _drive(name, client, fn, n, concurrency))
+    return results
+
+
+def print_route_latency() -> Dict[str, Any]:
+    """Per-provider latency and failure streaks as seen by the LLM router."""
+    from llm_router import ROUTES
+
+    snapshot = {name: router.snapshot() for name, router in ROUTES.items()}
+    print("\n=== LLM routes ===")
+    for name, targets in snapshot.items():
+        for t in targets:
+            print(f"{name:<10} {t['target']:<38} n={t['samples']:<6} p50={t['p50_ms']} p95={t['p95_ms']} "
+                  f"failures={t['consecutive_failures']}")
+    return snapshot
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────────
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline DoctorX Care benchmark suite")
+    parser.add_argument("mode", choices=["micro", "encoding", "load", "priority", "all"], nargs="?", default="all")
+    parser.add_argument("--iterations", type=int, default=200, help="Microbenchmark iterations")
+    parser.add_argument("--readings", type=int, default=500, help="Readings per metric in tracking payloads")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per load scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--session-turns", type=int, default=6)
+    parser.add_argument("--gemini-latency-ms", type=float, default=0.0)
+    parser.add_argument("--groq-latency-ms", type=float, default=0.0)
+    parser.add_argument("--places-latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected failure probability for every provider")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--cassette", help="Replay provider traffic from this recorded cassette instead of the fakes")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for recorded cassette latencies")
+    parser.add_argument("--json", dest="json_path", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this saved baseline; exit 1 on regression")
+    parser.add_argument("--save-baseline", help="Store this run's results as a baseline file")
+    parser.add_argument("--regression-metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown over the baseline, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Slowdowns smaller than this never count")
+    args = parser.parse_args(argv)
+
+    def cfg(latency):
+        return FakeProviderConfig(latency_ms=latency, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed)
+
+    report: Dict[str, Any] = {"generated_at": datetime.now().isoformat(), "config": vars(args)}
+
+    if args.cassette:
+        # Load payloads vary per request, so fall back to any response from the same endpoint
+        providers = install_cassette(args.cassette, "replay", args.latency_scale, match="endpoint")
+    else:
+        providers = install_fake_providers(
+            gemini=cfg(args.gemini_latency_ms),
+            groq=cfg(args.groq_latency_ms),
+            places=cfg(args.places_latency_ms),
+        )
+
+    with providers:
+        if args.mode in ("micro", "all"):
+            report["micro"] = run_microbenchmarks(args.iterations, args.readings)
+            print_report("Microbenchmarks", report["micro"])
+        if args.mode in ("encoding", "all"):
+            report["encoding"] = run_encoding_benchmarks(args.iterations)
+            print_encoding_report(report["encoding"])
+        if args.mode in ("load", "all"):
+            report["load"] = asyncio.run(run_load_scenarios(
+                args.requests, args.concurrency, args.session_turns, min(args.readings, 200),
+            ))
+            print_report(f"Load (concurrency={args.concurrency})", report["load"])
+            report["llm_routes"] = print_route_latency()
+        if args.mode in ("priority", "all"):
+            report["priority"] = asyncio.run(run_priority_scenario(args.concurrency))
+            print_report(f"Admission wait by priority (concurrency={args.concurrency})", report["priority"])
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.json_path}")
+    if args.save_baseline:
+        save_baseline(args.save_baseline, report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare_to_baseline(report, baseline, args.regression_metric, args.tolerance, args.min_delta_ms)
+        print_comparison(rows, args.regression_metric)
+        regressed = [r for r in rows if r["regressed"]]
+        if not rows:
+            print("\nNo scenarios in common with the baseline.")
+            return 1
+        if regressed:
+            print(f"\n{len(regressed)} scenario(s) regressed beyond {args.tolerance:.0%} of the baseline.")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,551 @@
+"""
+Streaming import of wearable and health-app exports into the vitals store.
+
+Exports can be hundreds of megabytes, so nothing is materialised: the
+uploaded file is read incrementally, each record is mapped to one of the
+service's vital types and normalised to its canonical unit
+(``vitals_store.CANONICAL_UNITS``), and rows are written in batches of
+IMPORT_BATCH_SIZE. Memory use stays flat regardless of file size.
+
+Supported inputs (``fmt="auto"`` sniffs them):
+- Apple Health ``export.xml``, or the ``export.zip`` that contains it,
+  parsed with ``lxml.etree.iterparse``, clearing each element once read;
+- CSV exports (Google Fit, Samsung Health, glucometer software such as
+  LibreView), in wide form (a column per vital) or long form
+  (type/value/unit columns); metadata lines above the header are skipped,
+  and a zip of CSVs is read member by member.
+
+Progress (bytes read, records imported, skip reasons) is published through
+``jobs.report_progress`` after every batch.
+
+Configuration:
+    IMPORT_BATCH_SIZE   rows per store transaction (default 5000)
+"""
+
+import io
+import os
+import re
+import csv
+import time
+import zipfile
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Callable, IO
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from jobs import report_progress
+from vitals_store import STORE, VitalsStore, Row, CANONICAL_UNITS, to_ts, to_iso
+
+try:
+    from lxml import etree
+except ImportError:   # stdlib fallback; slower, same results
+    import xml.etree.ElementTree as etree
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+
+IMPORT_RECORDS = REGISTRY.counter(
+    "doctorx_import_records_total", "Records read from bulk imports by outcome.", ("format", "result"),
+)
+IMPORT_DURATION = REGISTRY.histogram(
+    "doctorx_import_duration_seconds", "Wall time of a bulk import.", ("format",),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+# Plausible ranges in canonical units; anything outside is a device or typing error
+_VALID_RANGES = {
+    "blood_glucose": (10.0, 1000.0),
+    "heart_rate": (20.0, 300.0),
+    "systolic": (50.0, 300.0),
+    "diastolic": (20.0, 200.0),
+    "weight": (2.0, 500.0),
+    "oxygen_saturation": (50.0, 100.0),
+}
+
+_MGDL_PER_MMOL_GLUCOSE = 18.0
+_KG_PER_LB = 0.45359237
+_KG_PER_STONE = 6.35029318
+
+
+class ImportFormatError(ValueError):
+    """The upload isn't a supported export."""
+
+
+# ── Units ────────────────────────────────────────────────────────────────────
+
+def normalize(metric: str, value: float, unit: Optional[str]) -> Tuple[Optional[float], str]:
+    """
+    Convert ``value`` to the metric's canonical unit. Returns ``(value, reason)``;
+    value is None when the unit is unknown or the result is implausible.
+    """
+    u = (unit or "").strip().lower().replace(" ", "")
+    if metric == "blood_glucose":
+        if u.startswith("mmol"):        # Apple writes "mmol<180.1558800000541>/L"
+            value *= _MGDL_PER_MMOL_GLUCOSE
+        elif u not in ("", "mg/dl", "mg/100ml"):
+            return None, "unsupported_unit"
+    elif metric == "weight":
+        if u in ("lb", "lbs", "pound", "pounds"):
+            value *= _KG_PER_LB
+        elif u == "g":
+            value /= 1000.0
+        elif u == "st":
+            value *= _KG_PER_STONE
+        elif u not in ("", "kg", "kgs"):
+            return None, "unsupported_unit"
+    elif metric == "oxygen_saturation":
+        if value <= 1.0:                # Apple stores SpO2 as a fraction
+            value *= 100.0
+    elif metric == "heart_rate":
+        if u not in ("", "bpm", "count/min", "beats/min", "/min"):
+            return None, "unsupported_unit"
+    elif metric in ("systolic", "diastolic"):
+        if u not in ("", "mmhg"):
+            return None, "unsupported_unit"
+
+    low, high = _VALID_RANGES.get(metric, (float("-inf"), float("inf")))
+    if not low <= value <= high:
+        return None, "out_of_range"
+    return round(value, 2), "ok"
+
+
+# ── Dates ────────────────────────────────────────────────────────────────────
+
+_DAY_FIRST_FORMATS = (
+    "%d-%m-%Y %H:%M", "%d/%m/%Y %H:%M", "%d.%m.%Y %H:%M",
+    "%d-%m-%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d.%m.%Y %H:%M:%S",
+    "%d/%m/%Y %I:%M %p", "%d-%m-%Y %I:%M %p",
+    "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y",
+)
+_MONTH_FIRST_FORMATS = (
+    "%m-%d-%Y %H:%M", "%m/%d/%Y %H:%M",
+    "%m-%d-%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %I:%M %p", "%m-%d-%Y %I:%M %p",
+    "%m-%d-%Y", "%m/%d/%Y",
+)
+_COMMON_FORMATS = ("%Y/%m/%d %H:%M:%S", "%Y/%m/%d %H:%M", "%Y/%m/%d", "%Y-%m-%d %H:%M:%S %z", "%Y%m%d")
+
+
+class DateParser:
+    """Parses the date formats found in exports; remembers the last format that worked."""
+
+    def __init__(self, dayfirst: bool = True):
+        self.formats = _COMMON_FORMATS + (_DAY_FIRST_FORMATS + _MONTH_FIRST_FORMATS if dayfirst
+                                          else _MONTH_FIRST_FORMATS + _DAY_FIRST_FORMATS)
+        self._last: Optional[str] = None
+
+    def __call__(self, text: str) -> Optional[int]:
+        text = text.strip()
+        if not text:
+            return None
+        if text.isdigit() and len(text) in (10, 13):
+            # Unix time (Samsung exports milliseconds); shown in server-local wall-clock time
+            seconds = int(text) / (1000 if len(text) == 13 else 1)
+            return to_ts(datetime.fromtimestamp(seconds))
+        if self._last:
+            try:
+                return to_ts(datetime.strptime(text, self._last))
+            except ValueError:
+                pass
+        try:
+            return to_ts(datetime.fromisoformat(text.replace("Z", "+00:00")))
+        except ValueError:
+            pass
+        for fmt in self.formats:
+            try:
+                dt = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            self._last = fmt
+            return to_ts(dt)
+        return None
+
+
+# ── Byte counting ────────────────────────────────────────────────────────────
+
+class _CountingReader(io.RawIOBase):
+    """Wraps a binary stream and counts the bytes read, for progress reporting."""
+
+    def __init__(self, raw: IO[bytes]):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.raw.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self.bytes_read += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+# ── Importer ─────────────────────────────────────────────────────────────────
+
+class _Batcher:
+    """Accumulates rows, writes them in batches and publishes progress."""
+
+    def __init__(self, patient_id: str, fmt: str, store: VitalsStore, batch_size: int,
+                 total_bytes: int, progress: Callable[..., None]):
+        self.patient_id = patient_id
+        self.fmt = fmt
+        self.store = store
+        self.batch_size = batch_size
+        self.total_bytes = total_bytes
+        self.progress = progress
+        self.rows: List[Row] = []
+        self.records = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.skipped: Dict[str, int] = {}
+        self.metrics: Dict[str, int] = {}
+        self.first_ts: Optional[int] = None
+        self.last_ts: Optional[int] = None
+        self.reader: Optional[_CountingReader] = None
+        self.bytes_done = 0      # bytes of earlier zip members / files
+
+    def skip(self, reason: str) -> None:
+        self.records += 1
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def add(self, metric: str, ts: Optional[int], value: Optional[float], unit: Optional[str],
+            context: Optional[str] = None) -> None:
+        if ts is None:
+            return self.skip("bad_date")
+        if value is None:
+            return self.skip("bad_value")
+        value, reason = normalize(metric, value, unit)
+        if value is None:
+            return self.skip(reason)
+        self.records += 1
+        self.rows.append((self.patient_id, metric, ts, value, CANONICAL_UNITS.get(metric, unit), context, self.fmt))
+        self.metrics[metric] = self.metrics.get(metric, 0) + 1
+        self.first_ts = ts if self.first_ts is None else min(self.first_ts, ts)
+        self.last_ts = ts if self.last_ts is None else max(self.last_ts, ts)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.rows:
+            inserted = self.store.write_batch(self.rows, source=self.fmt)
+            self.imported += inserted
+            self.duplicates += len(self.rows) - inserted
+            self.rows = []
+        self.publish()
+
+    def publish(self) -> None:
+        done = self.bytes_done + (self.reader.bytes_read if self.reader else 0)
+        self.progress(
+            bytes_read=done,
+            total_bytes=self.total_bytes,
+            percent=round(100.0 * min(done, self.total_bytes) / self.total_bytes, 1) if self.total_bytes else None,
+            records_seen=self.records,
+            imported=self.imported,
+            duplicates=self.duplicates,
+            skipped=dict(self.skipped),
+        )
+
+
+# ── Apple Health ─────────────────────────────────────────────────────────────
+
+_APPLE_TYPES = {
+    "HKQuantityTypeIdentifierHeartRate": ("heart_rate", None),
+    "HKQuantityTypeIdentifierRestingHeartRate": ("heart_rate", "Resting"),
+    "HKQuantityTypeIdentifierBloodGlucose": ("blood_glucose", None),
+    "HKQuantityTypeIdentifierOxygenSaturation": ("oxygen_saturation", None),
+    "HKQuantityTypeIdentifierBodyMass": ("weight", None),
+    "HKQuantityTypeIdentifierBloodPressureSystolic": ("systolic", None),
+    "HKQuantityTypeIdentifierBloodPressureDiastolic": ("diastolic", None),
+}
+
+# HKBloodGlucoseMealTime metadata values
+_APPLE_MEAL_TIME = {"1": "Before meal", "2": "Post-meal"}
+
+
+def _apple_ts(text: Optional[str]) -> Optional[int]:
+    # "2025-01-20 08:00:00 +0530": keep the wall-clock part
+    if not text or len(text) < 19:
+        return None
+    try:
+        return to_ts(datetime.fromisoformat(text[:19]))
+    except ValueError:
+        return None
+
+
+def _import_apple(stream: IO[bytes], batcher: _Batcher) -> None:
+    if hasattr(etree, "XMLParser") and hasattr(etree, "LXML_VERSION"):
+        events = etree.iterparse(stream, events=("end",), tag="Record",
+                                 resolve_entities=False, no_network=True, huge_tree=True)
+    else:
+        events = etree.iterparse(stream, events=("end",))
+
+    for _, elem in events:
+        if elem.tag != "Record":
+            continue
+        mapped = _APPLE_TYPES.get(elem.get("type"))
+        if mapped is None:
+            batcher.skip("unsupported_type")
+        else:
+            metric, context = mapped
+            if metric == "blood_glucose":
+                for entry in elem.iter("MetadataEntry"):
+                    if entry.get("key") == "HKBloodGlucoseMealTime":
+                        context = _APPLE_MEAL_TIME.get(entry.get("value"), context)
+            try:
+                value = float(elem.get("value"))
+            except (TypeError, ValueError):
+                value = None
+            batcher.add(metric, _apple_ts(elem.get("startDate")), value, elem.get("unit"), context)
+
+        # Free the element and everything already read before it
+        elem.clear()
+        if hasattr(elem, "getprevious"):
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        if batcher.records % 50000 == 0:
+            batcher.publish()
+
+
+# ── CSV ──────────────────────────────────────────────────────────────────────
+
+_METRIC_PATTERNS = (
+    ("systolic", re.compile(r"systolic|\bsys\b")),
+    ("diastolic", re.compile(r"diastolic|\bdia\b")),
+    ("blood_glucose", re.compile(r"glucose|blood ?sugar|\bbg\b")),
+    ("oxygen_saturation", re.compile(r"spo2|oxygen|saturation")),
+    ("heart_rate", re.compile(r"heart ?rate|heart_rate|pulse|\bbpm\b|\bhr\b")),
+    ("weight", re.compile(r"weight|body ?mass")),
+)
+_DATE_HEADER = re.compile(r"timestamp|date|start_?time|start time|datetime|\btime\b")
+_TIME_ONLY_HEADER = re.compile(r"^time$")
+_CONTEXT_HEADER = re.compile(r"context|meal|measurement ?time|\btag\b")
+_TYPE_HEADER = re.compile(r"^(type|metric|data ?type|record ?type|measurement)$")
+_VALUE_HEADER = re.compile(r"^(value|reading|result)$")
+_UNIT_HEADER = re.compile(r"^units?$")
+_AGGREGATE_HEADER = re.compile(r"\b(max|min|maximum|minimum)\b")
+_UNIT_IN_HEADER = re.compile(r"\(([^)]+)\)|\b(mg/dl|mmol/l|kg|lbs?|bpm|mmhg|%)")
+
+_HEADER_SEARCH_ROWS = 5
+
+
+def _match_metric(text: str) -> Optional[str]:
+    for metric, pattern in _METRIC_PATTERNS:
+        if pattern.search(text):
+            return metric
+    return None
+
+
+def _header_unit(header: str) -> Optional[str]:
+    m = _UNIT_IN_HEADER.search(header)
+    if not m:
+        return None
+    return (m.group(1) or m.group(2)).strip()
+
+
+class _CsvLayout:
+    """Which column holds what, worked out from the header row."""
+
+    def __init__(self, header: List[str]):
+        lowered = [h.strip().lower() for h in header]
+        self.date_col: Optional[int] = None
+        self.time_col: Optional[int] = None
+        self.context_col: Optional[int] = None
+        self.type_col: Optional[int] = None
+        self.value_col: Optional[int] = None
+        self.unit_col: Optional[int] = None
+        # metric -> [(column, unit from header)]
+        self.value_cols: Dict[str, List[Tuple[int, Optional[str]]]] = {}
+
+        for i, h in enumerate(lowered):
+            if _TIME_ONLY_HEADER.match(h) and self.date_col is not None:
+                self.time_col = i
+            elif self.date_col is None and _DATE_HEADER.search(h) and not _match_metric(h):
+                self.date_col = i
+            elif _TYPE_HEADER.match(h):
+                self.type_col = i
+            elif _VALUE_HEADER.match(h):
+                self.value_col = i
+            elif _UNIT_HEADER.match(h):
+                self.unit_col = i
+            elif self.context_col is None and _CONTEXT_HEADER.search(h) and not _match_metric(h):
+                self.context_col = i
+            elif not _AGGREGATE_HEADER.search(h):
+                metric = _match_metric(h)
+                if metric:
+                    self.value_cols.setdefault(metric, []).append((i, _header_unit(h)))
+
+    @property
+    def long_form(self) -> bool:
+        return self.type_col is not None and self.value_col is not None
+
+    @property
+    def usable(self) -> bool:
+        return self.date_col is not None and (self.long_form or bool(self.value_cols))
+
+
+def _cell(row: List[str], i: Optional[int]) -> str:
+    return row[i].strip() if i is not None and i < len(row) else ""
+
+
+def _number(text: str) -> Optional[float]:
+    try:
+        return float(text.replace(",", "")) if text else None
+    except ValueError:
+        return None
+
+
+def _import_csv(stream: IO[bytes], batcher: _Batcher, dayfirst: bool) -> None:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    sample = text.read(8192)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(_chain(sample, text), dialect)
+
+    layout = None
+    for _ in range(_HEADER_SEARCH_ROWS):
+        header = next(reader, None)
+        if header is None:
+            break
+        candidate = _CsvLayout(header)
+        if candidate.usable:
+            layout = candidate
+            break
+    if layout is None:
+        raise ImportFormatError("No date column and recognisable vital columns found in the CSV header.")
+
+    parse_date = DateParser(dayfirst)
+    for row in reader:
+        if not row:
+            continue
+        date_text = _cell(row, layout.date_col)
+        if layout.time_col is not None:
+            date_text = f"{date_text} {_cell(row, layout.time_col)}"
+        ts = parse_date(date_text)
+        context = _cell(row, layout.context_col) or None
+
+        if layout.long_form:
+            metric = _match_metric(_cell(row, layout.type_col).lower())
+            if metric is None:
+                batcher.skip("unsupported_type")
+                continue
+            batcher.add(metric, ts, _number(_cell(row, layout.value_col)), _cell(row, layout.unit_col) or None, context)
+            continue
+
+        for metric, columns in layout.value_cols.items():
+            # Several columns can hold one vital (e.g. LibreView's historic/scan/strip glucose)
+            for col, unit in columns:
+                value = _number(_cell(row, col))
+                if value is not None:
+                    batcher.add(metric, ts, value, unit or _cell(row, layout.unit_col) or None, context)
+                    break
+
+
+def _chain(sample: str, rest: IO[str]) -> Iterator[str]:
+    """Lines of ``sample`` followed by the rest of the stream, without re-reading."""
+    buffered = io.StringIO(sample + rest.readline())
+    yield from buffered
+    yield from rest
+
+
+# ── Entry point ──────────────────────────────────────────────────────────────
+
+def detect_format(head: bytes, filename: str = "") -> str:
+    lowered = head.lstrip(b"\xef\xbb\xbf \t\r\n")[:4096].lower()
+    if lowered.startswith(b"<?xml") or b"<healthdata" in lowered:
+        return "apple_health"
+    if filename.lower().endswith(".xml"):
+        return "apple_health"
+    return "csv"
+
+
+def _import_stream(raw: IO[bytes], name: str, fmt: str, batcher: _Batcher, dayfirst: bool) -> str:
+    batcher.reader = _CountingReader(raw)
+    stream = io.BufferedReader(batcher.reader, buffer_size=1024 * 1024)
+    if fmt == "auto":
+        fmt = detect_format(stream.peek(4096), name)
+    batcher.fmt = fmt
+    if fmt == "apple_health":
+        _import_apple(stream, batcher)
+    elif fmt == "csv":
+        _import_csv(stream, batcher, dayfirst)
+    else:
+        raise ImportFormatError(f"Unsupported import format '{fmt}'.")
+    return fmt
+
+
+def import_file(
+    path: str,
+    patient_id: str,
+    fmt: str = "auto",
+    dayfirst: bool = True,
+    filename: str = "",
+    store: VitalsStore = STORE,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Callable[..., None] = report_progress,
+) -> Dict[str, Any]:
+    """
+    Stream an export file into the vitals store and return a summary.
+
+    Raises:
+        ImportFormatError: If the file isn't a supported export.
+    """
+    start = time.perf_counter()
+    total_bytes = os.path.getsize(path)
+    batcher = _Batcher(patient_id, fmt, store, batch_size, total_bytes, progress)
+    formats = []
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = [m for m in archive.infolist() if not m.is_dir()]
+            apple = [m for m in members if os.path.basename(m.filename) == "export.xml"]
+            # Apple's zip also has export_cda.xml and GPX routes; only export.xml has Records
+            members = apple or [m for m in members if m.filename.lower().endswith(".csv")]
+            if not members:
+                raise ImportFormatError("The zip contains no export.xml or CSV files.")
+            total_uncompressed = sum(m.file_size for m in members)
+            batcher.total_bytes = total_uncompressed
+            for member in members:
+                with archive.open(member) as raw:
+                    try:
+                        formats.append(_import_stream(raw, member.filename, fmt, batcher, dayfirst))
+                    except ImportFormatError:
+                        if len(members) == 1:
+                            raise
+                        batcher.skip("unreadable_file")   # one odd CSV shouldn't sink the archive
+                batcher.bytes_done += member.file_size
+                batcher.reader = None
+    else:
+        with open(path, "rb") as raw:
+            formats.append(_import_stream(raw, filename, fmt, batcher, dayfirst))
+
+    batcher.flush()
+    resolved = formats[0] if len(set(formats)) == 1 else "mixed"
+    seconds = time.perf_counter() - start
+    IMPORT_DURATION.observe(seconds, format=resolved)
+    IMPORT_RECORDS.inc(batcher.imported, format=resolved, result="imported")
+    IMPORT_RECORDS.inc(batcher.duplicates, format=resolved, result="duplicate")
+    IMPORT_RECORDS.inc(sum(batcher.skipped.values()), format=resolved, result="skipped")
+
+    return {
+        "patient_id": patient_id,
+        "format": resolved,
+        "records_seen": batcher.records,
+        "imported": batcher.imported,
+        "duplicates": batcher.duplicates,
+        "skipped": batcher.skipped,
+        "metrics": batcher.metrics,
+        "first_date": to_iso(batcher.first_ts) if batcher.first_ts is not None else None,
+        "last_date": to_iso(batcher.last_ts) if batcher.last_ts is not None else None,
+        "bytes": total_bytes,
+        "seconds": round(seconds, 2),
+    }
@@ -0,0 +1,211 @@
+"""
+Deadlines and client-disconnect cancellation for in-flight provider work.
+
+A request that runs an LLM or Places call is supervised while it waits:
+if the client goes away, or the request outlives its deadline, the work is
+either cancelled or — when it has somewhere useful to go, such as a job id
+a retry can pick up — detached and left to finish. Detached work gets a
+fresh deadline of REQUEST_DEADLINE_SECONDS from that moment, so its later
+provider calls are not refused for the deadline of the request it left.
+
+Async work (Places) is cancelled outright. Provider SDK calls are
+blocking and run in a thread, so they cannot be interrupted mid-flight;
+instead the thread's ``WorkScope`` is marked and every provider call
+checks it first (``check_cancelled``), so failover attempts, hedges and
+later turns are never started. ``remaining_timeout`` caps per-call
+timeouts at whatever is left of the deadline.
+
+Clients may shorten their deadline with an ``X-Request-Timeout: <seconds>``
+header; it can never exceed the server's own.
+
+Configuration:
+    REQUEST_DEADLINE_SECONDS   longest a request may wait on provider work (default 120)
+"""
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from typing import Optional, Any, Callable, Awaitable
+
+from dotenv import load_dotenv
+from starlette.requests import Request
+
+from telemetry import REGISTRY, attach_thread
+
+load_dotenv()
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+
+ABANDONED_REQUESTS = REGISTRY.counter(
+    "doctorx_abandoned_requests_total",
+    "Requests whose provider work was abandoned before it finished, by what happened to the work.",
+    ("kind", "reason", "outcome"),
+)
+CANCELLED_CALLS = REGISTRY.counter(
+    "doctorx_cancelled_provider_calls_total", "Provider calls skipped or aborted because their request was abandoned.",
+    ("provider", "reason"),
+)
+
+
+class RequestAbandoned(Exception):
+    """The client disconnected, or the request ran past its deadline."""
+
+    def __init__(self, reason: str):
+        self.reason = reason   # "disconnect" | "deadline"
+        super().__init__(
+            "Request deadline exceeded." if reason == "deadline" else "Client disconnected."
+        )
+
+
+class WorkScope:
+    """Deadline and cancellation flag shared by a request and the work it started."""
+
+    def __init__(self, deadline_seconds: float):
+        self.deadline = time.monotonic() + deadline_seconds
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason: str) -> None:
+        self.reason = reason
+        self._cancelled.set()
+
+    def restart(self, deadline_seconds: float) -> None:
+        """Start a new deadline, for work that carries on without its request."""
+        self.deadline = time.monotonic() + deadline_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def abandoned_reason(self) -> Optional[str]:
+        if self._cancelled.is_set():
+            return self.reason
+        if self.remaining() <= 0:
+            return "deadline"
+        return None
+
+
+_scope: contextvars.ContextVar[Optional[WorkScope]] = contextvars.ContextVar("work_scope", default=None)
+
+
+def check_cancelled(provider: str) -> None:
+    """
+    Call before starting a provider call; a no-op outside a supervised request.
+
+    Raises:
+        RequestAbandoned: If the request has been abandoned.
+    """
+    scope = _scope.get()
+    reason = scope.abandoned_reason() if scope else None
+    if reason:
+        CANCELLED_CALLS.inc(provider=provider, reason=reason)
+        raise RequestAbandoned(reason)
+
+
+def remaining_timeout(provider: str, default: float) -> float:
+    """``default`` capped at the time left before the request's deadline."""
+    check_cancelled(provider)
+    scope = _scope.get()
+    if scope is None:
+        return default
+    return max(0.1, min(default, scope.remaining()))
+
+
+def request_deadline(request: Request) -> float:
+    """Seconds this request may wait on provider work."""
+    try:
+        requested = float(request.headers.get("x-request-timeout", ""))
+    except ValueError:
+        return REQUEST_DEADLINE_SECONDS
+    return min(REQUEST_DEADLINE_SECONDS, requested) if requested > 0 else REQUEST_DEADLINE_SECONDS
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body has already been read, so the next message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _discard(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+
+async def _supervise(
+    request: Request,
+    kind: str,
+    work: asyncio.Future,
+    scope: WorkScope,
+    detach: Optional[Callable[[asyncio.Future], Any]],
+    provider: Optional[str] = None,
+) -> Any:
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({work, watcher}, timeout=scope.remaining(), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if work in done:
+        return work.result()
+
+    reason = "disconnect" if watcher in done else "deadline"
+    if detach is not None:
+        scope.restart(REQUEST_DEADLINE_SECONDS)
+        ABANDONED_REQUESTS.inc(kind=kind, reason=reason, outcome="detached")
+        return detach(work)
+
+    scope.cancel(reason)
+    # Async work stops here; a thread stops at its next provider call
+    if work.cancel() and provider:
+        CANCELLED_CALLS.inc(provider=provider, reason=reason)
+    work.add_done_callback(_discard)
+    ABANDONED_REQUESTS.inc(kind=kind, reason=reason, outcome="cancelled")
+    raise RequestAbandoned(reason)
+
+
+async def run_in_thread(
+    request: Request,
+    kind: str,
+    fn: Callable[..., Any],
+    *args: Any,
+    detach: Optional[Callable[[asyncio.Future], Any]] = None,
+) -> Any:
+    """
+    Run blocking ``fn(*args)`` in a thread while watching for disconnect and
+    the request deadline. On abandonment the work is handed to ``detach``
+    (whose return value becomes the response) or, without one, cancelled.
+
+    Raises:
+        RequestAbandoned: If the work was cancelled.
+    """
+    scope = WorkScope(request_deadline(request))
+
+    def scoped() -> Any:
+        token = _scope.set(scope)
+        try:
+            with attach_thread():
+                return fn(*args)
+        finally:
+            _scope.reset(token)
+
+    work = asyncio.ensure_future(asyncio.to_thread(scoped))
+    return await _supervise(request, kind, work, scope, detach)
+
+
+async def run_task(request: Request, kind: str, provider: str, awaitable: Awaitable[Any]) -> Any:
+    """
+    Await ``awaitable`` (a ``provider`` call) as a task that is cancelled if
+    the client disconnects or the deadline passes.
+
+    Raises:
+        RequestAbandoned: If the task was cancelled.
+    """
+    scope = WorkScope(request_deadline(request))
+    token = _scope.set(scope)
+    try:
+        work = asyncio.ensure_future(awaitable)
+    finally:
+        _scope.reset(token)
+    return await _supervise(request, kind, work, scope, None, provider)
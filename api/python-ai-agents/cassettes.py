@@ -0,0 +1,582 @@
+"""
+Record/replay of provider HTTP traffic (Gemini, Groq, Google Places).
+
+In ``record`` mode every provider request goes to the live API as usual and
+the exchange is appended to a cassette file, with its latency. In
+``replay`` mode nothing leaves the process: requests are answered from the
+cassette after sleeping for the recorded latency (optionally scaled), so a
+slow or broken consultation or report scan can be reproduced, profiled and
+used as a performance regression test without keys or quota.
+
+Traffic is captured at the HTTP layer, below the SDKs:
+- Places: ``DoctorFinder.http_transport``;
+- Groq (AI Doctor turns, and phi agents routed to Groq): an httpx client
+  handed to the Groq SDK;
+- Gemini (phi agents and AI Doctor fallback): the SDK is switched to its
+  REST transport and its ``requests`` session gets a cassette adapter.
+
+Redaction — cassettes may be shared, so before anything is written:
+- API keys (``key`` query parameter, auth headers) are dropped; only the
+  response content type is kept from the headers;
+- request bodies keep their structure, numbers and protocol fields
+  (role, model, mime type...) but every other string — prompts, patient
+  messages, images — is replaced by a keyed digest (HMAC), as is the
+  patient's location in Places queries;
+- Gemini/Groq responses have patient identifiers (``patient_name``...,
+  including inside JSON returned as text), e-mail addresses, phone and
+  ID numbers and "Patient: ..." labels masked. Places responses describe public facilities and are
+  kept as they are.
+
+Requests are matched on a digest of the *unredacted* method, path, query
+and body, so replaying the same inputs finds the same answer; repeats are
+served in recorded order and then cycle. Volatile fields the server puts
+into prompts itself (the "Analysis Date" stamp of tracking analyses) are
+replaced by a placeholder before hashing, or no replay would ever match.
+
+Every digest written to a cassette — masks and the per-request match
+digest, which covers the unredacted query including the location — is an
+HMAC under PROVIDER_CASSETTE_KEY, so short values such as a "lat,lng"
+can't be recovered by hashing guesses. Recording and replaying therefore
+require the key, and the same key: each interaction stores a key id, and
+a cassette recorded under another key is refused on load.
+
+Explicit Gemini prompt caches (prompt_cache.py) are turned off while a
+cassette is installed. The caching client doesn't use the patched
+transport, and a request that references a cache by name would only
+match for as long as that cache lived.
+
+With ``PROVIDER_CASSETTE_MATCH=endpoint`` a request with no exact match gets the next recorded response
+for the same provider endpoint instead, which lets load tests with varied
+payloads replay a small cassette.
+
+Configuration:
+    PROVIDER_CASSETTE_MODE           off | record | replay     (default off)
+    PROVIDER_CASSETTE_PATH           cassette file, JSON lines (default provider_cassette.jsonl)
+    PROVIDER_CASSETTE_LATENCY_SCALE  replay latency multiplier; 0 = no delay (default 1)
+    PROVIDER_CASSETTE_MATCH          exact | endpoint          (default exact)
+    PROVIDER_CASSETTE_REDACT_KEYS    extra JSON keys to mask in responses (comma-separated)
+    PROVIDER_CASSETTE_KEY            long random secret for the digests in cassettes
+                                     (required to record or replay)
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import hmac
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import httpx
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+PROVIDER_CASSETTE_MODE = os.getenv("PROVIDER_CASSETTE_MODE", "off").lower()
+PROVIDER_CASSETTE_PATH = os.getenv("PROVIDER_CASSETTE_PATH", "provider_cassette.jsonl")
+PROVIDER_CASSETTE_LATENCY_SCALE = float(os.getenv("PROVIDER_CASSETTE_LATENCY_SCALE", "1"))
+PROVIDER_CASSETTE_MATCH = os.getenv("PROVIDER_CASSETTE_MATCH", "exact").lower()
+PROVIDER_CASSETTE_KEY = os.getenv("PROVIDER_CASSETTE_KEY", "").encode("utf-8")
+
+MODES = ("off", "record", "replay")
+
+CASSETTE_INTERACTIONS = REGISTRY.counter(
+    "doctorx_cassette_interactions_total", "Provider requests recorded or replayed.",
+    ("provider", "result"),
+)
+
+# Placeholder credentials so SDK clients can be built for replay without keys
+REPLAY_API_KEY = "cassette-replay"
+# Keys the agent factories insist on; set to the placeholder while replaying if missing
+REPLAY_KEY_VARS = ("LAB_SERVICE_API_KEY", "TRACKING_SERVICE_API_KEY", "GROQ_API_KEY")
+
+GEMINI_HOST = "generativelanguage.googleapis.com"
+
+
+class CassetteMiss(RuntimeError):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+# ── Redaction ────────────────────────────────────────────────────────────────
+
+SECRET_PARAMS = {"key", "api_key"}
+# Query parameters that identify the patient (Places searches around them)
+PHI_PARAMS = {"location"}
+# Request fields whose values are protocol, not content, and are kept
+PROTOCOL_KEYS = {
+    "role", "model", "type", "mime_type", "mimeType", "response_mime_type",
+    "responseMimeType", "response_format", "tool_choice", "name",
+}
+PHI_KEYS = {"patient_name", "patient_id", "patient", "email", "phone", "address", "dob", "date_of_birth"}
+PHI_KEYS |= {k.strip() for k in os.getenv("PROVIDER_CASSETTE_REDACT_KEYS", "").split(",") if k.strip()}
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Phone numbers (10 digits, optional country code) and 12-digit IDs such as Aadhaar;
+# dates and readings are left alone
+_NUMBER_RE = re.compile(r"(?<![\w.-])(?:\+\d{1,3}[\s-]?)?(?:\d{5}[\s-]?\d{5}|\d{4}[\s-]?\d{4}[\s-]?\d{4})(?![\w.-])")
+
+
+def _digest(data: Any) -> str:
+    if not isinstance(data, bytes):
+        data = str(data).encode("utf-8")
+    return hmac.new(PROVIDER_CASSETTE_KEY, data, hashlib.sha256).hexdigest()
+
+
+def key_id() -> str:
+    """Short fingerprint of PROVIDER_CASSETTE_KEY, stored with each interaction."""
+    return _digest(b"doctorx-cassette-key")[:12]
+
+
+def _masked(value: str) -> str:
+    return f"<redacted {_digest(value)[:12]} len={len(value)}>"
+
+
+def _redact_request(value: Any, key: Optional[str] = None) -> Any:
+    """Keep structure, numbers and protocol fields; digest every other string."""
+    if isinstance(value, dict):
+        return {k: _redact_request(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact_request(v, key) for v in value]
+    if isinstance(value, str) and key not in PROTOCOL_KEYS:
+        return _masked(value)
+    return value
+
+
+# "Patient: Ravi Kumar" / "**Patient Name**: ..." lines in markdown reports
+_PATIENT_LABEL_RE = re.compile(r"(?i)(\bpatient(?:'s)?(?:\s+name)?\b\**\s*[:：]\s*\**\s*)[^\n,;|*]+")
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+def _scrub_text(text: str) -> str:
+    # Models often answer with JSON inside a text field, sometimes in a code fence
+    fenced = _FENCE_RE.match(text)
+    if fenced:
+        return "```json\n" + _scrub_text(fenced.group(1)) + "\n```"
+    stripped = text.strip()
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        try:
+            return json.dumps(_redact_response(json.loads(stripped)), ensure_ascii=False)
+        except ValueError:
+            pass
+    text = _PATIENT_LABEL_RE.sub(r"\1<name>", text)
+    return _NUMBER_RE.sub("<number>", _EMAIL_RE.sub("<email>", text))
+
+
+def _redact_response(value: Any) -> Any:
+    """Mask identifying fields and patterns in an LLM response body."""
+    if isinstance(value, dict):
+        return {
+            k: "<redacted>" if k in PHI_KEYS and v not in (None, "") else _redact_response(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact_response(v) for v in value]
+    if isinstance(value, str):
+        return _scrub_text(value)
+    return value
+
+
+def _redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [
+        (k, _masked(v) if k in PHI_PARAMS else v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in SECRET_PARAMS
+    ]
+    return parts._replace(query=urlencode(query)).geturl()
+
+
+def _json_or_none(body: bytes) -> Any:
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+# Values the server stamps into prompts that differ on every run
+VOLATILE_PATTERNS = (
+    # "**Analysis Date:** 2025-01-31 14:02:09" in tracking analysis prompts
+    (re.compile(r"(Analysis Date:\**\s*)\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)?"), r"\1<now>"),
+)
+
+
+def _stable(text: str) -> str:
+    for pattern, placeholder in VOLATILE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def match_key(method: str, url: str, body: bytes) -> str:
+    """
+    Digest identifying a request: method, path, query (without keys) and
+    body, with volatile fields replaced by placeholders.
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS)
+    parsed = _json_or_none(body)
+    if parsed is not None:
+        canonical = _stable(json.dumps(parsed, sort_keys=True, separators=(",", ":"))).encode("utf-8")
+    else:
+        canonical = body
+    return _digest(f"{method.upper()} {parts.path}?{urlencode(query)}\n".encode("utf-8") + canonical)
+
+
+# ── Cassette file ────────────────────────────────────────────────────────────
+
+def _endpoint(provider: str, method: str, url: str) -> Tuple[str, str, str]:
+    return provider, method.upper(), urlsplit(url).path
+
+
+class Cassette:
+    """
+    Append-only JSON-lines file of interactions. Each line is one exchange:
+    provider, method, redacted URL and request body, match digest, key id,
+    response status/content type/body and latency in milliseconds.
+    """
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0, match: str = "exact"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unsupported cassette mode '{mode}'. Allowed values: record, replay")
+        if not PROVIDER_CASSETTE_KEY:
+            raise ValueError(
+                "PROVIDER_CASSETTE_KEY must be set to record or replay a cassette; "
+                "its digests would otherwise be reversible for short values such as locations."
+            )
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.match = match
+        self._lock = threading.Lock()
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_endpoint: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+        self._cursors: Dict[Any, int] = {}
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item.get("key_id") != key_id():
+                    raise ValueError(
+                        f"{self.path} was recorded under a different PROVIDER_CASSETTE_KEY (or none); "
+                        "replay it with the key it was recorded with, or record it again."
+                    )
+                self._by_key.setdefault(item["match"], []).append(item)
+                self._by_endpoint.setdefault(_endpoint(item["provider"], item["method"], item["url"]), []).append(item)
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._by_key.values())
+
+    # ── Recording ────────────────────────────────────────────────────────────
+
+    def record(
+        self,
+        provider: str,
+        method: str,
+        url: str,
+        request_body: bytes,
+        status: int,
+        content_type: Optional[str],
+        response_body: bytes,
+        seconds: float,
+    ) -> None:
+        item: Dict[str, Any] = {
+            "provider": provider,
+            "method": method.upper(),
+            "url": _redact_url(url),
+            "match": match_key(method, url, request_body),
+            "key_id": key_id(),
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "latency_ms": round(seconds * 1000.0, 1),
+        }
+        parsed_request = _json_or_none(request_body)
+        if parsed_request is not None:
+            item["request"] = _redact_request(parsed_request)
+        elif request_body:
+            item["request"] = _masked(request_body.decode("utf-8", "replace"))
+
+        response: Dict[str, Any] = {"status": status, "content_type": content_type}
+        parsed_response = _json_or_none(response_body)
+        if parsed_response is not None:
+            response["json"] = parsed_response if provider == "places" else _redact_response(parsed_response)
+        else:
+            try:
+                text = response_body.decode("utf-8")
+                response["text"] = text if provider == "places" else _scrub_text(text)
+            except UnicodeDecodeError:
+                response["base64"] = base64.b64encode(response_body).decode("ascii")
+        item["response"] = response
+
+        line = json.dumps(item, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        CASSETTE_INTERACTIONS.inc(provider=provider, result="recorded")
+
+    # ── Replay ───────────────────────────────────────────────────────────────
+
+    def _next(self, cursor_key: Any, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        index = self._cursors.get(cursor_key, 0)
+        self._cursors[cursor_key] = index + 1
+        return items[index % len(items)]
+
+    def lookup(self, provider: str, method: str, url: str, request_body: bytes) -> Dict[str, Any]:
+        """
+        The recorded response for a request.
+
+        Raises:
+            CassetteMiss: If nothing was recorded for it.
+        """
+        key = match_key(method, url, request_body)
+        with self._lock:
+            if key in self._by_key:
+                CASSETTE_INTERACTIONS.inc(provider=provider, result="hit")
+                return self._next(key, self._by_key[key])
+            endpoint = _endpoint(provider, method, url)
+            if self.match == "endpoint" and endpoint in self._by_endpoint:
+                CASSETTE_INTERACTIONS.inc(provider=provider, result="endpoint")
+                return self._next(endpoint, self._by_endpoint[endpoint])
+        CASSETTE_INTERACTIONS.inc(provider=provider, result="miss")
+        raise CassetteMiss(
+            f"No recorded {provider} response for {method.upper()} {_redact_url(url)} in {self.path}"
+        )
+
+    def delay(self, item: Dict[str, Any]) -> float:
+        return item.get("latency_ms", 0.0) / 1000.0 * self.latency_scale
+
+
+def response_parts(item: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+    """Status, headers and body bytes of a recorded response."""
+    response = item["response"]
+    if "json" in response:
+        body = json.dumps(response["json"], ensure_ascii=False).encode("utf-8")
+    elif "text" in response:
+        body = response["text"].encode("utf-8")
+    else:
+        body = base64.b64decode(response.get("base64", ""))
+    headers = {"content-type": response["content_type"]} if response.get("content_type") else {}
+    return response["status"], headers, body
+
+
+# ── httpx transport (Groq, Places) ───────────────────────────────────────────
+
+class CassetteTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport that records through to ``inner`` or replays from the
+    cassette. Works with both sync (Groq SDK) and async (Places) clients.
+    """
+
+    def __init__(self, cassette: Cassette, provider: str, inner: Any = None):
+        self.cassette = cassette
+        self.provider = provider
+        self.inner = inner
+
+    def _recorded(self, request: httpx.Request, response: httpx.Response, seconds: float) -> httpx.Response:
+        self.cassette.record(
+            self.provider, request.method, str(request.url), request.content,
+            response.status_code, response.headers.get("content-type"), response.content, seconds,
+        )
+        # The body was decoded on read, so the content-encoding no longer applies
+        headers = {"content-type": response.headers["content-type"]} if "content-type" in response.headers else {}
+        return httpx.Response(response.status_code, headers=headers, content=response.content, request=request)
+
+    def _replayed(self, request: httpx.Request, item: Dict[str, Any]) -> httpx.Response:
+        status, headers, body = response_parts(item)
+        return httpx.Response(status, headers=headers, content=body, request=request)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        if self.cassette.mode == "replay":
+            item = self.cassette.lookup(self.provider, request.method, str(request.url), request.content)
+            time.sleep(self.cassette.delay(item))
+            return self._replayed(request, item)
+
+        if self.inner is None:
+            self.inner = httpx.HTTPTransport()
+        started = time.perf_counter()
+        response = self.inner.handle_request(request)
+        response.read()
+        return self._recorded(request, response, time.perf_counter() - started)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.cassette.mode == "replay":
+            item = self.cassette.lookup(self.provider, request.method, str(request.url), request.content)
+            await asyncio.sleep(self.cassette.delay(item))
+            return self._replayed(request, item)
+
+        started = time.perf_counter()
+        if self.inner is not None:
+            response = await self.inner.handle_async_request(request)
+            await response.aread()
+        else:
+            # DoctorFinder opens a client (and connection) per call; so does the recording
+            async with httpx.AsyncHTTPTransport() as inner:
+                response = await inner.handle_async_request(request)
+                await response.aread()
+        return self._recorded(request, response, time.perf_counter() - started)
+
+    def close(self) -> None:
+        # Shared across clients that close their transport on exit; nothing to release
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+# ── requests adapter (Gemini REST) ───────────────────────────────────────────
+
+def _requests_adapter(cassette: Cassette, provider: str):
+    """``requests`` adapter for the Gemini SDK's REST session (imported lazily)."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.structures import CaseInsensitiveDict
+
+    class CassetteAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            body = request.body or b""
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            if cassette.mode == "replay":
+                item = cassette.lookup(provider, request.method, request.url, body)
+                time.sleep(cassette.delay(item))
+                status, headers, content = response_parts(item)
+                response = requests.Response()
+                response.status_code = status
+                response.headers = CaseInsensitiveDict(headers)
+                response._content = content
+                response.encoding = "utf-8"
+                response.url = request.url
+                response.request = request
+                response.reason = "Replayed"
+                return response
+
+            started = time.perf_counter()
+            response = super().send(request, **kwargs)
+            cassette.record(
+                provider, request.method, request.url, body,
+                response.status_code, response.headers.get("content-type"), response.content,
+                time.perf_counter() - started,
+            )
+            return response
+
+    return CassetteAdapter()
+
+
+def _gemini_session_class(cassette: Cassette, original: type) -> type:
+    adapter = _requests_adapter(cassette, "gemini")
+
+    class CassetteSession(original):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.mount(f"https://{GEMINI_HOST}/", adapter)
+
+    return CassetteSession
+
+
+def _gemini_rest_modules() -> list:
+    modules = []
+    for version in ("v1beta", "v1"):
+        try:
+            module = __import__(
+                f"google.ai.generativelanguage_{version}.services.generative_service.transports.rest",
+                fromlist=["AuthorizedSession"],
+            )
+        except ImportError:
+            continue
+        modules.append(module)
+    return modules
+
+
+# ── Installation ─────────────────────────────────────────────────────────────
+
+def _patches(cassette: Cassette) -> list:
+    import ai_doctor_agent
+    import DoctorFinder
+    import llm_router
+    import prompt_cache
+    from groq import Groq
+
+    replay = cassette.mode == "replay"
+    groq_http = httpx.Client(transport=CassetteTransport(cassette, "groq"))
+    groq_key = REPLAY_API_KEY if replay else ai_doctor_agent.GROQ_API_KEY
+
+    gemini_options: Dict[str, Any] = {"client_params": {"transport": "rest"}}
+    groq_options: Dict[str, Any] = {"http_client": groq_http}
+    if replay:
+        gemini_options["client_params"]["api_key"] = REPLAY_API_KEY
+        groq_options["api_key"] = REPLAY_API_KEY
+
+    patches = [
+        (ai_doctor_agent, "groq_client", Groq(api_key=groq_key, http_client=groq_http)),
+        (llm_router, "GEMINI_MODEL_OPTIONS", gemini_options),
+        (llm_router, "GROQ_MODEL_OPTIONS", groq_options),
+        (DoctorFinder, "http_transport", CassetteTransport(cassette, "places")),
+        (prompt_cache, "PROMPT_CACHE", "off"),
+    ]
+    if replay and not DoctorFinder.GOOGLE_MAPS_API_KEY:
+        patches.append((DoctorFinder, "GOOGLE_MAPS_API_KEY", REPLAY_API_KEY))
+    for module in _gemini_rest_modules():
+        patches.append((module, "AuthorizedSession", _gemini_session_class(cassette, module.AuthorizedSession)))
+    return patches
+
+
+@contextmanager
+def install_cassette(
+    path: str = PROVIDER_CASSETTE_PATH,
+    mode: str = "replay",
+    latency_scale: float = PROVIDER_CASSETTE_LATENCY_SCALE,
+    match: str = PROVIDER_CASSETTE_MATCH,
+):
+    """
+    Route Gemini, Groq and Places traffic through a cassette, restoring the
+    live clients on exit. Yields the ``Cassette``.
+    """
+    cassette = Cassette(path, mode, latency_scale, match)
+    patches = _patches(cassette)
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    placeholders = _set_replay_keys() if mode == "replay" else []
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        yield cassette
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+        for var in placeholders:
+            os.environ.pop(var, None)
+
+
+def _set_replay_keys() -> List[str]:
+    missing = [var for var in REPLAY_KEY_VARS if not os.getenv(var)]
+    for var in missing:
+        os.environ[var] = REPLAY_API_KEY
+    return missing
+
+
+def install_from_env() -> Optional[Cassette]:
+    """Apply ``PROVIDER_CASSETTE_MODE`` for the lifetime of the process (server start-up)."""
+    if PROVIDER_CASSETTE_MODE not in MODES:
+        raise ValueError(f"Unsupported PROVIDER_CASSETTE_MODE '{PROVIDER_CASSETTE_MODE}'. Allowed values: {list(MODES)}")
+    if PROVIDER_CASSETTE_MODE == "off":
+        return None
+    cassette = Cassette(PROVIDER_CASSETTE_PATH, PROVIDER_CASSETTE_MODE, PROVIDER_CASSETTE_LATENCY_SCALE, PROVIDER_CASSETTE_MATCH)
+    if cassette.mode == "replay":
+        _set_replay_keys()
+    for module, name, value in _patches(cassette):
+        setattr(module, name, value)
+    print(f"Provider cassette: {PROVIDER_CASSETTE_MODE} {PROVIDER_CASSETTE_PATH}")
+    return cassette
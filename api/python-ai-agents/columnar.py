@@ -0,0 +1,353 @@
+"""
+Columnar request format for large vitals submissions.
+
+The row format (``HealthTrackingData``) builds one Pydantic object per
+reading and keeps every date as a string. For thousands of readings that
+validation and allocation dominates the request before any analysis
+starts. The columnar format sends each metric as parallel arrays instead:
+
+    {
+      "format": "columnar",
+      "patient_id": "p1",
+      "condition": "Diabetes",
+      "series": {
+        "blood_glucose": {
+          "t": [1737369000, 1737390600, ...],      # or ISO strings
+          "value": [102, 168, ...],
+          "units": ["mg/dL"],                      # unit dictionary
+          "contexts": ["Fasting", "Post-meal"],    # context dictionary
+          "context": [0, 1, ...]                   # per-reading index, -1 = none
+        },
+        "blood_pressure": {"t": [...], "systolic": [...], "diastolic": [...], "pulse": [...]}
+      }
+    }
+
+Timestamps are seconds since 1970-01-01 in the reading's wall-clock time
+(no time-zone shift, as in ``vitals_store``) or ISO-8601 strings; strings
+with an offset are converted to UTC, as in ``vitals_series``. Units and
+contexts are dictionary-encoded: ``unit``/``context`` hold an index per
+reading and may be omitted when the dictionary has one entry (or none). ``pulse`` may contain null where it wasn't measured.
+Free-text notes are only supported by the row format.
+
+Each series is validated and converted in one vectorised pass into NumPy
+arrays (``Columns``), sorted by time. Validation errors surface as 422s,
+like the row format's.
+"""
+
+import hashlib
+import warnings
+from dataclasses import dataclass, replace
+from typing import Optional, Dict, Any, List, Literal, Tuple
+
+import numpy as np
+from pydantic import BaseModel, PrivateAttr, model_validator
+
+# Value columns of each metric (HealthTrackingData's reading lists)
+METRIC_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "blood_pressure": ("systolic", "diastolic", "pulse"),
+    "blood_glucose": ("value",),
+    "heart_rate": ("value",),
+    "weight": ("value",),
+    "oxygen_saturation": ("value",),
+    "tsh": ("value",),
+    "t3": ("value",),
+    "t4": ("value",),
+}
+
+# Columns that may hold nulls (not measured)
+_OPTIONAL_FIELDS = {"pulse"}
+
+_U64 = np.uint64
+
+# Timestamps must fall in years 1-9999 (what datetime and ISO strings can show)
+_MIN_T, _MAX_T = -62135596800, 253402300799
+
+
+# ── Request models ───────────────────────────────────────────────────────────
+
+class ColumnarSeries(BaseModel):
+    """One metric as parallel arrays; index i of every array is one reading."""
+    t: list                           # epoch seconds (wall clock) or ISO strings
+    value: Optional[list] = None      # every metric except blood pressure
+    systolic: Optional[list] = None   # blood pressure
+    diastolic: Optional[list] = None
+    pulse: Optional[list] = None
+    units: List[str] = []             # unit dictionary
+    unit: Optional[list] = None       # per-reading index into `units`
+    contexts: List[str] = []          # context dictionary, e.g. ["Fasting", "Post-meal"]
+    context: Optional[list] = None    # per-reading index into `contexts`, -1 = none
+
+
+class ColumnarHealthTrackingData(BaseModel):
+    """Columnar counterpart of HealthTrackingData; parsed arrays are on ``columns``."""
+    format: Literal["columnar"]
+    patient_id: str
+    condition: str
+    series: Dict[str, ColumnarSeries] = {}
+    medications: Optional[List[dict]] = []
+    symptoms: Optional[str] = None
+    lifestyle_changes: Optional[str] = None
+
+    _columns: Dict[str, "Columns"] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="after")
+    def _parse(self):
+        unknown = sorted(set(self.series) - set(METRIC_FIELDS))
+        if unknown:
+            raise ValueError(f"Unknown series {unknown}; expected any of {sorted(METRIC_FIELDS)}")
+        self._columns = {
+            name: parse_columns(name, series, METRIC_FIELDS[name])
+            for name, series in self.series.items()
+        }
+        return self
+
+    @property
+    def columns(self) -> Dict[str, "Columns"]:
+        return self._columns
+
+    def select(self, keep: Dict[str, np.ndarray]) -> "ColumnarHealthTrackingData":
+        """Copy holding only the readings where ``keep[name]`` is True."""
+        subset = self.model_copy()
+        subset._columns = {
+            name: cols.take(keep[name]) if name in keep else cols
+            for name, cols in self._columns.items()
+        }
+        return subset
+
+
+class ColumnarTrendRequest(BaseModel):
+    """Columnar counterpart of TrendAnalysisRequest."""
+    format: Literal["columnar"]
+    patient_id: str
+    metric_type: str
+    time_range: int = 30
+    readings: ColumnarSeries
+
+    _columns: Optional["Columns"] = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def _parse(self):
+        fields = ("value",) if self.readings.value is not None else METRIC_FIELDS["blood_pressure"]
+        self._columns = parse_columns("readings", self.readings, fields)
+        return self
+
+    @property
+    def columns(self) -> "Columns":
+        return self._columns
+
+
+def payload_format(value: Any) -> str:
+    """Union discriminator: "columnar" for columnar bodies, "rows" otherwise."""
+    fmt = value.get("format") if isinstance(value, dict) else getattr(value, "format", None)
+    return "columnar" if fmt == "columnar" else "rows"
+
+
+# ── Parsed columns ───────────────────────────────────────────────────────────
+
+@dataclass
+class Columns:
+    t: np.ndarray                  # int64 seconds, ascending
+    fields: Dict[str, np.ndarray]  # float64 per value column; NaN = not measured
+    unit_idx: np.ndarray           # int64 index into units, -1 = none
+    units: List[str]
+    context_idx: np.ndarray        # int64 index into contexts, -1 = none
+    contexts: List[str]
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    def take(self, index: np.ndarray) -> "Columns":
+        return replace(
+            self,
+            t=self.t[index],
+            fields={k: v[index] for k, v in self.fields.items()},
+            unit_idx=self.unit_idx[index],
+            context_idx=self.context_idx[index],
+        )
+
+    def dates(self) -> np.ndarray:
+        """ISO strings ("2025-01-20T10:30:00") for every reading."""
+        return np.datetime_as_string(self.t.astype("datetime64[s]"), unit="s")
+
+    def labels(self, which: str) -> List[Optional[str]]:
+        """Per-reading unit or context string (None where unset)."""
+        idx, table = (self.unit_idx, self.units) if which == "unit" else (self.context_idx, self.contexts)
+        lookup = np.array(list(table) + [None], dtype=object)
+        return lookup[idx].tolist()   # -1 picks the trailing None
+
+
+def _timestamps(name: str, values: list) -> np.ndarray:
+    if values and isinstance(values[0], str):
+        try:
+            with warnings.catch_warnings():
+                # NumPy converts "+05:30"/"Z" suffixes to UTC and warns that it did
+                warnings.simplefilter("ignore", UserWarning)
+                warnings.simplefilter("ignore", DeprecationWarning)
+                parsed = np.array(values, dtype="datetime64[s]")
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{name}.t: {e}") from None
+        if np.isnat(parsed).any():
+            raise ValueError(f"{name}.t: missing timestamp at index {int(np.flatnonzero(np.isnat(parsed))[0])}")
+        seconds = parsed.astype(np.int64)
+    else:
+        seconds = _floats(f"{name}.t", values)
+        if not np.isfinite(seconds).all():
+            raise ValueError(f"{name}.t: missing timestamp at index {int(np.flatnonzero(~np.isfinite(seconds))[0])}")
+
+    # Checked before the int64 cast, which would silently wrap e.g. 1e30
+    out_of_range = (seconds < _MIN_T) | (seconds > _MAX_T)
+    if out_of_range.any():
+        raise ValueError(f"{name}.t: timestamp out of range at index {int(np.flatnonzero(out_of_range)[0])}")
+    return seconds.astype(np.int64)
+
+
+def _floats(label: str, values: list) -> np.ndarray:
+    try:
+        array = np.array(values, dtype=np.float64)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"{label}: {e}") from None
+    if array.ndim != 1:
+        raise ValueError(f"{label}: expected a flat array")
+    return array
+
+
+def _codes(label: str, values: Optional[list], table: List[str], n: int) -> np.ndarray:
+    if values is None:
+        # Omitted: every reading has the dictionary's only entry, or none
+        if len(table) > 1:
+            raise ValueError(f"{label}: required when the dictionary has more than one entry")
+        return np.full(n, 0 if table else -1, dtype=np.int64)
+    codes = _floats(label, values)
+    if len(codes) != n:
+        raise ValueError(f"{label}: {len(codes)} entries for {n} readings")
+    if not np.isfinite(codes).all() or (codes != np.floor(codes)).any():
+        raise ValueError(f"{label}: indices must be integers")
+    codes = codes.astype(np.int64)
+    if n and (codes.min() < -1 or codes.max() >= len(table)):
+        raise ValueError(f"{label}: index out of range for {len(table)} entries")
+    return codes
+
+
+def parse_columns(name: str, series: ColumnarSeries, fields: Tuple[str, ...]) -> Columns:
+    """Validate one series and convert it to time-sorted arrays."""
+    t = _timestamps(name, series.t)
+    n = len(t)
+
+    parsed: Dict[str, np.ndarray] = {}
+    for field in fields:
+        raw = getattr(series, field)
+        if raw is None:
+            if field in _OPTIONAL_FIELDS:
+                continue
+            raise ValueError(f"{name}.{field}: required")
+        values = _floats(f"{name}.{field}", raw)
+        if len(values) != n:
+            raise ValueError(f"{name}.{field}: {len(values)} values for {n} timestamps")
+        if field not in _OPTIONAL_FIELDS and not np.isfinite(values).all():
+            bad = int(np.flatnonzero(~np.isfinite(values))[0])
+            raise ValueError(f"{name}.{field}: missing or non-finite value at index {bad}")
+        parsed[field] = values
+
+    unit_idx = _codes(f"{name}.unit", series.unit, series.units, n)
+    context_idx = _codes(f"{name}.context", series.context, series.contexts, n)
+
+    order = np.argsort(t, kind="stable")
+    if n and (order != np.arange(n)).any():
+        t, unit_idx, context_idx = t[order], unit_idx[order], context_idx[order]
+        parsed = {k: v[order] for k, v in parsed.items()}
+    return Columns(t, parsed, unit_idx, list(series.units), context_idx, list(series.contexts))
+
+
+# ── Digests ──────────────────────────────────────────────────────────────────
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser, vectorised (uint64 arithmetic wraps)."""
+    x = (x ^ (x >> _U64(30))) * _U64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> _U64(27))) * _U64(0x94D049BB133111EB)
+    return x ^ (x >> _U64(31))
+
+
+def _string_hashes(strings: List[str]) -> np.ndarray:
+    # Trailing entry for index -1 (unset)
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in strings] + [0],
+        dtype=np.uint64,
+    )
+
+
+def reading_digests(name: str, cols: Optional[Columns]) -> np.ndarray:
+    """
+    64-bit digest per reading over its timestamp, values, unit and context,
+    independent of dictionary order. Not comparable with row-format digests.
+    """
+    if cols is None or len(cols) == 0:
+        return np.empty(0, dtype=np.uint64)
+    h = _mix(cols.t.astype(np.uint64) ^ _string_hashes([name])[0])
+    for field in sorted(cols.fields):
+        values = np.nan_to_num(cols.fields[field], nan=-1.0) + 0.0   # one NaN bit pattern; -0.0 -> 0.0
+        h = _mix(h ^ values.view(np.uint64))
+    h = _mix(h ^ _string_hashes(cols.units)[cols.unit_idx])
+    return _mix(h ^ _string_hashes(cols.contexts)[cols.context_idx])
+
+
+# ── Prompt rendering ─────────────────────────────────────────────────────────
+
+# Sections of the tracking prompt in the same order and wording as the row format:
+# (series, heading, line style, include context, thyroid condition only)
+_SECTIONS = (
+    ("blood_pressure", "BLOOD PRESSURE READINGS", "bp", True, False),
+    ("blood_glucose", "BLOOD GLUCOSE READINGS", "value", True, False),
+    ("heart_rate", "HEART RATE READINGS", "value", True, False),
+    ("weight", "WEIGHT READINGS", "value", False, False),
+    ("oxygen_saturation", "OXYGEN SATURATION (SpO₂) READINGS", "percent", False, False),
+    ("tsh", "TSH LEVELS", "value", False, True),
+    ("t3", "T3 LEVELS", "value", False, True),
+    ("t4", "FREE T4 LEVELS", "value", False, True),
+)
+
+
+def render_readings(data: ColumnarHealthTrackingData) -> str:
+    """The readings part of the tracking prompt, built from the arrays."""
+    thyroid = data.condition.lower() == "thyroid"
+    out: List[str] = []
+    for name, heading, style, with_context, thyroid_only in _SECTIONS:
+        cols = data.columns.get(name)
+        if cols is None or len(cols) == 0 or (thyroid_only and not thyroid):
+            continue
+        dates = cols.dates().tolist()
+        contexts = cols.labels("context") if with_context else [None] * len(cols)
+        if style == "bp":
+            pulse = cols.fields.get("pulse")
+            pulses = pulse.tolist() if pulse is not None else [None] * len(cols)
+            lines = [
+                f"- Date: {d} | Systolic: {s} mmHg | Diastolic: {di} mmHg"
+                + (f" | Pulse: {int(p)} bpm" if p and p == p else "")
+                + (f" | Context: {c}" if c else "")
+                for d, s, di, p, c in zip(dates, cols.fields["systolic"].tolist(), cols.fields["diastolic"].tolist(), pulses, contexts)
+            ]
+        elif style == "percent":
+            lines = [f"- Date: {d} | Value: {v}%" for d, v in zip(dates, cols.fields["value"].tolist())]
+        else:
+            units = cols.labels("unit")
+            lines = [
+                f"- Date: {d} | Value: {v} {u or ''}" + (f" | Context: {c}" if c else "")
+                for d, v, u, c in zip(dates, cols.fields["value"].tolist(), units, contexts)
+            ]
+        out.append(f"\n### {heading}:\n" + "\n".join(lines) + "\n")
+    return "".join(out)
+
+
+def trend_values(cols: Columns) -> np.ndarray:
+    """The series a trend request's statistics are computed on (systolic for blood pressure)."""
+    return cols.fields["value"] if "value" in cols.fields else cols.fields["systolic"]
+
+
+def render_trend_points(cols: Columns) -> str:
+    """DATA POINTS lines of the trend prompt."""
+    dates = cols.dates().tolist()
+    units = cols.labels("unit")
+    if "value" in cols.fields:
+        values = [str(v) for v in cols.fields["value"].tolist()]
+    else:
+        values = [f"{s}/{d}" for s, d in zip(cols.fields["systolic"].tolist(), cols.fields["diastolic"].tolist())]
+    return "".join(f"- Date: {d} | Value: {v} {u or ''}\n" for d, v, u in zip(dates, values, units))
@@ -0,0 +1,563 @@
+"""
+Offline spatial index of medical facilities built from an OpenStreetMap extract.
+
+Hospitals and pharmacies rarely move, so nearby searches can be answered
+locally instead of by a live Google Places call. The importer reads
+``amenity`` (or ``healthcare``) = hospital | pharmacy | clinic | doctors
+from a GeoJSON / GeoJSON-seq export (Overpass, osmium export, ogr2ogr) or
+an ``.osm.pbf`` file (needs the optional ``osmium`` package) and writes an
+index directory:
+
+    meta.json         counts, tree shape, source
+    xyz.npy           unit-sphere coordinates, in tree order (float64, n x 3)
+    latlng.npy        latitude/longitude, same order
+    kind.npy          facility kind code (uint8)
+    flags.npy         emergency=yes / emergency=no bits (uint8)
+    boxes.npy         bounding box per tree node (float64, nodes x 6)
+    text.bin          UTF-8 osm id, name, address, phone, opening hours, website
+    text_offsets.npy  start of each text field in text.bin (int64)
+
+The tree is an implicit, balanced KD-tree: points are reordered so every
+node covers a contiguous slice, split at its middle along the widest axis,
+and leaves hold at most ``leaf_size`` points. Only the node boxes are
+stored; everything is memory-mapped on load, so several workers share one
+copy through the page cache. Distances use the chord between points on the
+unit sphere, which orders exactly like great-circle distance.
+
+Usage:
+    python facility_index.py build india-health.geojson data/facility_index
+    python facility_index.py query data/facility_index 28.61 77.21 --type hospital --radius 5000 --k 10
+
+Configuration:
+    FACILITY_INDEX_PATH   index directory used by DoctorFinder (default unset: Places only)
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import heapq
+import shutil
+import argparse
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Iterable
+
+import numpy as np
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+FACILITY_INDEX_PATH = os.getenv("FACILITY_INDEX_PATH", "")
+
+EARTH_RADIUS_M = 6371008.8
+INDEX_VERSION = 1
+
+# OSM amenity/healthcare values kept, and their on-disk codes
+KINDS = ("hospital", "pharmacy", "clinic", "doctors")
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS, start=1)}
+
+# DoctorFinder facility types -> OSM kinds
+TYPE_KINDS = {
+    "hospital": ("hospital",),
+    "emergency": ("hospital",),
+    "pharmacy": ("pharmacy",),
+    "doctor": ("doctors", "clinic"),
+    "clinic": ("clinic", "doctors"),
+}
+
+FLAG_EMERGENCY_YES = 1
+FLAG_EMERGENCY_NO = 2
+
+TEXT_FIELDS = ("osm_id", "name", "address", "phone", "opening_hours", "website")
+
+FACILITY_INDEX_QUERY = REGISTRY.histogram(
+    "doctorx_facility_index_query_seconds", "Offline facility index query time.", ("query",),
+    buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+
+
+class FacilityImportError(ValueError):
+    """The extract could not be read."""
+
+
+# ── Geometry ─────────────────────────────────────────────────────────────────
+
+def to_xyz(lat, lng) -> np.ndarray:
+    lat_r, lng_r = np.radians(lat), np.radians(lng)
+    cos_lat = np.cos(lat_r)
+    return np.stack([cos_lat * np.cos(lng_r), cos_lat * np.sin(lng_r), np.sin(lat_r)], axis=-1)
+
+
+def chord_for_meters(meters: float) -> float:
+    return 2.0 * math.sin(min(meters / EARTH_RADIUS_M, math.pi) / 2.0)
+
+
+def meters_for_chord(chord):
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord, 2.0) / 2.0)
+
+
+# ── Import ───────────────────────────────────────────────────────────────────
+
+def _facility_kind(tags: Dict[str, Any]) -> Optional[str]:
+    for key in ("amenity", "healthcare"):
+        value = tags.get(key)
+        if value in KIND_CODES:
+            return value
+        if value == "doctor":
+            return "doctors"
+    return None
+
+
+def _address(tags: Dict[str, Any]) -> str:
+    if tags.get("addr:full"):
+        return str(tags["addr:full"])
+    street = " ".join(str(tags[k]) for k in ("addr:housenumber", "addr:street") if tags.get(k))
+    parts = [street] + [str(tags[k]) for k in ("addr:suburb", "addr:city") if tags.get(k)]
+    return ", ".join(p for p in parts if p)
+
+
+def _record(lat: float, lng: float, tags: Dict[str, Any], osm_id: str) -> Optional[tuple]:
+    kind = _facility_kind(tags)
+    if kind is None or not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        return None
+    emergency = str(tags.get("emergency", "")).lower()
+    flags = FLAG_EMERGENCY_YES if emergency == "yes" else FLAG_EMERGENCY_NO if emergency == "no" else 0
+    return (
+        lat, lng, KIND_CODES[kind], flags,
+        osm_id,
+        str(tags.get("name") or tags.get("name:en") or ""),
+        _address(tags),
+        str(tags.get("phone") or tags.get("contact:phone") or ""),
+        str(tags.get("opening_hours") or ""),
+        str(tags.get("website") or tags.get("contact:website") or ""),
+    )
+
+
+def _centroid(geometry: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """(lat, lng) of a point, or the vertex mean of the first ring of a way/area."""
+    coords = geometry.get("coordinates") if geometry else None
+    if not coords:
+        return None
+    kind = geometry.get("type")
+    if kind == "Point":
+        return coords[1], coords[0]
+    ring = {"LineString": coords, "Polygon": coords[0], "MultiPolygon": coords[0][0] if coords[0] else None}.get(kind)
+    if not ring:
+        return None
+    return sum(p[1] for p in ring) / len(ring), sum(p[0] for p in ring) / len(ring)
+
+
+def _geojson_features(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(4096).lstrip("\x1e \t\r\n")
+        f.seek(0)
+        if head.startswith("{") and '"FeatureCollection"' in head.replace(" ", ""):
+            yield from json.load(f).get("features", [])
+            return
+        # GeoJSON-seq: one feature per line (optionally RS-prefixed)
+        for line in f:
+            line = line.strip().lstrip("\x1e")
+            if line:
+                yield json.loads(line)
+
+
+def read_geojson(path: str) -> Iterator[tuple]:
+    for feature in _geojson_features(path):
+        props = feature.get("properties") or {}
+        tags = props.get("tags") if isinstance(props.get("tags"), dict) else props
+        point = _centroid(feature.get("geometry"))
+        if point is None:
+            continue
+        osm_id = str(feature.get("id") or props.get("@id") or props.get("osm_id") or props.get("id") or "")
+        record = _record(point[0], point[1], tags, osm_id)
+        if record is not None:
+            yield record
+
+
+def read_pbf(path: str) -> List[tuple]:
+    try:
+        import osmium
+    except ImportError:
+        raise FacilityImportError("Reading .osm.pbf needs the 'osmium' package (pip install osmium); or export to GeoJSON first.")
+
+    records: List[tuple] = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            if _facility_kind(n.tags):
+                record = _record(n.location.lat, n.location.lon, dict(n.tags), f"node/{n.id}")
+                if record:
+                    records.append(record)
+
+        def way(self, w):
+            if _facility_kind(w.tags):
+                points = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+                if points:
+                    lat = sum(p[0] for p in points) / len(points)
+                    lng = sum(p[1] for p in points) / len(points)
+                    record = _record(lat, lng, dict(w.tags), f"way/{w.id}")
+                    if record:
+                        records.append(record)
+
+    Handler().apply_file(path, locations=True)
+    return records
+
+
+def read_extract(path: str) -> Iterable[tuple]:
+    if path.endswith(".pbf"):
+        return read_pbf(path)
+    if path.endswith((".geojson", ".geojsonl", ".geojsons", ".json", ".jsonl", ".ndjson")):
+        return read_geojson(path)
+    raise FacilityImportError(f"Unsupported extract '{os.path.basename(path)}'. Use .osm.pbf or GeoJSON.")
+
+
+# ── Build ────────────────────────────────────────────────────────────────────
+
+def _levels(n: int, leaf_size: int) -> int:
+    return max(0, math.ceil(math.log2(n / leaf_size))) if n > leaf_size else 0
+
+
+def _build_tree(xyz: np.ndarray, leaf_size: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Reorder points into implicit KD-tree order. Returns (order, node boxes, levels)."""
+    n = len(xyz)
+    levels = _levels(n, leaf_size)
+    order = np.arange(n)
+    points = xyz.copy()
+    boxes = np.empty((2 ** (levels + 1), 6))
+    boxes[:, :3], boxes[:, 3:] = np.inf, -np.inf
+
+    stack = [(1, 0, n, 0)]
+    while stack:
+        node, lo, hi, depth = stack.pop()
+        if hi <= lo:
+            continue
+        chunk = points[lo:hi]
+        boxes[node, :3], boxes[node, 3:] = chunk.min(axis=0), chunk.max(axis=0)
+        if depth == levels:
+            continue
+        mid = (lo + hi) // 2
+        axis = int(np.argmax(boxes[node, 3:] - boxes[node, :3]))
+        part = np.argpartition(chunk[:, axis], mid - lo)
+        points[lo:hi] = chunk[part]
+        order[lo:hi] = order[lo:hi][part]
+        stack.append((2 * node, lo, mid, depth + 1))
+        stack.append((2 * node + 1, mid, hi, depth + 1))
+    return order, boxes, levels
+
+
+def build_index(source: str, out_dir: str, leaf_size: int = 32) -> Dict[str, Any]:
+    """
+    Import an extract and write the index to ``out_dir`` (replaced atomically,
+    so a running server keeps its current mapping until it reloads).
+
+    Raises:
+        FacilityImportError: If the extract can't be read or holds no facilities.
+    """
+    started = time.perf_counter()
+    try:
+        records = list(read_extract(source))
+    except (OSError, json.JSONDecodeError) as e:
+        raise FacilityImportError(f"Could not read {os.path.basename(source)}: {e}")
+    # The same facility can be both a node and a way in some exports
+    records = list({(r[4] or f"{r[0]:.6f},{r[1]:.6f},{r[5]}"): r for r in records}.values())
+    if not records:
+        raise FacilityImportError(f"No hospitals, pharmacies, clinics or doctors found in {os.path.basename(source)}.")
+
+    latlng = np.array([(r[0], r[1]) for r in records], dtype=np.float64)
+    order, boxes, levels = _build_tree(to_xyz(latlng[:, 0], latlng[:, 1]), leaf_size)
+    latlng = latlng[order]
+
+    text = bytearray()
+    offsets = np.empty(len(records) * len(TEXT_FIELDS) + 1, dtype=np.int64)
+    slot = 0
+    for i in order:
+        for value in records[i][4:]:
+            offsets[slot] = len(text)
+            text += value.encode("utf-8")
+            slot += 1
+    offsets[slot] = len(text)
+
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "xyz.npy"), to_xyz(latlng[:, 0], latlng[:, 1]))
+    np.save(os.path.join(tmp_dir, "latlng.npy"), latlng)
+    np.save(os.path.join(tmp_dir, "kind.npy"), np.array([records[i][2] for i in order], dtype=np.uint8))
+    np.save(os.path.join(tmp_dir, "flags.npy"), np.array([records[i][3] for i in order], dtype=np.uint8))
+    np.save(os.path.join(tmp_dir, "boxes.npy"), boxes)
+    np.save(os.path.join(tmp_dir, "text_offsets.npy"), offsets)
+    with open(os.path.join(tmp_dir, "text.bin"), "wb") as f:
+        f.write(text)
+
+    counts = np.bincount([r[2] for r in records], minlength=len(KINDS) + 1)
+    meta = {
+        "version": INDEX_VERSION,
+        "count": len(records),
+        "leaf_size": leaf_size,
+        "levels": levels,
+        "kinds": {kind: int(counts[code]) for kind, code in KIND_CODES.items()},
+        "source": os.path.basename(source),
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return {**meta, "seconds": round(time.perf_counter() - started, 2)}
+
+
+# ── Queries ──────────────────────────────────────────────────────────────────
+
+class FacilityIndex:
+    """Read-only, memory-mapped view of an index directory."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Facility index at {path} has version {self.meta.get('version')}; rebuild it.")
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.path = path
+        self.xyz = load("xyz.npy")
+        self.latlng = load("latlng.npy")
+        self.kind = load("kind.npy")
+        self.flags = load("flags.npy")
+        self.offsets = load("text_offsets.npy")
+        self.text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode="r") if self.offsets[-1] else b""
+        self.count = len(self.xyz)
+        self.levels = self.meta["levels"]
+        self._first_leaf = 2 ** self.levels
+        # Box tests run per node in Python; plain tuples avoid numpy scalar overhead
+        self._boxes = [tuple(b) for b in load("boxes.npy").tolist()]
+
+    def __len__(self) -> int:
+        return self.count
+
+    # ── Tree walks ───────────────────────────────────────────────────────────
+
+    def _box_dist2(self, node: int, q: Tuple[float, float, float]) -> float:
+        x0, y0, z0, x1, y1, z1 = self._boxes[node]
+        dx = x0 - q[0] if q[0] < x0 else q[0] - x1 if q[0] > x1 else 0.0
+        dy = y0 - q[1] if q[1] < y0 else q[1] - y1 if q[1] > y1 else 0.0
+        dz = z0 - q[2] if q[2] < z0 else q[2] - z1 if q[2] > z1 else 0.0
+        return dx * dx + dy * dy + dz * dz
+
+    def _mask(self, lo: int, hi: int, kinds: Optional[np.ndarray], exclude_flags: int) -> Optional[np.ndarray]:
+        mask = None
+        if kinds is not None:
+            mask = kinds[self.kind[lo:hi]]
+        if exclude_flags:
+            keep = (self.flags[lo:hi] & exclude_flags) == 0
+            mask = keep if mask is None else mask & keep
+        return mask
+
+    @staticmethod
+    def _kind_table(kinds: Optional[Iterable[str]]) -> Optional[np.ndarray]:
+        if not kinds:
+            return None
+        table = np.zeros(len(KINDS) + 1, dtype=bool)
+        table[[KIND_CODES[k] for k in kinds]] = True
+        return table
+
+    def within(
+        self, latitude: float, longitude: float, radius_m: float,
+        kinds: Optional[Iterable[str]] = None, exclude_flags: int = 0,
+    ) -> List[Tuple[int, float]]:
+        """``(row, meters)`` for every facility within ``radius_m``, nearest first."""
+        started = time.perf_counter()
+        q = tuple(to_xyz(latitude, longitude).tolist())
+        limit2 = chord_for_meters(radius_m) ** 2
+
+        # Collect the slices of the leaves that may hold matches, then test them in one pass
+        ranges: List[Tuple[int, int]] = []
+        stack = [(1, 0, self.count, 0)]
+        while stack:
+            node, lo, hi, depth = stack.pop()
+            if hi <= lo or self._box_dist2(node, q) > limit2:
+                continue
+            if depth == self.levels:
+                if ranges and ranges[-1][1] == lo:
+                    ranges[-1] = (ranges[-1][0], hi)
+                else:
+                    ranges.append((lo, hi))
+                continue
+            mid = (lo + hi) // 2
+            stack.append((2 * node + 1, mid, hi, depth + 1))
+            stack.append((2 * node, lo, mid, depth + 1))
+
+        rows = [np.arange(lo, hi) for lo, hi in ranges]
+        if not rows:
+            FACILITY_INDEX_QUERY.observe(time.perf_counter() - started, query="radius")
+            return []
+        rows = np.concatenate(rows) if len(rows) > 1 else rows[0]
+        d2 = ((self.xyz[rows] - np.asarray(q)) ** 2).sum(axis=1)
+        keep = d2 <= limit2
+        kind_table = self._kind_table(kinds)
+        if kind_table is not None:
+            keep &= kind_table[self.kind[rows]]
+        if exclude_flags:
+            keep &= (self.flags[rows] & exclude_flags) == 0
+        rows, d2 = rows[keep], d2[keep]
+        by_distance = np.argsort(d2, kind="stable")
+        meters = meters_for_chord(np.sqrt(d2[by_distance]))
+        result = list(zip(rows[by_distance].tolist(), meters.tolist()))
+        FACILITY_INDEX_QUERY.observe(time.perf_counter() - started, query="radius")
+        return result
+
+    def nearest(
+        self, latitude: float, longitude: float, k: int,
+        max_radius_m: Optional[float] = None, kinds: Optional[Iterable[str]] = None, exclude_flags: int = 0,
+    ) -> List[Tuple[int, float]]:
+        """``(row, meters)`` for the ``k`` nearest facilities (optionally within ``max_radius_m``)."""
+        started = time.perf_counter()
+        q = tuple(to_xyz(latitude, longitude).tolist())
+        qa = np.asarray(q)
+        limit2 = chord_for_meters(max_radius_m) ** 2 if max_radius_m else 4.0
+        kind_table = self._kind_table(kinds)
+
+        best: List[Tuple[float, int]] = []       # max-heap of (-d2, row)
+        frontier = [(self._box_dist2(1, q), 1, 0, self.count, 0)]
+        while frontier:
+            box2, node, lo, hi, depth = heapq.heappop(frontier)
+            worst = -best[0][0] if len(best) == k else limit2
+            if box2 > worst:
+                break
+            if depth == self.levels:
+                d2 = ((self.xyz[lo:hi] - qa) ** 2).sum(axis=1)
+                keep = d2 <= worst
+                mask = self._mask(lo, hi, kind_table, exclude_flags)
+                if mask is not None:
+                    keep &= mask
+                for i in np.nonzero(keep)[0].tolist():
+                    item = (-float(d2[i]), lo + i)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                continue
+            mid = (lo + hi) // 2
+            for child, clo, chi in ((2 * node, lo, mid), (2 * node + 1, mid, hi)):
+                if chi > clo:
+                    child2 = self._box_dist2(child, q)
+                    if child2 <= worst:
+                        heapq.heappush(frontier, (child2, child, clo, chi, depth + 1))
+
+        best.sort(reverse=True)
+        rows = [row for _, row in best]
+        meters = meters_for_chord(np.sqrt([-d for d, _ in best])).tolist() if best else []
+        FACILITY_INDEX_QUERY.observe(time.perf_counter() - started, query="nearest")
+        return list(zip(rows, meters))
+
+    # ── Rows ─────────────────────────────────────────────────────────────────
+
+    def facilities(self, hits: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        """Rows in the DoctorXCare facility shape (no Places-only fields yet)."""
+        if not hits:
+            return []
+        rows = np.fromiter((row for row, _ in hits), dtype=np.int64, count=len(hits))
+        latlng = self.latlng[rows].tolist()
+        kinds = self.kind[rows].tolist()
+        flags = self.flags[rows].tolist()
+        width = len(TEXT_FIELDS)
+        # A row's text fields are contiguous: read the block once, split it locally
+        bounds = self.offsets[(rows * width)[:, None] + np.arange(width + 1)].tolist()
+        result = []
+        for (row, meters), (lat, lng), kind, flag, b in zip(hits, latlng, kinds, flags, bounds):
+            block = bytes(self.text[b[0]:b[-1]])
+            osm_id, name, address, phone, opening_hours, website = (
+                block[b[i] - b[0]:b[i + 1] - b[0]].decode("utf-8") for i in range(width)
+            )
+            result.append({
+                "id": f"osm:{osm_id or f'{lat:.6f},{lng:.6f}'}",
+                "name": name or "Unknown Facility",
+                "vicinity": address or "Address not available",
+                "rating": None,
+                "user_ratings_total": 0,
+                "geometry": {"lat": lat, "lng": lng},
+                "open_now": None,
+                "photo_reference": None,
+                "types": [KINDS[kind - 1]] + (["emergency"] if flag & FLAG_EMERGENCY_YES else []),
+                "distance_m": round(meters, 1),
+                "phone": phone or None,
+                "opening_hours": opening_hours or None,
+                "website": website or None,
+                "source": "osm",
+                "osm_id": osm_id or None,
+            })
+        return result
+
+    def search(
+        self, latitude: float, longitude: float, facility_type: str, radius_m: float, limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Facilities of a DoctorFinder ``facility_type`` within ``radius_m``, nearest first."""
+        kinds = TYPE_KINDS[facility_type]
+        # Hospitals tagged emergency=no are left out of emergency searches
+        exclude = FLAG_EMERGENCY_NO if facility_type == "emergency" else 0
+        if limit:
+            hits = self.nearest(latitude, longitude, limit, radius_m, kinds, exclude)
+        else:
+            hits = self.within(latitude, longitude, radius_m, kinds, exclude)
+        return self.facilities(hits)
+
+
+def load_index(path: str = FACILITY_INDEX_PATH) -> Optional[FacilityIndex]:
+    """The index at ``path``, or None when unset or missing (Places is used instead)."""
+    if not path:
+        return None
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        print(f"Facility index not found at {path}; nearby searches use Google Places")
+        return None
+    index = FacilityIndex(path)
+    print(f"Facility index: {len(index)} facilities from {index.meta.get('source')} ({path})")
+    return index
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────────
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline facility index (OpenStreetMap)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Import an extract into an index directory")
+    build.add_argument("source", help=".osm.pbf, GeoJSON or GeoJSON-seq file")
+    build.add_argument("out_dir")
+    build.add_argument("--leaf-size", type=int, default=32)
+    query = commands.add_parser("query", help="Look up facilities around a point")
+    query.add_argument("index_dir")
+    query.add_argument("latitude", type=float)
+    query.add_argument("longitude", type=float)
+    query.add_argument("--type", default="hospital", choices=sorted(TYPE_KINDS))
+    query.add_argument("--radius", type=float, default=5000)
+    query.add_argument("--k", type=int, default=None, help="Return only the k nearest")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        try:
+            print(json.dumps(build_index(args.source, args.out_dir, args.leaf_size), indent=2))
+        except FacilityImportError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        return 0
+
+    index = FacilityIndex(args.index_dir)
+    started = time.perf_counter()
+    results = index.search(args.latitude, args.longitude, args.type, args.radius, args.k)
+    elapsed_us = (time.perf_counter() - started) * 1e6
+    for f in results[:20]:
+        print(f"{f['distance_m']:>9.0f} m  {f['name']}  ({', '.join(f['types'])})  {f['vicinity']}")
+    print(f"{len(results)} result(s) in {elapsed_us:.0f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
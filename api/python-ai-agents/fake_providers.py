@@ -0,0 +1,307 @@
+"""
+Local stand-ins for Gemini (phi Agent), Groq and Google Places.
+Used by the benchmark suite so latency and throughput can be measured
+without spending real provider quota. Each fake supports configurable
+latency, jitter and error injection.
+"""
+
+import io
+import json
+import random
+import functools
+import time
+import asyncio
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any
+
+import httpx
+
+
+@dataclass
+class FakeProviderConfig:
+    """Latency and failure profile for one fake provider."""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0   # 0.0 – 1.0, probability a call fails
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    def delay_seconds(self) -> float:
+        jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+
+class InjectedProviderError(RuntimeError):
+    """Raised by a fake provider when error injection fires."""
+
+
+# ── Gemini / phi Agent ───────────────────────────────────────────────────────
+
+FAKE_AGENT_MARKDOWN = """## 📊 HEALTH STATUS OVERVIEW
+- **Overall Status**: STABLE
+- **Condition Monitored**: General Health
+- **Total Readings Analyzed**: 0
+
+## 📈 TREND ANALYSIS
+- **Direction**: Stable →
+
+## ⚠️ RED FLAGS & ALERTS
+None detected.
+
+## 💬 PATIENT-FRIENDLY SUMMARY
+Simply put: your numbers look steady. Next steps: keep tracking.
+"""
+
+FAKE_EXTRACTION_JSON = {
+    "blood_pressure": [{"date": "2025-01-20T10:30:00", "systolic": 128, "diastolic": 84, "pulse": 76, "context": "Morning"}],
+    "blood_glucose": [{"date": "2025-01-20T08:00:00", "value": 104, "unit": "mg/dL", "context": "Fasting"}],
+    "heart_rate": [],
+    "weight": [{"date": "2025-01-20T00:00:00", "value": 72, "unit": "kg"}],
+    "report_date": "2025-01-20",
+    "patient_name": "Benchmark Patient",
+    "summary": "Mildly elevated BP and fasting glucose.",
+}
+
+
+class FakeAgent:
+    """Mimics phi ``Agent.run`` — blocking call returning a RunResponse-like object."""
+
+    def __init__(self, config: FakeProviderConfig, content: str = FAKE_AGENT_MARKDOWN, model: str = "gemini-2.5-flash"):
+        self.config = config
+        self.content = content
+        self.model = SimpleNamespace(id=model)
+        self.calls = 0
+
+    def run(self, message: str, images: Optional[List[str]] = None, **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        time.sleep(self.config.delay_seconds())
+        if self.config.should_fail():
+            raise InjectedProviderError("Injected Gemini error")
+
+        input_tokens = max(1, len(message) // 4)
+        output_tokens = max(1, len(self.content) // 4)
+        return SimpleNamespace(
+            content=self.content,
+            model=self.model.id,
+            metrics={
+                "input_tokens": [input_tokens],
+                "output_tokens": [output_tokens],
+                "total_tokens": [input_tokens + output_tokens],
+            },
+        )
+
+
+def fake_agent_factory(config: FakeProviderConfig, content: str = FAKE_AGENT_MARKDOWN):
+    """Return a callable shaped like ``get_medical_agent`` and friends."""
+    def _factory(model_id: str = "gemini-2.5-flash") -> FakeAgent:
+        # Router targets arrive as "provider:model"
+        return FakeAgent(config, content=content, model=model_id.split(":")[-1])
+    return _factory
+
+
+class FakeChatModel:
+    """Mimics a phi ``Model.response`` for AI Doctor turns routed to Gemini."""
+
+    def __init__(self, config: FakeProviderConfig, model: str = "gemini-2.5-flash"):
+        self.id = model
+        self._completions = _FakeGroqCompletions(config)
+
+    def response(self, messages: list) -> SimpleNamespace:
+        completion = self._completions.create(
+            model=self.id,
+            messages=[{"role": m.role, "content": m.content} for m in messages],
+        )
+        content = completion.choices[0].message.content
+        # phi appends the assistant message (with its metrics) to the history
+        messages.append(SimpleNamespace(
+            role="assistant",
+            content=content,
+            metrics={
+                "input_tokens": completion.usage.prompt_tokens,
+                "output_tokens": completion.usage.completion_tokens,
+            },
+        ))
+        return SimpleNamespace(content=content)
+
+
+def fake_chat_model_factory(config: FakeProviderConfig):
+    """Return a callable shaped like ``ai_doctor_agent.gemini_chat_model``."""
+    def _factory(model_id: str) -> FakeChatModel:
+        return FakeChatModel(config, model_id)
+    return _factory
+
+
+# ── Groq ─────────────────────────────────────────────────────────────────────
+
+class _FakeGroqCompletions:
+    def __init__(self, config: FakeProviderConfig, assess_after_turns: int = 6):
+        self.config = config
+        self.assess_after_turns = assess_after_turns
+
+    def create(self, model: str, messages: list, **kwargs) -> SimpleNamespace:
+        time.sleep(self.config.delay_seconds())
+        if self.config.should_fail():
+            raise InjectedProviderError("Injected Groq error")
+
+        user_turns = sum(1 for m in messages if m.get("role") == "user")
+        if user_turns > self.assess_after_turns or "final clinical assessment" in messages[-1]["content"]:
+            payload = {
+                "assessment_ready": True,
+                "possible_conditions": ["Tension headache", "Migraine", "Dehydration"],
+                "emergency_level": 2,
+                "emergency_reason": "No red-flag features reported.",
+                "immediate_actions": ["Hydrate", "Rest in a dark room"],
+                "lifestyle_advice": ["Regular sleep", "Limit screen time"],
+                "specialist_referral": "None",
+                "red_flags": ["Sudden worst headache of life"],
+                "summary": "Likely a benign primary headache. Confirm with a doctor.",
+            }
+        else:
+            payload = {
+                "assessment_ready": False,
+                "question": f"Question {user_turns}: how long have you had this symptom?",
+                "empathy_note": "I understand.",
+            }
+
+        content = json.dumps(payload, ensure_ascii=False)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+
+class FakeGroqClient:
+    """Drop-in for ``groq.Groq`` exposing ``chat.completions.create``."""
+
+    def __init__(self, config: FakeProviderConfig, assess_after_turns: int = 6):
+        self.chat = SimpleNamespace(completions=_FakeGroqCompletions(config, assess_after_turns))
+
+
+# ── Google Places ────────────────────────────────────────────────────────────
+
+def _fake_place(i: int, lat: float, lng: float, rng: random.Random) -> Dict[str, Any]:
+    place = {
+        "place_id": f"fake_place_{i:04d}",
+        "name": f"Benchmark Hospital {i}",
+        "vicinity": f"{i} Test Road, Local City",
+        "user_ratings_total": rng.randint(0, 5000),
+        "geometry": {"location": {"lat": lat + rng.uniform(-0.04, 0.04), "lng": lng + rng.uniform(-0.04, 0.04)}},
+        "opening_hours": {"open_now": rng.random() > 0.2},
+        "photos": [{"photo_reference": f"fake_photo_{i:04d}", "height": 800, "width": 1200}],
+        "types": ["hospital", "health", "point_of_interest", "establishment"],
+    }
+    # Some facilities have no rating so the None-last sort path is exercised
+    if rng.random() > 0.15:
+        place["rating"] = round(rng.uniform(2.5, 5.0), 1)
+    return place
+
+
+def fake_places_results(count: int = 20, lat: float = 28.61, lng: float = 77.21, seed: int = 0) -> List[Dict[str, Any]]:
+    """Generate raw Nearby Search results in Google's response shape."""
+    rng = random.Random(seed)
+    return [_fake_place(i, lat, lng, rng) for i in range(count)]
+
+
+@functools.lru_cache(maxsize=1)
+def fake_place_photo() -> bytes:
+    """A 1200x800 JPEG, roughly the size of a real Places photo."""
+    from PIL import Image
+
+    image = Image.linear_gradient("L").resize((1200, 800)).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def fake_places_transport(config: FakeProviderConfig, results_per_page: int = 20) -> httpx.MockTransport:
+    """httpx transport that answers Nearby Search, Place Details and Place Photo requests locally."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(config.delay_seconds())
+        if config.should_fail():
+            return httpx.Response(200, json={"status": "OVER_QUERY_LIMIT", "results": []})
+
+        params = request.url.params
+        if request.url.host == "lh3.googleusercontent.invalid":
+            return httpx.Response(200, content=fake_place_photo(), headers={"content-type": "image/jpeg"})
+        if request.url.path.endswith("/place/photo"):
+            # Google redirects photo requests to its image host
+            location = f"https://lh3.googleusercontent.invalid/p/{params.get('photo_reference', '')}"
+            return httpx.Response(302, headers={"location": location})
+        if request.url.path.endswith("/details/json"):
+            place_id = params.get("place_id", "")
+            return httpx.Response(200, json={
+                "status": "OK",
+                "result": {
+                    "name": f"Details for {place_id}",
+                    "formatted_address": "1 Test Road, Local City",
+                    "formatted_phone_number": "+91 11 0000 0000",
+                    "website": "https://example.invalid",
+                    "rating": 4.2,
+                    "geometry": {"location": {"lat": 28.61, "lng": 77.21}},
+                    "opening_hours": {"open_now": True, "weekday_text": ["Monday: Open 24 hours"]},
+                },
+            })
+
+        lat, lng = (float(x) for x in params.get("location", "28.61,77.21").split(","))
+        return httpx.Response(200, json={
+            "status": "OK",
+            "results": fake_places_results(results_per_page, lat, lng),
+        })
+
+    return httpx.MockTransport(handler)
+
+
+# ── Installation ─────────────────────────────────────────────────────────────
+
+@contextmanager
+def install_fake_providers(
+    gemini: Optional[FakeProviderConfig] = None,
+    groq: Optional[FakeProviderConfig] = None,
+    places: Optional[FakeProviderConfig] = None,
+):
+    """
+    Swap the live providers used by ``main`` for local fakes, restoring
+    the originals on exit. Providers passed as None get a zero-latency fake.
+    """
+    import main
+    import ai_doctor_agent
+    import DoctorFinder
+
+    gemini = gemini or FakeProviderConfig()
+    groq = groq or FakeProviderConfig()
+    places = places or FakeProviderConfig()
+
+    patches = [
+        (main, "get_medical_agent", fake_agent_factory(gemini)),
+        (main, "get_health_tracking_agent", fake_agent_factory(gemini)),
+        (main, "get_trend_visualization_agent", fake_agent_factory(gemini)),
+        (main, "get_report_extraction_agent", fake_agent_factory(gemini, json.dumps(FAKE_EXTRACTION_JSON))),
+        (ai_doctor_agent, "groq_client", FakeGroqClient(groq)),
+        (ai_doctor_agent, "gemini_chat_model", fake_chat_model_factory(gemini)),
+        (DoctorFinder, "http_transport", fake_places_transport(places)),
+        (DoctorFinder, "GOOGLE_MAPS_API_KEY", "fake-benchmark-key"),
+    ]
+
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
@@ -0,0 +1,235 @@
+"""
+Wire encoding of API responses: fast JSON serialization and
+content-negotiated compression.
+
+- ``FastJSONResponse`` renders with orjson when it is installed (several
+  times faster than the stdlib encoder and emits UTF-8 directly, so Hindi
+  text isn't inflated into ``\\uXXXX`` escapes); without orjson it behaves
+  exactly like Starlette's ``JSONResponse``.
+- ``CompressionMiddleware`` compresses text-like responses above a size
+  threshold with brotli (if installed and accepted) or gzip, honouring
+  ``Accept-Encoding`` q-values.
+
+Configuration:
+    COMPRESS_MIN_BYTES     smallest body worth compressing (default 1024)
+    COMPRESS_GZIP_LEVEL    zlib level 1-9                  (default 6)
+    COMPRESS_BROTLI_QUALITY brotli quality 0-11            (default 4, tuned for speed)
+"""
+
+import os
+import zlib
+from typing import Optional, Dict, Any, List, Tuple
+
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+
+from telemetry import REGISTRY
+
+try:
+    import orjson
+except ImportError:   # optional speed-up
+    orjson = None
+
+try:
+    import brotli
+except ImportError:   # optional; gzip is always available
+    brotli = None
+
+load_dotenv()
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+COMPRESSION_BYTES = REGISTRY.counter(
+    "doctorx_response_bytes_total", "Response body bytes before and after compression.", ("encoding", "stage"),
+)
+
+# Content types worth compressing; images and archives are already compressed
+_COMPRESSIBLE_PREFIXES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+# ── JSON ─────────────────────────────────────────────────────────────────────
+
+def dumps(content: Any) -> bytes:
+    """Serialize like the API does: orjson if available, else compact stdlib JSON."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return JSONResponse(content).body
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class for the API (see module docstring)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# ── Content negotiation ──────────────────────────────────────────────────────
+
+def _parse_accept_encoding(value: str) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in value.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Best supported encoding the client accepts ("br", "gzip"), or None."""
+    accepted = _parse_accept_encoding(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Encoder:
+    """Incremental gzip/brotli encoder with a common interface."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)   # 31 = gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._br.finish()
+        return self._gz.flush(zlib.Z_FINISH)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    encoder = _Encoder(encoding)
+    return encoder.compress(data) + encoder.finish()
+
+
+# ── ASGI middleware ──────────────────────────────────────────────────────────
+
+class CompressionMiddleware:
+    """
+    Compresses text-like responses of at least ``minimum_size`` bytes.
+    Single-body responses are compressed in one shot; streamed responses
+    are compressed chunk by chunk once the first chunk is seen.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Dict[str, Any]] = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                content_type, already_encoded = _inspect_headers(headers)
+                if already_encoded or not content_type.startswith(_COMPRESSIBLE_PREFIXES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message     # held until the first body chunk
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                if not more_body and len(body) < self.minimum_size:
+                    # Too small to be worth it, but caches still need to know we negotiate
+                    start_message["headers"] = _with_vary(start_message.get("headers", []))
+                    await send(start_message)
+                    await send(message)
+                    passthrough = True
+                    return
+                encoder = _Encoder(encoding)
+                headers = [
+                    (k, v) for k, v in start_message.get("headers", [])
+                    if k.lower() != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                if not more_body:
+                    compressed = encoder.compress(body) + encoder.finish()
+                    headers.append((b"content-length", str(len(compressed)).encode("latin-1")))
+                    start_message["headers"] = _with_vary(headers)
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": compressed})
+                    _count(encoding, len(body), len(compressed))
+                    return
+                start_message["headers"] = _with_vary(headers)
+                await send(start_message)
+
+            chunk = encoder.compress(body)
+            if not more_body:
+                chunk += encoder.finish()
+            _count(encoding, len(body), len(chunk))
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _inspect_headers(headers: List[Tuple[bytes, bytes]]) -> Tuple[str, bool]:
+    content_type, encoded = "", False
+    for name, value in headers:
+        lowered = name.lower()
+        if lowered == b"content-type":
+            content_type = value.decode("latin-1").lower()
+        elif lowered == b"content-encoding":
+            encoded = True
+    return content_type, encoded
+
+
+def _with_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+
+def _count(encoding: str, original: int, compressed: int) -> None:
+    COMPRESSION_BYTES.inc(original, encoding=encoding, stage="original")
+    COMPRESSION_BYTES.inc(compressed, encoding=encoding, stage="wire")
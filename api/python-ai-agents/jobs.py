@@ -0,0 +1,503 @@
+"""
+Asynchronous job mode for long-running analyses.
+
+Clients submit work (vision analysis, report scans, chronic-care
+analysis) and get a job id back immediately. A bounded pool of asyncio
+workers drains the queue, running the blocking agent call in a thread,
+and results are kept for JOB_RESULT_TTL_SECONDS for polling or
+long-polling.
+
+Long jobs (e.g. bulk imports) can call ``report_progress`` from inside
+their function; the latest values are returned with the job status.
+
+Jobs are owned by the server, not the request: a client disconnecting
+after submission never cancels or loses the work, and resubmitting the
+same payload (or the same ``Idempotency-Key``) returns the existing job
+instead of starting a duplicate. Synchronous requests abandoned mid-run
+can be handed over with ``adopt`` so their result is kept the same way.
+
+A job runs in the worker process that accepted it, but its status,
+progress and result are written through to shared_state.py, so a poll,
+long-poll or deduplicated resubmission works on any worker. Long-polls on
+another worker's job re-read it every JOB_POLL_SECONDS. The owning worker
+refreshes a heartbeat on its unfinished jobs; a job whose heartbeat stops
+(the worker was killed) reads as failed, so a retry can submit it again.
+Jobs still unfinished when a worker drains for shutdown are marked failed
+the same way.
+
+Configuration:
+    JOB_WORKERS             concurrent jobs           (default 4)
+    JOB_QUEUE_MAX           queued jobs before 429    (default 100)
+    JOB_RESULT_TTL_SECONDS  how long results are kept (default 3600)
+    JOB_DRAIN_SECONDS       wait for jobs on shutdown (default 30)
+    JOB_POLL_SECONDS        re-read interval when long-polling another worker's job (default 0.5)
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Dict, Any, Callable, Tuple, List
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from http_encoding import dumps
+from ratelimit import RateLimited, wait_for_provider
+from shared_state import SharedDB
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+
+# Owners refresh their unfinished jobs this often; a job silent for
+# _STALE_SECONDS belongs to a worker that is gone
+_HEARTBEAT_SECONDS = 10.0
+_STALE_SECONDS = 60.0
+# How often expired and stale rows are deleted from the shared table
+_PURGE_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id          TEXT PRIMARY KEY,
+    kind            TEXT NOT NULL,
+    idempotency_key TEXT,
+    status          TEXT NOT NULL,
+    result          BLOB,
+    error           TEXT,
+    status_code     INTEGER,
+    progress        BLOB,
+    created_at      REAL NOT NULL,
+    started_at      REAL,
+    finished_at     REAL,
+    heartbeat       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_idempotency_key ON jobs (idempotency_key) WHERE idempotency_key IS NOT NULL;
+"""
+
+_COLUMNS = (
+    "job_id", "kind", "idempotency_key", "status", "result", "error", "status_code",
+    "progress", "created_at", "started_at", "finished_at",
+)
+
+_DB = SharedDB("jobs", _SCHEMA)
+
+JOBS_TOTAL = REGISTRY.counter(
+    "doctorx_jobs_total", "Async jobs by final status.", ("kind", "status"),
+)
+JOBS_DEDUPLICATED = REGISTRY.counter(
+    "doctorx_jobs_deduplicated_total", "Submissions answered with an existing job.", ("kind",),
+)
+JOB_QUEUE_DEPTH = REGISTRY.gauge(
+    "doctorx_job_queue_depth", "Jobs waiting for a worker.",
+)
+JOB_DURATION = REGISTRY.histogram(
+    "doctorx_job_duration_seconds", "Job run time once picked up by a worker.", ("kind",),
+)
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    fn: Optional[Callable[[], Any]]   # None for adopted work already running
+    provider: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    status: str = "queued"            # queued | running | succeeded | failed
+    result: Any = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: Optional[Dict[str, Any]] = None
+    # Long-pollers' futures, resolved on their own loop when the job finishes
+    _waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = field(default_factory=list, repr=False)
+    _waiters_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        body: Dict[str, Any] = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": _iso(self.created_at),
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at),
+        }
+        if self.progress is not None:
+            body["progress"] = self.progress
+        if self.status == "succeeded":
+            body["result"] = self.result
+        elif self.status == "failed":
+            body["error"] = self.error
+            body["status_code"] = self.status_code
+        return body
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+
+# ── Shared table ─────────────────────────────────────────────────────────────
+
+_SELECT = f"SELECT {', '.join(_COLUMNS)}, heartbeat FROM jobs"
+
+
+def _store(job: Job, db=_DB) -> None:
+    """Write the job's current state (and a fresh heartbeat) to the shared table."""
+    db.execute(
+        f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}, heartbeat) VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})",
+        (
+            job.job_id, job.kind, job.idempotency_key, job.status,
+            dumps(job.result) if job.status == "succeeded" else None,
+            job.error, job.status_code,
+            dumps(job.progress) if job.progress is not None else None,
+            job.created_at, job.started_at, job.finished_at, time.time(),
+        ),
+    )
+
+
+def _store_quietly(job: Job) -> None:
+    # Status updates from workers and job threads must never kill the worker
+    try:
+        _store(job)
+    except Exception as e:
+        print(f"Could not store job {job.job_id}: {e}")
+
+
+def _from_row(row: tuple) -> Job:
+    """A read-only copy of a job, as another worker (or this one) last stored it."""
+    values = dict(zip(_COLUMNS, row))
+    heartbeat = row[len(_COLUMNS)]
+    job = Job(fn=None, **values)
+    job.result = json.loads(job.result) if job.result is not None else None
+    job.progress = json.loads(job.progress) if job.progress is not None else None
+    if not job.finished and heartbeat < time.time() - _STALE_SECONDS:
+        job.status = "failed"
+        job.error = "The server process running this job stopped before it finished. Please submit it again."
+        job.status_code = 503
+    return job
+
+
+# The job whose function is running in this thread (copied in by asyncio.to_thread)
+_current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar("current_job", default=None)
+
+
+def report_progress(**fields: Any) -> None:
+    """Merge ``fields`` into the running job's progress; a no-op outside a job."""
+    job = _current_job.get()
+    if job is not None:
+        job.progress = {**(job.progress or {}), **fields}
+        _store_quietly(job)
+
+
+class JobManager:
+    """Per-process queue and worker pool over the shared job table."""
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_max: int = JOB_QUEUE_MAX, ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.ttl = ttl
+        # Jobs this process runs (or ran), with their functions and long-pollers
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        self._draining = False
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    # ── Store ────────────────────────────────────────────────────────────────
+
+    def _purge_expired(self) -> None:
+        now = time.time()
+        cutoff = now - self.ttl
+        with self._lock:
+            expired = [jid for jid, j in self._jobs.items() if j.finished and j.finished_at < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+        if now - self._last_purge >= _PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            _DB.execute(
+                "DELETE FROM jobs WHERE finished_at < ? OR (finished_at IS NULL AND heartbeat < ?)",
+                (cutoff, cutoff - _STALE_SECONDS),
+            )
+
+    def _job(self, row: Optional[tuple]) -> Optional[Job]:
+        """This process's own Job object for a row when it runs the job, else a copy of the row."""
+        if row is None:
+            return None
+        with self._lock:
+            own = self._jobs.get(row[0])
+        return own if own is not None else _from_row(row)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge_expired()
+        with self._lock:
+            own = self._jobs.get(job_id)
+        if own is not None:
+            return own
+        row = _DB.execute(
+            _SELECT + " WHERE job_id = ? AND (finished_at IS NULL OR finished_at >= ?)",
+            (job_id, time.time() - self.ttl),
+        ).fetchone()
+        return self._job(row)
+
+    def _find_row(self, db, idempotency_key: str) -> Optional[tuple]:
+        now = time.time()
+        return db.execute(
+            _SELECT + " WHERE idempotency_key = ? AND status != 'failed'"
+            " AND ((finished_at IS NULL AND heartbeat >= ?) OR finished_at >= ?)"
+            " ORDER BY created_at DESC LIMIT 1",
+            (idempotency_key, now - _STALE_SECONDS, now - self.ttl),
+        ).fetchone()
+
+    def find(self, idempotency_key: str) -> Optional[Job]:
+        """The queued, running or succeeded job registered under ``idempotency_key``, on any worker."""
+        self._purge_expired()
+        return self._job(self._find_row(_DB, idempotency_key))
+
+    # ── Submission ───────────────────────────────────────────────────────────
+
+    def _ensure_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        # First use, or the previous loop is gone (e.g. a new test client)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._heartbeat()))
+        with self._lock:
+            pending = [j for j in self._jobs.values() if j.status == "queued"]
+        for job in pending:
+            self._queue.put_nowait(job)
+
+    def submit(
+        self,
+        kind: str,
+        fn: Callable[[], Any],
+        provider: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Tuple[Job, bool]:
+        """
+        Queue ``fn`` to run in this process's worker pool. Returns ``(job, created)``;
+        ``created`` is False when an existing job with the same key, on any
+        worker, was reused.
+
+        Raises:
+            RateLimited: If the queue is full.
+        """
+        self._purge_expired()
+        self._ensure_workers()
+
+        # One transaction, so two workers given the same key can't both create a job
+        with _DB.transaction() as conn:
+            if idempotency_key:
+                existing = self._find_row(conn, idempotency_key)
+                # A failed job may be retried; anything else is reused
+                if existing is not None:
+                    JOBS_DEDUPLICATED.inc(kind=kind)
+                    return self._job(existing), False
+
+            # While draining for shutdown, send new work to another worker/instance
+            if self._draining or self._queue.qsize() >= self.queue_max:
+                raise RateLimited("jobs", 5)
+
+            job = Job(job_id=f"job_{uuid.uuid4().hex}", kind=kind, fn=fn, provider=provider, idempotency_key=idempotency_key)
+            _store(job, conn)
+
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        JOB_QUEUE_DEPTH.set(self._queue.qsize())
+        return job, True
+
+    def adopt(self, kind: str, future: "asyncio.Future", idempotency_key: Optional[str] = None) -> Job:
+        """
+        Register work that is already running (a synchronous request whose
+        client went away) as a job, so it can be polled or picked up by a
+        retry instead of being recomputed. Adoption is never refused.
+        """
+        self._purge_expired()
+        job = Job(
+            job_id=f"job_{uuid.uuid4().hex}", kind=kind, fn=None, idempotency_key=idempotency_key,
+            status="running", started_at=time.time(),
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+        _store_quietly(job)
+        future.add_done_callback(lambda f: self._adopted_done(job, f))
+        return job
+
+    def _adopted_done(self, job: Job, future: "asyncio.Future") -> None:
+        if future.cancelled():
+            self._fail(job, RuntimeError("Cancelled before it finished."))
+        elif future.exception() is not None:
+            self._fail(job, future.exception())
+        else:
+            job.result = future.result()
+            job.status = "succeeded"
+        self._finish(job)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """
+        Long-poll: return once the job finishes or ``timeout`` seconds pass.
+        Waiting holds no thread, so pollers never compete with job workers.
+        Another worker's job is re-read every JOB_POLL_SECONDS; the latest
+        copy is returned.
+        """
+        if job.finished or timeout <= 0:
+            return job
+        with self._lock:
+            own = self._jobs.get(job.job_id) is job
+        if not own:
+            return await self._poll(job, timeout)
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with job._waiters_lock:
+            if job.finished:
+                return job
+            job._waiters.append((loop, waiter))
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        finally:
+            waiter.cancel()
+            with job._waiters_lock:
+                if (loop, waiter) in job._waiters:
+                    job._waiters.remove((loop, waiter))
+        return job
+
+    async def _poll(self, job: Job, timeout: float) -> Job:
+        deadline = time.monotonic() + timeout
+        while not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(JOB_POLL_SECONDS, remaining))
+            latest = self.get(job.job_id)
+            if latest is None:   # expired in the meantime
+                break
+            job = latest
+        return job
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Stop accepting jobs and wait up to ``timeout`` seconds for queued and
+        running ones to finish. Returns how many were still unfinished; those
+        are marked failed in the shared table, so a retry resubmits them.
+        """
+        self._draining = True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                unfinished = [j for j in self._jobs.values() if not j.finished]
+            if not unfinished or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        if unfinished:
+            print(f"Shutting down with {len(unfinished)} unfinished job(s)")
+            now = time.time()
+            for job in unfinished:
+                _DB.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, status_code = 503, finished_at = ? "
+                    "WHERE job_id = ? AND finished_at IS NULL",
+                    ("The server shut down before this job finished. Please submit it again.", now, job.job_id),
+                )
+        return len(unfinished)
+
+    # ── Workers ──────────────────────────────────────────────────────────────
+
+    async def _worker(self) -> None:
+        while True:
+            job: Job = await self._queue.get()
+            JOB_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _heartbeat(self) -> None:
+        """Keep this process's unfinished jobs from reading as abandoned."""
+        while True:
+            await asyncio.sleep(_HEARTBEAT_SECONDS)
+            with self._lock:
+                job_ids = [jid for jid, j in self._jobs.items() if not j.finished]
+            if not job_ids:
+                continue
+            try:
+                _DB.execute(
+                    f"UPDATE jobs SET heartbeat = ? WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+                    (time.time(), *job_ids),
+                )
+            except Exception as e:
+                print(f"Could not refresh job heartbeats: {e}")
+
+    async def _run(self, job: Job) -> None:
+        try:
+            if job.provider:
+                await wait_for_provider(job.provider)
+            job.status = "running"
+            job.started_at = time.time()
+            _store_quietly(job)
+            token = _current_job.set(job)
+            try:
+                job.result = await asyncio.to_thread(job.fn)
+            finally:
+                _current_job.reset(token)
+            job.status = "succeeded"
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+    @staticmethod
+    def _fail(job: Job, e: BaseException) -> None:
+        job.status = "failed"
+        job.error = str(getattr(e, "detail", None) or e)
+        job.status_code = getattr(e, "status_code", 500)
+        print(f"Job {job.job_id} ({job.kind}) failed: {job.error}")
+
+    def _finish(self, job: Job) -> None:
+        job.finished_at = time.time()
+        try:
+            _store(job)
+        except (TypeError, ValueError) as e:
+            # A result that can't be encoded would be invisible to other workers
+            self._fail(job, RuntimeError(f"The job's result could not be stored: {e}"))
+            _store_quietly(job)
+        except Exception as e:
+            print(f"Could not store job {job.job_id}: {e}")
+        with job._waiters_lock:
+            waiters, job._waiters = job._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:   # that poller's loop has closed
+                pass
+        JOBS_TOTAL.inc(kind=job.kind, status=job.status)
+        if job.started_at:
+            JOB_DURATION.observe(job.finished_at - job.started_at, kind=job.kind)
+
+
+JOBS = JobManager()
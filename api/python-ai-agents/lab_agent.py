@@ -1,13 +1,21 @@
 import os
 from phi.agent import Agent                   # Correct Import
-from phi.model.google import Gemini           # Correct Import
-from phi.tools.duckduckgo import DuckDuckGo   # Correct Import
 from dotenv import load_dotenv
 
+# Offline guideline lookup (DuckDuckGo only as an opt-in fallback)
+from medical_reference import reference_tools, REFERENCE_TOOL_INSTRUCTION
+
+# Builds Gemini or Groq models from a router target ("provider:model")
+from llm_router import agent_model
+
 # Load environment variables from .env file
 load_dotenv()
 
-def get_medical_agent():
+# Default Gemini model (callers may pass a cheaper one when degrading,
+# or a "provider:model" target when the LLM router fails over)
+GEMINI_MODEL = "gemini-2.5-flash"
+
+def get_medical_agent(model_id: str = GEMINI_MODEL):
     # 1. API key loading
     api_key = os.getenv("LAB_SERVICE_API_KEY")
     
@@ -18,9 +26,9 @@ def get_medical_agent():
     # 2. Agent configuration 
     return Agent(
         # Model configuration
-        model=Gemini(id="gemini-2.5-flash", api_key=api_key),
+        model=agent_model(model_id, api_key),
         
-       tools=[DuckDuckGo()],
+       tools=reference_tools(),
         markdown=True,
         name="Medical Lab Analyst",
         description="You are a highly skilled medical imaging expert with extensive knowledge in radiology.",
@@ -28,6 +36,7 @@ def get_medical_agent():
         # 3. Instructions
       instructions = [
     "Role: Empathetic Medical AI Assistant. Analyze the provided medical report (Lab or Imaging) and generate a structured summary.",
+    REFERENCE_TOOL_INSTRUCTION,
     "Strictly follow the format below:",
 
     "### 1. PATIENT_INFO",
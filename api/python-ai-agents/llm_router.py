@@ -0,0 +1,330 @@
+"""
+LLM router — failover and hedged requests across configured providers/models.
+
+Each route is an ordered list of ``provider:model`` targets. A call goes to
+the first healthy target; if it raises, the next one is tried. Targets that
+fail repeatedly are skipped for a cool-down period.
+
+For latency-critical routes (AI Doctor turns) the router can also hedge:
+if the primary has not answered after its recent p95 latency, a second
+request goes to the next target and whichever answers first wins. Provider
+SDK calls are blocking, so the loser cannot be interrupted mid-flight; it
+is cancelled if it has not started yet, otherwise it finishes in the
+background and its result is discarded (its tokens are still recorded).
+
+Configuration:
+    LLM_ROUTE_AGENTS          targets for the phi analysis agents
+    LLM_ROUTE_DOCTOR          targets for AI Doctor turns
+    LLM_HEDGE_DOCTOR          hedge slow AI Doctor turns          (default true)
+    LLM_HEDGE_DEFAULT_DELAY   hedge delay before p95 is known     (default 3 s)
+    LLM_HEDGE_MIN_DELAY / LLM_HEDGE_MAX_DELAY   clamp for the p95 delay (0.5 s / 10 s)
+    LLM_FAILURE_THRESHOLD     consecutive failures before a target is skipped (default 3)
+    LLM_COOLDOWN_SECONDS      how long a failing target is skipped (default 30)
+"""
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Callable, Iterable, TypeVar
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from cancellation import RequestAbandoned, check_cancelled
+
+load_dotenv()
+
+T = TypeVar("T")
+
+LLM_ROUTE_AGENTS = os.getenv(
+    "LLM_ROUTE_AGENTS",
+    "gemini:gemini-2.5-flash,gemini:gemini-2.5-flash-lite,groq:llama-3.3-70b-versatile",
+)
+LLM_ROUTE_DOCTOR = os.getenv(
+    "LLM_ROUTE_DOCTOR",
+    "groq:llama-3.3-70b-versatile,groq:llama-3.1-8b-instant,gemini:gemini-2.5-flash",
+)
+LLM_HEDGE_DOCTOR = os.getenv("LLM_HEDGE_DOCTOR", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+LLM_FAILURE_THRESHOLD = int(os.getenv("LLM_FAILURE_THRESHOLD", "3"))
+LLM_COOLDOWN_SECONDS = float(os.getenv("LLM_COOLDOWN_SECONDS", "30"))
+
+# Recent latencies kept per target, and how many are needed before p95 is trusted
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+# Providers that accept image inputs through the phi agents
+VISION_PROVIDERS = ("gemini",)
+
+# Extra constructor arguments for the phi provider models. Left empty in
+# production; the cassette recorder (cassettes.py) uses them to route SDK
+# traffic through itself.
+GEMINI_MODEL_OPTIONS: Dict[str, Any] = {}
+GROQ_MODEL_OPTIONS: Dict[str, Any] = {}
+
+ROUTER_ATTEMPTS = REGISTRY.counter(
+    "doctorx_llm_router_attempts_total", "LLM calls attempted by the router.",
+    ("route", "provider", "model", "outcome"),
+)
+ROUTER_LATENCY = REGISTRY.histogram(
+    "doctorx_llm_router_attempt_seconds", "Per-provider LLM latency as seen by the router.",
+    ("route", "provider", "model"),
+)
+ROUTER_FAILOVERS = REGISTRY.counter(
+    "doctorx_llm_router_failovers_total", "Calls that moved on to a later target.", ("route",),
+)
+ROUTER_HEDGES = REGISTRY.counter(
+    "doctorx_llm_router_hedges_total", "Hedged requests sent, and which side won.", ("route", "result"),
+)
+
+
+# ── Targets ──────────────────────────────────────────────────────────────────
+
+@dataclass(frozen=True)
+class Target:
+    provider: str
+    model: str
+
+    @property
+    def spec(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+
+def parse_target(spec: str, default_provider: str = "gemini") -> Target:
+    """``"groq:llama-3.3-70b-versatile"`` -> Target; a bare model id gets an inferred provider."""
+    spec = spec.strip()
+    if ":" in spec:
+        provider, model = spec.split(":", 1)
+        return Target(provider.strip().lower(), model.strip())
+    provider = "gemini" if spec.startswith("gemini") else default_provider
+    return Target(provider, spec)
+
+
+def parse_targets(specs: str, default_provider: str = "gemini") -> List[Target]:
+    return [parse_target(s, default_provider) for s in specs.split(",") if s.strip()]
+
+
+def agent_model(model_id: str, api_key: Optional[str]):
+    """
+    phi model for an agent factory. ``model_id`` is a bare Gemini id or a
+    ``provider:model`` spec from a route; Groq targets use GROQ_API_KEY.
+    """
+    target = parse_target(model_id)
+    if target.provider == "groq":
+        from phi.model.groq import Groq
+        return Groq(**{"id": target.model, "api_key": os.getenv("GROQ_API_KEY"), **GROQ_MODEL_OPTIONS})
+    # Sends the agent's instructions through a Gemini context cache when worthwhile
+    from prompt_cache import CachedGemini
+    return CachedGemini(**{"id": target.model, "api_key": api_key, **GEMINI_MODEL_OPTIONS})
+
+
+# ── Per-target health ────────────────────────────────────────────────────────
+
+class TargetState:
+    """Rolling latency window plus a consecutive-failure circuit breaker."""
+
+    def __init__(self):
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def success(self, seconds: float) -> None:
+        with self.lock:
+            self.latencies.append(seconds)
+            self.failures = 0
+            self.open_until = 0.0
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= LLM_FAILURE_THRESHOLD:
+                self.open_until = time.monotonic() + LLM_COOLDOWN_SECONDS
+
+    @property
+    def available(self) -> bool:
+        return self.open_until <= time.monotonic()
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_HEDGE_THREADS", "16")), thread_name_prefix="llm-hedge")
+        return _executor
+
+
+# ── Router ───────────────────────────────────────────────────────────────────
+
+class LLMRouter:
+    def __init__(self, name: str, targets: List[Target], hedge: bool = False, default_provider: str = "gemini"):
+        if not targets:
+            raise ValueError(f"LLM route '{name}' has no targets configured.")
+        self.name = name
+        self.targets = targets
+        self.hedge = hedge
+        self.default_provider = default_provider
+        self._states: Dict[Target, TargetState] = {}
+        self._lock = threading.Lock()
+
+    def state(self, target: Target) -> TargetState:
+        with self._lock:
+            return self._states.setdefault(target, TargetState())
+
+    def candidates(self, prefer: Optional[str] = None, providers: Optional[Iterable[str]] = None) -> List[Target]:
+        """
+        Targets in try order. ``prefer`` (e.g. a budget-degraded model) goes
+        first; targets in cool-down move to the back rather than vanishing,
+        so a route never fails closed.
+        """
+        ordered = list(self.targets)
+        if prefer:
+            preferred = parse_target(prefer, self.default_provider)
+            ordered = [preferred] + [t for t in ordered if t != preferred]
+        if providers is not None:
+            allowed = set(providers)
+            ordered = [t for t in ordered if t.provider in allowed]
+        healthy = [t for t in ordered if self.state(t).available]
+        return healthy + [t for t in ordered if t not in healthy]
+
+    def hedge_delay(self, target: Target) -> float:
+        p95 = self.state(target).percentile(0.95)
+        if p95 is None:
+            return LLM_HEDGE_DEFAULT_DELAY
+        return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, p95))
+
+    def _attempt(self, invoke: Callable[[Target], T], target: Target) -> T:
+        state = self.state(target)
+        # An abandoned request starts no further attempts or hedges
+        check_cancelled(target.provider)
+        start = time.perf_counter()
+        try:
+            result = invoke(target)
+        except RequestAbandoned:
+            # Not the provider's fault; its health is left alone
+            ROUTER_ATTEMPTS.inc(route=self.name, provider=target.provider, model=target.model, outcome="cancelled")
+            raise
+        except Exception:
+            state.failure()
+            ROUTER_ATTEMPTS.inc(route=self.name, provider=target.provider, model=target.model, outcome="error")
+            raise
+        elapsed = time.perf_counter() - start
+        state.success(elapsed)
+        ROUTER_ATTEMPTS.inc(route=self.name, provider=target.provider, model=target.model, outcome="success")
+        ROUTER_LATENCY.observe(elapsed, route=self.name, provider=target.provider, model=target.model)
+        return result
+
+    def _submit(self, invoke: Callable[[Target], T], target: Target):
+        # Each thread gets its own copy of the caller's context (trace, usage attribution)
+        ctx = contextvars.copy_context()
+        return _hedge_executor().submit(ctx.run, self._attempt, invoke, target)
+
+    def _hedged(self, invoke: Callable[[Target], T], primary: Target, backup: Target) -> T:
+        first = self._submit(invoke, primary)
+        done, _ = wait([first], timeout=self.hedge_delay(primary))
+        if done:
+            if first.exception() is None:
+                return first.result()
+            if backup == primary or isinstance(first.exception(), RequestAbandoned):
+                raise first.exception()
+            # Fast failure: plain failover, no need to race
+            ROUTER_FAILOVERS.inc(route=self.name)
+            return self._attempt(invoke, backup)
+
+        ROUTER_HEDGES.inc(route=self.name, result="sent")
+        second = self._submit(invoke, backup)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    ROUTER_HEDGES.inc(route=self.name, result="hedge_won" if future is second else "primary_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(
+        self,
+        invoke: Callable[[Target], T],
+        prefer: Optional[str] = None,
+        providers: Optional[Iterable[str]] = None,
+        hedge: Optional[bool] = None,
+    ) -> T:
+        """
+        Run ``invoke(target)`` against the route, failing over on errors and
+        optionally hedging slow calls.
+
+        Raises:
+            RuntimeError: If every eligible target failed.
+        """
+        targets = self.candidates(prefer, providers)
+        if not targets:
+            raise RuntimeError(f"No LLM provider available for '{self.name}'.")
+        use_hedge = self.hedge if hedge is None else hedge
+
+        last_error: Optional[BaseException] = None
+        i = 0
+        while i < len(targets):
+            primary = targets[i]
+            try:
+                if use_hedge:
+                    backup = targets[i + 1] if i + 1 < len(targets) else primary
+                    i += 1 if backup == primary else 2
+                    return self._hedged(invoke, primary, backup)
+                i += 1
+                return self._attempt(invoke, primary)
+            except RequestAbandoned:
+                raise
+            except Exception as e:
+                last_error = e
+                print(f"LLM route '{self.name}': {primary.spec} failed: {e}")
+                if i < len(targets):
+                    ROUTER_FAILOVERS.inc(route=self.name)
+        raise RuntimeError(f"All LLM providers failed for '{self.name}': {last_error}") from last_error
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        rows = []
+        for target in self.targets:
+            state = self.state(target)
+            p50, p95 = state.percentile(0.5), state.percentile(0.95)
+            rows.append({
+                "target": target.spec,
+                "provider": target.provider,
+                "model": target.model,
+                "samples": len(state.latencies),
+                "p50_ms": round(p50 * 1000.0, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000.0, 1) if p95 is not None else None,
+                "consecutive_failures": state.failures,
+                "available": state.available,
+            })
+        return rows
+
+    def reset(self) -> None:
+        """Forget latency history and breaker state (benchmarks and tests)."""
+        with self._lock:
+            self._states.clear()
+
+
+AGENT_ROUTE = LLMRouter("agents", parse_targets(LLM_ROUTE_AGENTS, "gemini"), hedge=False, default_provider="gemini")
+DOCTOR_ROUTE = LLMRouter("ai_doctor", parse_targets(LLM_ROUTE_DOCTOR, "groq"), hedge=LLM_HEDGE_DOCTOR, default_provider="groq")
+ROUTES: Dict[str, LLMRouter] = {r.name: r for r in (AGENT_ROUTE, DOCTOR_ROUTE)}
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
-import shutil
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Discriminator, Tag
+from typing import Annotated, List, Optional, Tuple, Union
+import asyncio
+import functools
+import hashlib
+import uuid
 import os
 import uvicorn
 import time
@@ -15,19 +19,114 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import Agent Logic
 from lab_agent import get_medical_agent
-from tracking_agent import get_health_tracking_agent, get_trend_visualization_agent, get_report_extraction_agent
+from tracking_agent import get_health_tracking_agent, get_trend_visualization_agent, get_report_extraction_agent, GEMINI_MODEL
 
 # =============================================
 # NEW IMPORT: Nearby Facility Finder Agent
 # =============================================
-from DoctorFinder import get_nearby_facilities, get_place_details
+from DoctorFinder import get_nearby_facilities, get_place_details, search_facility_types, has_offline_index, fetch_place_photo, FACILITY_TYPE_MAP
 
 # =============================================
 # NEW IMPORT: AI Doctor Consultation Agent
 # =============================================
-from ai_doctor_agent import start_consultation, continue_consultation, get_emergency_info
+from ai_doctor_agent import start_consultation, continue_consultation, scripted_turn, get_emergency_info, turn_priority, turn_provider, GROQ_MODEL
 
-app = FastAPI()
+# =============================================
+# NEW IMPORT: Request telemetry (phase spans + Prometheus metrics)
+# =============================================
+from telemetry import TelemetryMiddleware, span, render_metrics
+
+# =============================================
+# NEW IMPORT: LLM usage ledger & token budgets
+# =============================================
+from usage import LEDGER, PatientIdRequired, TokenBudgetExceeded, attribute_usage, budget_model, record_agent_run, timed
+
+# =============================================
+# NEW IMPORT: Admission control / rate limiting
+# =============================================
+from ratelimit import RateLimited, RateLimitMiddleware, admit, admit_subject, client_key, try_admit
+
+# =============================================
+# NEW IMPORT: Async job mode for long-running analyses
+# =============================================
+from jobs import JOBS, JOB_DRAIN_SECONDS
+
+# =============================================
+# NEW IMPORT: Shared memoizing cache for agent tools
+# =============================================
+from tool_cache import TOOL_CACHE
+
+# =============================================
+# NEW IMPORT: LLM router (failover + hedged requests)
+# =============================================
+from llm_router import AGENT_ROUTE, ROUTES, VISION_PROVIDERS
+
+# =============================================
+# NEW IMPORT: orjson responses + gzip/brotli compression
+# =============================================
+from http_encoding import FastJSONResponse, CompressionMiddleware
+
+# =============================================
+# NEW IMPORT: Downsampled chart series for vitals
+# =============================================
+from vitals_series import SERIES_CACHE, VITALS_SERIES_MAX_POINTS
+
+# =============================================
+# NEW IMPORT: Streaming anomaly detection for logged vitals
+# =============================================
+from anomaly import DETECTOR, canonical_metric
+
+# =============================================
+# NEW IMPORT: Incremental re-analysis from per-patient snapshots
+# =============================================
+from analysis_snapshots import SNAPSHOTS, ANALYSIS_PROMPT_CHARS, ANALYSIS_REQUESTS, Plan, render_incremental_prompt
+
+# =============================================
+# NEW IMPORT: Streaming bulk import of wearable / health-app exports
+# =============================================
+from bulk_import import import_file, normalize
+
+# =============================================
+# NEW IMPORT: Columnar payloads for large vitals submissions
+# =============================================
+from columnar import (
+    ColumnarHealthTrackingData, ColumnarTrendRequest, payload_format, render_readings, render_trend_points, trend_values,
+)
+
+# =============================================
+# NEW IMPORT: Record/replay of provider traffic (PROVIDER_CASSETTE_MODE)
+# =============================================
+from cassettes import install_from_env
+
+PROVIDER_CASSETTE = install_from_env()
+
+# =============================================
+# NEW IMPORT: Resized facility photos with an on-disk cache
+# =============================================
+from photo_cache import PHOTOS, PHOTO_REQUESTS, cache_headers, not_modified, photo_etag, snap_width, valid_photo_reference
+
+# =============================================
+# NEW IMPORT: Deadlines and disconnect cancellation for provider work
+# =============================================
+from cancellation import RequestAbandoned, request_deadline, run_in_thread, run_task
+
+# =============================================
+# NEW IMPORT: Opt-in per-request profiling (PROFILE_TOKEN / PROFILE_SAMPLE_RATE)
+# =============================================
+from profiling import ProfilingMiddleware, profiling_enabled
+
+# =============================================
+# NEW IMPORT: Stored vitals/reports and their Parquet / Arrow / CSV export
+# =============================================
+from vitals_store import STORE, CANONICAL_UNITS, to_ts
+from vitals_export import open_export
+
+# =============================================
+# NEW IMPORT: Admin token for operator endpoints that expose patient data
+# =============================================
+from access import require_admin
+
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # --- CORS SETTINGS ---
 origins = [
@@ -39,14 +138,58 @@ origins = [
     "https://www.doctorxcare.in", 
 ]
 #    "https://app.doctorxcare.in",
+
+# --- PROFILING (innermost; only installed when PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set) ---
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# --- RATE LIMITING (inside CORS so 429s stay readable by the browser) ---
+app.add_middleware(RateLimitMiddleware)
+
+# --- COMPRESSION (gzip/brotli for JSON and markdown bodies above a size threshold) ---
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After", "X-Profile-Id"],
 )
 
+# --- TELEMETRY (outermost so upload time and CORS are included) ---
+app.add_middleware(TelemetryMiddleware)
+
+@app.exception_handler(TokenBudgetExceeded)
+async def token_budget_exceeded_handler(request: Request, exc: TokenBudgetExceeded):
+    return FastJSONResponse(status_code=429, content={"success": False, "detail": str(exc)})
+
+@app.exception_handler(PatientIdRequired)
+async def patient_id_required_handler(request: Request, exc: PatientIdRequired):
+    return FastJSONResponse(status_code=400, content={"success": False, "detail": str(exc)})
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return FastJSONResponse(
+        status_code=429,
+        content={"success": False, "detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(RequestAbandoned)
+async def request_abandoned_handler(request: Request, exc: RequestAbandoned):
+    # 499 (client closed request) is never read; 504 tells a waiting client its deadline passed
+    return FastJSONResponse(
+        status_code=504 if exc.reason == "deadline" else 499,
+        content={"success": False, "detail": str(exc)},
+    )
+
+# --- GRACEFUL DRAIN (runs after the server stops accepting connections) ---
+@app.on_event("shutdown")
+async def drain_jobs():
+    await JOBS.drain(JOB_DRAIN_SECONDS)
+
 # ==========================================
 # DATA MODELS
 # ==========================================
@@ -116,36 +259,181 @@ class TrendAnalysisRequest(BaseModel):
     time_range: int = 30  # days
     readings: List[dict]  # Array of {date, value} objects
 
+# Bodies of /analyze and /trend-analysis: the row format above, or the same data as
+# parallel arrays per metric with "format": "columnar" (see columnar.py)
+HealthTrackingPayload = Annotated[
+    Union[Annotated[HealthTrackingData, Tag("rows")], Annotated[ColumnarHealthTrackingData, Tag("columnar")]],
+    Discriminator(payload_format),
+]
+TrendAnalysisPayload = Annotated[
+    Union[Annotated[TrendAnalysisRequest, Tag("rows")], Annotated[ColumnarTrendRequest, Tag("columnar")]],
+    Discriminator(payload_format),
+]
+
+class TrendSeriesRequest(TrendAnalysisRequest):
+    """Request for chart-ready (downsampled) series of the same readings"""
+    points: int = 200   # target points per series after LTTB downsampling
+    buckets: int = 30   # time buckets for the min/avg/max bands
+    context: Optional[str] = None  # e.g. "Post-meal" to use post-meal glucose zones
+
 # --- New Models for AI Doctor ---
 
 class DoctorStartRequest(BaseModel):
     """Start a fresh AI Doctor consultation."""
     patient_name: Optional[str] = "Patient"
+    language: Optional[str] = None   # "en" / "hi" to skip the language question
 
 class DoctorContinueRequest(BaseModel):
     """Continue an ongoing consultation turn."""
     patient_message: str
     history: List[dict]          # serialised Gemini chat history
     turn: int = 0
+    session_id: Optional[str] = None   # returned by /start; used for usage accounting
+    patient_id: Optional[str] = None   # token budget and rate-limit subject; required when budgets are enforced
+    patient_name: Optional[str] = None  # used by the templated greeting after the language choice
 
 # ==========================================
-# SERVICE 1: LAB REPORT & IMAGING ANALYSIS
+# HELPERS
 # ==========================================
-@app.post("/api/medical-analysis")
-async def analyze_medical_image(file: UploadFile = File(...)):
-    try:
-        save_dir = "/tmp" if os.path.exists("/tmp") else "."
-        temp_filename = os.path.join(save_dir, f"temp_{int(time.time())}_{file.filename}")
-        
-        # Save Image Temporarily
+
+def _run_agent(
+    factory,
+    model_id: str,
+    prompt: str,
+    images: Optional[List[str]] = None,
+    patient_id: Optional[str] = None,
+):
+    """
+    Run a phi agent as the request's LLM phase and record its token usage.
+    The agent is built per attempt from ``factory`` so the LLM router can fail
+    over to the next configured model/provider; image prompts stay on
+    vision-capable providers.
+    """
+    def invoke(target):
+        with span("agent_construction"):
+            agent = factory(target.spec)
+        with span("llm_call"), timed() as elapsed:
+            response = agent.run(prompt, images=images)
+        record_agent_run(response, target.model, elapsed["seconds"], provider=target.provider)
+        return response
+
+    with attribute_usage(patient_id=patient_id):
+        return AGENT_ROUTE.call(invoke, prefer=model_id, providers=VISION_PROVIDERS if images else None)
+
+def _save_upload(file: UploadFile, prefix: str) -> Tuple[str, str]:
+    """Persist an upload to the temp dir. Returns (path, sha256 of the content)."""
+    save_dir = "/tmp" if os.path.exists("/tmp") else "."
+    temp_filename = os.path.join(save_dir, f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}_{file.filename}")
+    digest = hashlib.sha256()
+    with span("temp_file_io"):
         with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+                digest.update(chunk)
+                buffer.write(chunk)
+    return temp_filename, digest.hexdigest()
+
+def _remove_temp_file(temp_filename: str) -> None:
+    try:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+            print(f"Deleted temp file: {temp_filename}")
+    except Exception as e:
+        print(f"Warning: Could not delete temp file: {e}")
 
+def _wants_async(request: Request, run_async: bool) -> bool:
+    """Job mode is requested with ?async=true or an RFC 7240 `Prefer: respond-async` header."""
+    return run_async or "respond-async" in request.headers.get("prefer", "").lower()
+
+def _job_key(request: Request, kind: str, content_key: str, patient_id: Optional[str]) -> str:
+    """
+    Dedup key for a job. A client-chosen Idempotency-Key is scoped to the
+    patient (or, without one, the client), so two callers who pick the same
+    key never get each other's job. ``content_key`` already names the patient.
+    """
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key:
+        caller = f"patient:{patient_id}" if patient_id else f"client:{client_key(request.scope)}"
+        return f"{kind}:idem:{caller}:{idempotency_key}"
+    return f"{kind}:{content_key}"
+
+def _submit_job(request: Request, kind: str, fn, *args, patient_id: Optional[str], provider: Optional[str], content_key: str, temp_filename: Optional[str] = None):
+    """
+    Queue a long-running analysis and answer 202 with its job id.
+    Identical resubmissions (same Idempotency-Key, or same payload) reuse the
+    existing job without being charged against the patient's rate limit.
+    """
+    key = _job_key(request, kind, content_key, patient_id)
+    if JOBS.find(key) is None:
+        try:
+            admit_subject(patient_id)
+        except RateLimited:
+            if temp_filename:
+                _remove_temp_file(temp_filename)
+            raise
+    job, created = JOBS.submit(kind, functools.partial(fn, *args), provider=provider, idempotency_key=key)
+    if not created and temp_filename:
+        # The existing job already has its own copy of this upload
+        _remove_temp_file(temp_filename)
+    return _job_accepted(job, created)
+
+def _job_accepted(job, created: bool):
+    return FastJSONResponse(
+        status_code=202,
+        content={
+            "success": True,
+            "job_id": job.job_id,
+            "status": job.status,
+            "deduplicated": not created,
+            "status_url": f"/api/jobs/{job.job_id}",
+        },
+        headers={"Location": f"/api/jobs/{job.job_id}"},
+    )
+
+async def _run_detachable(request: Request, kind: str, fn, *args, patient_id: Optional[str], content_key: str, temp_filename: Optional[str] = None):
+    """
+    Run a job-capable analysis for a synchronous request. If the client
+    disconnects or the deadline passes, the run is adopted as a job under the
+    key the async path uses, so a retry (sync or async) picks it up instead of
+    paying for it again. The Gemini call is admitted only once no such job
+    exists, so a deduplicated retry spends no provider token.
+    """
+    key = _job_key(request, kind, content_key, patient_id)
+    job = JOBS.find(key)
+    if job is not None:
+        if temp_filename:
+            _remove_temp_file(temp_filename)
+        job = await JOBS.wait(job, request_deadline(request))
+        if job.status == "succeeded":
+            return job.result
+        if job.status == "failed":
+            raise HTTPException(status_code=job.status_code or 500, detail=job.error)
+        return _job_accepted(job, created=False)
+
+    try:
+        await admit("gemini", patient_id, priority="routine")
+    except RateLimited:
+        if temp_filename:
+            _remove_temp_file(temp_filename)
+        raise
+
+    def detach(future):
+        return _job_accepted(JOBS.adopt(kind, future, idempotency_key=key), created=True)
+
+    return await run_in_thread(request, kind, fn, *args, detach=detach)
+
+# ==========================================
+# SERVICE 1: LAB REPORT & IMAGING ANALYSIS
+# ==========================================
+def _medical_analysis(temp_filename: str, model_id: str, patient_id: Optional[str]) -> dict:
+    """Run the lab/imaging agent on a saved upload. Shared by the sync and job paths."""
+    try:
         # Run Agent
-        agent = get_medical_agent()
-        response = agent.run(
+        response = _run_agent(
+            get_medical_agent,
+            model_id,
             "Analyze this medical image for red flags and abnormalities.",
-            images=[temp_filename]
+            images=[temp_filename],
+            patient_id=patient_id,
         )
         
         return {"analysis": response.content}
@@ -155,51 +443,47 @@ async def analyze_medical_image(file: UploadFile = File(...)):
         return {"error": str(e)}
     
     finally:
-        time.sleep(1)
-        try:
-            if 'temp_filename' in locals() and os.path.exists(temp_filename):
-                os.remove(temp_filename)
-                print(f"Deleted temp file: {temp_filename}")
-        except Exception as e:
-            print(f"Warning: Could not delete temp file: {e}")
+        with span("cleanup"):
+            time.sleep(1)
+            _remove_temp_file(temp_filename)
+
+@app.post("/api/medical-analysis")
+async def analyze_medical_image(
+    request: Request,
+    file: UploadFile = File(...),
+    patient_id: Optional[str] = None,
+    run_async: bool = Query(default=False, alias="async", description="Return a job id instead of waiting"),
+):
+    model_id = budget_model(patient_id, GEMINI_MODEL)
+
+    try:
+        # Save Image Temporarily
+        temp_filename, digest = _save_upload(file, "temp")
+    except Exception as e:
+        print(f"Error processing request: {str(e)}")
+        return {"error": str(e)}
+
+    if _wants_async(request, run_async):
+        return _submit_job(
+            request, "medical-analysis", _medical_analysis, temp_filename, model_id, patient_id,
+            patient_id=patient_id, provider="gemini", content_key=f"{patient_id}:{digest}", temp_filename=temp_filename,
+        )
+
+    return await _run_detachable(
+        request, "medical-analysis", _medical_analysis, temp_filename, model_id, patient_id,
+        patient_id=patient_id, content_key=f"{patient_id}:{digest}", temp_filename=temp_filename,
+    )
 
 # ==========================================
 # SERVICE 2: CHRONIC CARE & HEALTH TRACKING
 # ==========================================
 
-@app.post("/api/health-tracking/scan-report")
-async def scan_health_report(
-    file: UploadFile = File(...),
-    patient_id: str = "demo_patient",
-    condition: str = "General"
-):
-    """
-    NEW ENDPOINT: Scan and extract data from medical reports (Lab reports, BP logs, etc.)
-    Supports: PNG, JPG, JPEG, PDF
-    Returns: Structured vital signs data extracted from the report
-    """
+def _scan_report(temp_filename: str, filename: str, patient_id: str, condition: str, model_id: str) -> dict:
+    """Extract structured vitals from a saved report upload. Shared by the sync and job paths."""
     try:
-        # Validate file type
-        allowed_extensions = ['.png', '.jpg', '.jpeg', '.pdf']
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file type. Please upload PNG, JPG, or PDF files."
-            )
-        
-        # Save file temporarily
-        save_dir = "/tmp" if os.path.exists("/tmp") else "."
-        temp_filename = os.path.join(save_dir, f"health_report_{int(time.time())}_{file.filename}")
-        
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         # Use Report Extraction Agent
-        agent = get_report_extraction_agent()
-        response = agent.run(
-            f"""Extract vital signs data from this health report.
+        with span("prompt_build"):
+            prompt = f"""Extract vital signs data from this health report.
             
 Patient Condition: {condition}
 
@@ -229,20 +513,19 @@ Return ONLY a valid JSON object with this structure:
   "summary": "Brief summary of findings"
 }}
 
-If no data is found for a category, use an empty array [].""",
-            images=[temp_filename]
-        )
+If no data is found for a category, use an empty array []."""
+        response = _run_agent(get_report_extraction_agent, model_id, prompt, images=[temp_filename], patient_id=patient_id)
         
         # Parse AI response to extract JSON
         content = response.content
         
         # Try to extract JSON from the response
         import re
-        json_match = re.search(r'\{[\s\S]*\}', content)
-        
-        if json_match:
-            extracted_data = json.loads(json_match.group())
-        else:
+        with span("json_parse"):
+            json_match = re.search(r'\{[\s\S]*\}', content)
+            extracted_data = json.loads(json_match.group()) if json_match else None
+
+        if extracted_data is None:
             # If no JSON found, return raw content for debugging
             extracted_data = {
                 "raw_response": content,
@@ -253,20 +536,20 @@ If no data is found for a category, use an empty array [].""",
                 "error": "Could not parse structured data from report"
             }
         
-        # Clean up temp file
-        try:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-        except Exception as e:
-            print(f"Warning: Could not delete temp file: {e}")
-        
+        scanned_at = datetime.now()
+        with span("vitals_store"):
+            STORE.save_report(
+                patient_id, "scan-report", to_ts(scanned_at), extracted_data,
+                condition=condition, filename=filename, summary=extracted_data.get("summary"),
+            )
+
         return {
             "success": True,
             "patient_id": patient_id,
             "condition": condition,
-            "filename": file.filename,
+            "filename": filename,
             "extracted_data": extracted_data,
-            "scanned_at": datetime.now().isoformat()
+            "scanned_at": scanned_at.isoformat()
         }
         
     except json.JSONDecodeError as e:
@@ -280,15 +563,58 @@ If no data is found for a category, use an empty array [].""",
         print(f"Report Scanning Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Report scanning failed: {str(e)}")
 
-@app.post("/api/health-tracking/analyze")
-async def analyze_health_tracking(data: HealthTrackingData):
+    finally:
+        # Clean up temp file
+        with span("temp_file_io"):
+            _remove_temp_file(temp_filename)
+
+@app.post("/api/health-tracking/scan-report")
+async def scan_health_report(
+    request: Request,
+    file: UploadFile = File(...),
+    patient_id: str = "demo_patient",
+    condition: str = "General",
+    run_async: bool = Query(default=False, alias="async", description="Return a job id instead of waiting"),
+):
     """
-    Comprehensive health tracking analysis for chronic conditions
-    Analyzes vitals, detects trends, and provides personalized recommendations
+    NEW ENDPOINT: Scan and extract data from medical reports (Lab reports, BP logs, etc.)
+    Supports: PNG, JPG, JPEG, PDF
+    Returns: Structured vital signs data extracted from the report
+    With `?async=true` (or `Prefer: respond-async`) returns 202 and a job id to poll.
     """
+    model_id = budget_model(patient_id, GEMINI_MODEL)
+
+    # Validate file type
+    allowed_extensions = ['.png', '.jpg', '.jpeg', '.pdf']
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    
+    if file_ext not in allowed_extensions:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Unsupported file type. Please upload PNG, JPG, or PDF files."
+        )
+
     try:
-        # Build comprehensive data summary for AI agent
-        tracking_summary = f"""
+        # Save file temporarily
+        temp_filename, digest = _save_upload(file, "health_report")
+    except Exception as e:
+        print(f"Report Scanning Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Report scanning failed: {str(e)}")
+
+    if _wants_async(request, run_async):
+        return _submit_job(
+            request, "scan-report", _scan_report, temp_filename, file.filename, patient_id, condition, model_id,
+            patient_id=patient_id, provider="gemini", content_key=f"{patient_id}:{condition}:{digest}", temp_filename=temp_filename,
+        )
+
+    return await _run_detachable(
+        request, "scan-report", _scan_report, temp_filename, file.filename, patient_id, condition, model_id,
+        patient_id=patient_id, content_key=f"{patient_id}:{condition}:{digest}", temp_filename=temp_filename,
+    )
+
+def _build_tracking_summary(data: HealthTrackingPayload) -> str:
+    """Render a health tracking submission (row or columnar) into the tracking agent's prompt."""
+    tracking_summary = f"""
 ## PATIENT HEALTH TRACKING DATA
 
 **Patient ID:** {data.patient_id}
@@ -296,141 +622,240 @@ async def analyze_health_tracking(data: HealthTrackingData):
 **Analysis Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
 """
-        
-        # Add Blood Pressure Data
-        if data.blood_pressure and len(data.blood_pressure) > 0:
-            tracking_summary += "\n### BLOOD PRESSURE READINGS:\n"
-            for reading in data.blood_pressure:
-                tracking_summary += f"- Date: {reading.date} | Systolic: {reading.systolic} mmHg | Diastolic: {reading.diastolic} mmHg"
-                if reading.pulse:
-                    tracking_summary += f" | Pulse: {reading.pulse} bpm"
-                if reading.context:
-                    tracking_summary += f" | Context: {reading.context}"
-                if reading.notes:
-                    tracking_summary += f" | Notes: {reading.notes}"
-                tracking_summary += "\n"
-        
-        # Add Blood Glucose Data
-        if data.blood_glucose and len(data.blood_glucose) > 0:
-            tracking_summary += "\n### BLOOD GLUCOSE READINGS:\n"
-            for reading in data.blood_glucose:
-                tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}"
-                if reading.context:
-                    tracking_summary += f" | Context: {reading.context}"
-                if reading.notes:
-                    tracking_summary += f" | Notes: {reading.notes}"
-                tracking_summary += "\n"
-        
-        # Add Heart Rate Data
-        if data.heart_rate and len(data.heart_rate) > 0:
-            tracking_summary += "\n### HEART RATE READINGS:\n"
-            for reading in data.heart_rate:
-                tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}"
-                if reading.context:
-                    tracking_summary += f" | Context: {reading.context}"
-                tracking_summary += "\n"
-        
-        # Add Weight Data
-        if data.weight and len(data.weight) > 0:
-            tracking_summary += "\n### WEIGHT READINGS:\n"
-            for reading in data.weight:
+
+    if isinstance(data, ColumnarHealthTrackingData):
+        tracking_summary += render_readings(data)
+    else:
+        tracking_summary += _render_reading_rows(data)
+    
+    # Add Symptoms if provided
+    if data.symptoms:
+        tracking_summary += f"\n### REPORTED SYMPTOMS:\n{data.symptoms}\n"
+    
+    # Add Lifestyle Changes
+    if data.lifestyle_changes:
+        tracking_summary += f"\n### LIFESTYLE MODIFICATIONS:\n{data.lifestyle_changes}\n"
+    
+    # Add Medications
+    if data.medications and len(data.medications) > 0:
+        tracking_summary += "\n### CURRENT MEDICATIONS:\n"
+        for med in data.medications:
+            tracking_summary += f"- {med.get('name', 'Unknown')} - {med.get('dosage', 'N/A')} - {med.get('frequency', 'N/A')}\n"
+
+    return tracking_summary
+
+def _render_reading_rows(data: HealthTrackingData) -> str:
+    """The readings part of the tracking prompt for the row format."""
+    tracking_summary = ""
+
+    # Add Blood Pressure Data
+    if data.blood_pressure and len(data.blood_pressure) > 0:
+        tracking_summary += "\n### BLOOD PRESSURE READINGS:\n"
+        for reading in data.blood_pressure:
+            tracking_summary += f"- Date: {reading.date} | Systolic: {reading.systolic} mmHg | Diastolic: {reading.diastolic} mmHg"
+            if reading.pulse:
+                tracking_summary += f" | Pulse: {reading.pulse} bpm"
+            if reading.context:
+                tracking_summary += f" | Context: {reading.context}"
+            if reading.notes:
+                tracking_summary += f" | Notes: {reading.notes}"
+            tracking_summary += "\n"
+    
+    # Add Blood Glucose Data
+    if data.blood_glucose and len(data.blood_glucose) > 0:
+        tracking_summary += "\n### BLOOD GLUCOSE READINGS:\n"
+        for reading in data.blood_glucose:
+            tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}"
+            if reading.context:
+                tracking_summary += f" | Context: {reading.context}"
+            if reading.notes:
+                tracking_summary += f" | Notes: {reading.notes}"
+            tracking_summary += "\n"
+    
+    # Add Heart Rate Data
+    if data.heart_rate and len(data.heart_rate) > 0:
+        tracking_summary += "\n### HEART RATE READINGS:\n"
+        for reading in data.heart_rate:
+            tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}"
+            if reading.context:
+                tracking_summary += f" | Context: {reading.context}"
+            tracking_summary += "\n"
+    
+    # Add Weight Data
+    if data.weight and len(data.weight) > 0:
+        tracking_summary += "\n### WEIGHT READINGS:\n"
+        for reading in data.weight:
+            tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
+    
+    # Add Oxygen Saturation
+    if data.oxygen_saturation and len(data.oxygen_saturation) > 0:
+        tracking_summary += "\n### OXYGEN SATURATION (SpO₂) READINGS:\n"
+        for reading in data.oxygen_saturation:
+            tracking_summary += f"- Date: {reading.date} | Value: {reading.value}%"
+            if reading.notes:
+                tracking_summary += f" | Notes: {reading.notes}"
+            tracking_summary += "\n"
+    
+    # Add Thyroid Data if applicable
+    if data.condition.lower() == "thyroid":
+        if data.tsh and len(data.tsh) > 0:
+            tracking_summary += "\n### TSH LEVELS:\n"
+            for reading in data.tsh:
                 tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
         
-        # Add Oxygen Saturation
-        if data.oxygen_saturation and len(data.oxygen_saturation) > 0:
-            tracking_summary += "\n### OXYGEN SATURATION (SpO₂) READINGS:\n"
-            for reading in data.oxygen_saturation:
-                tracking_summary += f"- Date: {reading.date} | Value: {reading.value}%"
-                if reading.notes:
-                    tracking_summary += f" | Notes: {reading.notes}"
-                tracking_summary += "\n"
-        
-        # Add Thyroid Data if applicable
-        if data.condition.lower() == "thyroid":
-            if data.tsh and len(data.tsh) > 0:
-                tracking_summary += "\n### TSH LEVELS:\n"
-                for reading in data.tsh:
-                    tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
-            
-            if data.t3 and len(data.t3) > 0:
-                tracking_summary += "\n### T3 LEVELS:\n"
-                for reading in data.t3:
-                    tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
-            
-            if data.t4 and len(data.t4) > 0:
-                tracking_summary += "\n### FREE T4 LEVELS:\n"
-                for reading in data.t4:
-                    tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
-        
-        # Add Symptoms if provided
-        if data.symptoms:
-            tracking_summary += f"\n### REPORTED SYMPTOMS:\n{data.symptoms}\n"
-        
-        # Add Lifestyle Changes
-        if data.lifestyle_changes:
-            tracking_summary += f"\n### LIFESTYLE MODIFICATIONS:\n{data.lifestyle_changes}\n"
-        
-        # Add Medications
-        if data.medications and len(data.medications) > 0:
-            tracking_summary += "\n### CURRENT MEDICATIONS:\n"
-            for med in data.medications:
-                tracking_summary += f"- {med.get('name', 'Unknown')} - {med.get('dosage', 'N/A')} - {med.get('frequency', 'N/A')}\n"
+        if data.t3 and len(data.t3) > 0:
+            tracking_summary += "\n### T3 LEVELS:\n"
+            for reading in data.t3:
+                tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
         
+        if data.t4 and len(data.t4) > 0:
+            tracking_summary += "\n### FREE T4 LEVELS:\n"
+            for reading in data.t4:
+                tracking_summary += f"- Date: {reading.date} | Value: {reading.value} {reading.unit}\n"
+
+    return tracking_summary
+
+def _cached_analysis(plan) -> dict:
+    """Stored result for an identical resubmission."""
+    ANALYSIS_REQUESTS.inc(mode="cached")
+    return {**plan.base.result, "analysis_mode": "cached", "new_readings": 0}
+
+def _plan_analysis(data: HealthTrackingPayload) -> Tuple[Plan, Optional[str]]:
+    """Snapshot plan for a submission and, unless it is cached, the payload digest used as its job key."""
+    plan = SNAPSHOTS.plan(data)
+    if plan.mode == "cached":
+        return plan, None
+    return plan, hashlib.sha256(data.model_dump_json().encode("utf-8")).hexdigest()
+
+def _health_tracking_analysis(data: HealthTrackingPayload, model_id: str, plan=None) -> dict:
+    """Run the chronic-care agent over a submission. Shared by the sync and job paths."""
+    try:
+        # Identical resubmissions reuse the stored analysis; pure additions only send the delta
+        plan = plan or SNAPSHOTS.plan(data)
+        if plan.mode == "cached":
+            return _cached_analysis(plan)
+
+        # Build comprehensive data summary for AI agent
+        with span("prompt_build"):
+            if plan.mode == "incremental":
+                tracking_summary = render_incremental_prompt(plan, _build_tracking_summary(plan.delta))
+            else:
+                tracking_summary = _build_tracking_summary(data)
+        ANALYSIS_PROMPT_CHARS.observe(len(tracking_summary), mode=plan.mode)
+        ANALYSIS_REQUESTS.inc(mode=plan.mode)
+
         # Get AI Agent and Analyze
-        agent = get_health_tracking_agent()
-        response = agent.run(tracking_summary)
+        response = _run_agent(get_health_tracking_agent, model_id, tracking_summary, patient_id=data.patient_id)
         
-        return {
+        result = {
             "success": True,
             "patient_id": data.patient_id,
             "condition": data.condition,
             "analysis": response.content,
-            "analyzed_at": datetime.now().isoformat()
+            "analyzed_at": datetime.now().isoformat(),
+            "analysis_mode": plan.mode,
+            "readings_analyzed": plan.fingerprint.total,
+            "new_readings": plan.new_readings,
         }
+        SNAPSHOTS.save(data, plan, result)
+        with span("vitals_store"):
+            STORE.save_report(
+                data.patient_id, "tracking-analysis", to_ts(datetime.now()), result,
+                condition=data.condition, summary=response.content,
+            )
+        return result
         
     except Exception as e:
         print(f"Health Tracking Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/api/health-tracking/analyze")
+async def analyze_health_tracking(
+    request: Request,
+    data: HealthTrackingPayload,
+    run_async: bool = Query(default=False, alias="async", description="Return a job id instead of waiting"),
+):
+    """
+    Comprehensive health tracking analysis for chronic conditions
+    Analyzes vitals, detects trends, and provides personalized recommendations
+    With `?async=true` (or `Prefer: respond-async`) returns 202 and a job id to poll.
+    Resubmitting an unchanged history returns the stored analysis immediately
+    (`analysis_mode: "cached"`); adding readings re-analyses only the new ones
+    against the previous summary (`analysis_mode: "incremental"`).
+    Large histories can be sent as parallel arrays per metric (`"format": "columnar"`).
+    """
+    # Fingerprinting and hashing a long history is CPU work; keep it off the event loop
+    plan, digest = await asyncio.to_thread(_plan_analysis, data)
+    if plan.mode == "cached":
+        return _cached_analysis(plan)
+
+    model_id = budget_model(data.patient_id, GEMINI_MODEL)
+
+    if _wants_async(request, run_async):
+        return _submit_job(
+            request, "health-tracking-analyze", _health_tracking_analysis, data, model_id,
+            patient_id=data.patient_id, provider="gemini", content_key=f"{data.patient_id}:{digest}",
+        )
+
+    return await _run_detachable(
+        request, "health-tracking-analyze", _health_tracking_analysis, data, model_id, plan,
+        patient_id=data.patient_id, content_key=f"{data.patient_id}:{digest}",
+    )
+
 @app.post("/api/health-tracking/trend-analysis")
-async def trend_analysis(data: TrendAnalysisRequest):
+async def trend_analysis(request: Request, data: TrendAnalysisPayload):
     """
     Generate trend insights and visualization recommendations
+    Readings can also be sent as parallel arrays (`"format": "columnar"`).
     """
+    model_id = budget_model(data.patient_id, GEMINI_MODEL)
+    await admit("gemini", data.patient_id, priority="routine")
     try:
+        columnar = isinstance(data, ColumnarTrendRequest)
+
         # Build trend data summary
-        trend_summary = f"""
+        with span("prompt_build"):
+            trend_summary = f"""
 ## TREND ANALYSIS REQUEST
 
 **Patient ID:** {data.patient_id}
 **Metric Type:** {data.metric_type}
 **Time Range:** Last {data.time_range} days
-**Total Readings:** {len(data.readings)}
+**Total Readings:** {len(data.columns) if columnar else len(data.readings)}
 
 ### DATA POINTS:
 """
-        # Add all readings
-        for reading in data.readings:
-            trend_summary += f"- Date: {reading.get('date')} | Value: {reading.get('value')} {reading.get('unit', '')}\n"
-        
-        # Calculate basic statistics
-        values = [r.get('value', 0) for r in data.readings if r.get('value') is not None]
-        if values:
-            avg_value = sum(values) / len(values)
-            min_value = min(values)
-            max_value = max(values)
-            
-            trend_summary += f"""
+            stats = None
+            if columnar:
+                trend_summary += render_trend_points(data.columns)
+                values = trend_values(data.columns)
+                if len(values):
+                    stats = (float(values.mean()), float(values.min()), float(values.max()))
+            else:
+                # Add all readings
+                for reading in data.readings:
+                    trend_summary += f"- Date: {reading.get('date')} | Value: {reading.get('value')} {reading.get('unit', '')}\n"
+                
+                # Calculate basic statistics
+                values = [r.get('value', 0) for r in data.readings if r.get('value') is not None]
+                if values:
+                    stats = (sum(values) / len(values), min(values), max(values))
+
+            if stats:
+                avg_value, min_value, max_value = stats
+                
+                trend_summary += f"""
 ### STATISTICAL SUMMARY:
 - Average: {avg_value:.2f}
 - Minimum: {min_value:.2f}
 - Maximum: {max_value:.2f}
 - Range: {max_value - min_value:.2f}
 """
-        
+            
         # Get Trend Visualization Agent
-        agent = get_trend_visualization_agent()
-        response = agent.run(trend_summary)
+        response = await run_in_thread(
+            request, "trend-analysis", _run_agent, get_trend_visualization_agent, model_id, trend_summary, None, data.patient_id,
+        )
         
         return {
             "success": True,
@@ -439,52 +864,195 @@ async def trend_analysis(data: TrendAnalysisRequest):
             "time_range": data.time_range,
             "insights": response.content,
             "statistics": {
-                "average": round(avg_value, 2) if values else 0,
-                "min": round(min_value, 2) if values else 0,
-                "max": round(max_value, 2) if values else 0,
+                "average": round(avg_value, 2) if stats else 0,
+                "min": round(min_value, 2) if stats else 0,
+                "max": round(max_value, 2) if stats else 0,
                 "total_readings": len(values)
             }
         }
         
+    except RequestAbandoned:
+        raise
     except Exception as e:
         print(f"Trend Analysis Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Trend analysis failed: {str(e)}")
 
+@app.post("/api/health-tracking/trend-series")
+async def trend_series(data: TrendSeriesRequest):
+    """
+    Chart-ready series for the trend view: LTTB-downsampled points, min/avg/max
+    bands per time bucket and reference-range zones. Blood pressure readings
+    ({date, systolic, diastolic}) yield a series each for systolic and diastolic.
+    No LLM call; results are cached per (patient, metric, range).
+    """
+    if not 3 <= data.points <= VITALS_SERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points must be between 3 and {VITALS_SERIES_MAX_POINTS}.")
+    if not 1 <= data.buckets <= 500:
+        raise HTTPException(status_code=400, detail="buckets must be between 1 and 500.")
+
+    try:
+        with span("series_build"):
+            series, cached = SERIES_CACHE.get_or_build(
+                data.patient_id, data.metric_type, data.time_range,
+                data.readings, data.points, data.buckets, data.context,
+            )
+
+        return {
+            "success": True,
+            "patient_id": data.patient_id,
+            "metric_type": data.metric_type,
+            "time_range": data.time_range,
+            "total_readings": len(data.readings),
+            "cached": cached,
+            "series": series,
+        }
+
+    except Exception as e:
+        print(f"Trend Series Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Trend series failed: {str(e)}")
+
 @app.post("/api/health-tracking/quick-log")
 async def quick_vital_log(
     patient_id: str,
     metric_type: str,
     value: float,
     unit: str,
-    context: Optional[str] = None
+    context: Optional[str] = None,
+    diastolic: Optional[float] = None,  # with metric_type "blood_pressure", value is systolic
 ):
     """
     Quick endpoint for logging a single vital sign reading
     Useful for mobile apps and quick entries
+    Each reading is checked against emergency thresholds and the patient's own
+    recent baseline; any alerts come back inline in `alerts` (no LLM call).
+    Readings are kept in the vitals store (see /api/health-tracking/export);
+    `data.stored` is false when the unit isn't recognised, the value is implausible,
+    or the same metric was already logged this second. Such readings are not
+    checked (`alerts` and `status` are empty) and don't affect the baseline.
     """
     try:
+        now = datetime.now()
+        logged_at = to_ts(now)
         log_entry = {
             "patient_id": patient_id,
             "metric_type": metric_type,
             "value": value,
             "unit": unit,
             "context": context,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now.isoformat()
         }
-        
-        # In production, this would save to database
-        # For now, return success with the logged data
+        if diastolic is not None:
+            log_entry["diastolic"] = diastolic
+
+        # Stored under canonical metric names and units like imported readings;
+        # blood pressure as systolic + diastolic rows
+        if diastolic is not None:
+            readings = [("systolic", value), ("diastolic", diastolic)]
+        else:
+            readings = [(canonical_metric(metric_type), value)]
+        rows = []
+        for metric, reading in readings:
+            canonical, _ = normalize(metric, reading, unit)
+            if canonical is not None:
+                rows.append((patient_id, metric, logged_at, canonical, CANONICAL_UNITS.get(metric, unit), context, "quick-log"))
+        with span("vitals_store"):
+            # SQLite may wait on a bulk import's write lock; keep that off the event loop
+            inserted = await asyncio.to_thread(STORE.write_batch, rows, "quick-log")
+        # False for an unrecognised unit, an implausible value, or a reading already logged this second
+        log_entry["stored"] = inserted == len(readings)
+
+        alerts, statuses = [], []
+        # A rejected reading was never saved; it must not move the patient's baseline or raise alerts
+        with span("anomaly_check"):
+            if log_entry["stored"]:
+                alerts, status = DETECTOR.observe(patient_id, metric_type, value, unit, context)
+                statuses.append(status)
+            if log_entry["stored"] and diastolic is not None:
+                more, status = DETECTOR.observe(patient_id, "diastolic", diastolic, unit, context)
+                alerts += more
+                statuses.append(status)
+            for alert in alerts:
+                if "emergency_level" in alert:
+                    alert["emergency"] = get_emergency_info(alert["emergency_level"])
         
         return {
             "success": True,
             "message": f"{metric_type.replace('_', ' ').title()} logged successfully",
-            "data": log_entry
+            "data": log_entry,
+            "alerts": alerts,
+            "status": statuses,
         }
         
     except Exception as e:
         print(f"Quick Log Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Logging failed: {str(e)}")
 
+@app.get("/api/health-tracking/export", dependencies=[Depends(require_admin)])
+async def export_health_data(
+    patient_id: str,
+    dataset: str = Query(default="vitals", description="vitals or reports"),
+    format: str = Query(default="parquet", description="parquet, arrow (IPC stream) or csv"),
+    metric: Optional[List[str]] = Query(
+        default=None,
+        description="Metrics to include (vitals) or report kinds (reports: scan-report, tracking-analysis); repeatable",
+    ),
+    start: Optional[str] = Query(default=None, description="From this date (YYYY-MM-DD or ISO datetime)"),
+    end: Optional[str] = Query(default=None, description="Up to this date or datetime, inclusive"),
+):
+    """
+    Bulk export of a patient's stored vitals (quick-log and imports) or their
+    extracted reports and analyses, as Parquet, Arrow IPC or CSV.
+    The file is streamed one row group at a time, and the metric and date filters
+    are applied in the store, so multi-year exports are never held in memory.
+    Operator endpoint: needs the admin bearer token (see access.py).
+    """
+    try:
+        export = open_export(patient_id, dataset, format, metric, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        export.chunks,
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename}"'},
+    )
+
+def _bulk_import(temp_filename: str, filename: str, patient_id: str, fmt: str, dayfirst: bool) -> dict:
+    """Stream a saved export into the vitals store. Runs as a job; progress is on the job."""
+    try:
+        with span("bulk_import"):
+            return import_file(temp_filename, patient_id, fmt=fmt, dayfirst=dayfirst, filename=filename)
+    finally:
+        _remove_temp_file(temp_filename)
+
+@app.post("/api/health-tracking/import")
+async def import_health_export(
+    request: Request,
+    file: UploadFile = File(...),
+    patient_id: str = "demo_patient",
+    format: str = Query(default="auto", description="auto, apple_health or csv"),
+    dayfirst: bool = Query(default=True, description="Read ambiguous CSV dates as DD/MM"),
+):
+    """
+    Bulk import of a wearable or health-app export: Apple Health export.xml / export.zip,
+    or CSV from Google Fit, Samsung Health or glucometer software.
+    The file is streamed into the vitals store in batches, so imports always run as a job:
+    returns 202 and a job id; poll `status_url` for progress and the import summary.
+    """
+    if format not in ("auto", "apple_health", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported format. Use auto, apple_health or csv.")
+
+    try:
+        temp_filename, digest = _save_upload(file, "health_import")
+    except Exception as e:
+        print(f"Health Import Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+
+    admit_subject(patient_id)
+    return _submit_job(
+        request, "health-import", _bulk_import, temp_filename, file.filename, patient_id, format, dayfirst,
+        provider=None, content_key=f"{patient_id}:{format}:{dayfirst}:{digest}", temp_filename=temp_filename,
+    )
+
 
 # ==========================================
 # SERVICE 3: NEARBY MEDICAL FACILITY FINDER
@@ -492,6 +1060,7 @@ async def quick_vital_log(
 
 @app.get("/api/v1/nearby-finder")
 async def nearby_medical_finder(
+    request: Request,
     latitude: float = Query(..., description="User's current latitude", ge=-90, le=90),
     longitude: float = Query(..., description="User's current longitude", ge=-180, le=180),
     facility_type: str = Query(
@@ -503,6 +1072,12 @@ async def nearby_medical_finder(
         description="Search radius in meters (default varies by facility type, max 50000)",
         ge=100,
         le=50000
+    ),
+    limit: Optional[int] = Query(
+        default=None,
+        description="Return at most this many facilities (the nearest ones with the offline index)",
+        ge=1,
+        le=200
     )
 ):
     """
@@ -517,14 +1092,29 @@ async def nearby_medical_finder(
     - `pharmacy`  — Pharmacies & drug stores (3 km radius)
     - `doctor`    — Specialist clinics & GPs (5 km radius)
     - `clinic`    — Outpatient clinics (5 km radius)
+
+    `emergency` searches are admitted ahead of all other provider traffic.
+
+    When an offline OpenStreetMap index is configured (`FACILITY_INDEX_PATH`)
+    results come from it, nearest first, with `distance_m`; Places then only
+    adds ratings, `open_now` and photos, and is skipped when it is busy.
     """
+    priority = "emergency" if facility_type.strip().lower() == "emergency" else "interactive"
+    enrich = True
+    if has_offline_index():
+        enrich = try_admit("places", priority)
+    else:
+        await admit("places", priority=priority)
     try:
-        facilities = await get_nearby_facilities(
-            latitude=latitude,
-            longitude=longitude,
-            facility_type=facility_type,
-            radius=radius,
-        )
+        with span("places_call"):
+            facilities = await run_task(request, "nearby-finder", "places", get_nearby_facilities(
+                latitude=latitude,
+                longitude=longitude,
+                facility_type=facility_type,
+                radius=radius,
+                limit=limit,
+                enrich=enrich,
+            ))
 
         return {
             "success": True,
@@ -535,6 +1125,8 @@ async def nearby_medical_finder(
             "fetched_at": datetime.now().isoformat(),
         }
 
+    except RequestAbandoned:
+        raise
     except ValueError as e:
         # Bad input — 400
         raise HTTPException(status_code=400, detail=str(e))
@@ -549,8 +1141,96 @@ async def nearby_medical_finder(
         )
 
 
+@app.get("/api/v1/nearby-finder/multi")
+async def nearby_medical_finder_multi(
+    request: Request,
+    latitude: float = Query(..., description="User's current latitude", ge=-90, le=90),
+    longitude: float = Query(..., description="User's current longitude", ge=-180, le=180),
+    facility_types: List[str] = Query(
+        default=["emergency", "hospital", "clinic"],
+        description="Facility types in priority order, repeated or comma-separated "
+                    "(e.g. `emergency,hospital,clinic`)",
+    ),
+    radius: Optional[int] = Query(
+        default=None,
+        description="Search radius in meters (default varies by facility type, max 50000)",
+        ge=100,
+        le=50000
+    ),
+    limit: Optional[int] = Query(
+        default=None,
+        description="Return at most this many facilities in total, after merging",
+        ge=1,
+        le=200
+    )
+):
+    """
+    Search several facility types in one call — e.g. `emergency`, `hospital`
+    and `clinic` when a patient needs help now.
+
+    The Places searches run concurrently, so the call takes about as long as
+    the slowest single search. Results are merged into one ranked list with
+    each place listed once; `matched_types` says which searches found it.
+    Places found by the earlier requested types come first, then those
+    matched by more types, then the nearest (with the offline index) or the
+    higher-rated ones (without it).
+
+    If some searches fail, the rest are returned and the failures are listed
+    in `failed_types`. Searches including `emergency` are admitted ahead of
+    all other provider traffic.
+    """
+    types = list(dict.fromkeys(t.strip().lower() for value in facility_types for t in value.split(",") if t.strip()))
+    unsupported = [t for t in types if t not in FACILITY_TYPE_MAP]
+    if unsupported:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported facility_type(s) {unsupported}. Allowed values: {list(FACILITY_TYPE_MAP.keys())}",
+        )
+    priority = "emergency" if "emergency" in types else "interactive"
+    enrich = True
+    # One admission per request: the per-type searches run together as one user action
+    if has_offline_index():
+        enrich = try_admit("places", priority)
+    else:
+        await admit("places", priority=priority)
+    try:
+        with span("places_call"):
+            result = await run_task(request, "nearby-finder-multi", "places", search_facility_types(
+                latitude=latitude,
+                longitude=longitude,
+                facility_types=types,
+                radius=radius,
+                limit=limit,
+                enrich=enrich,
+            ))
+
+        return {
+            "success": True,
+            "facility_types": result["facility_types"],
+            "total": len(result["facilities"]),
+            "per_type": result["per_type"],
+            "failed_types": result["failed_types"],
+            "location": {"latitude": latitude, "longitude": longitude},
+            "facilities": result["facilities"],
+            "fetched_at": datetime.now().isoformat(),
+        }
+
+    except RequestAbandoned:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        print(f"Nearby Finder (multi) Error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="An unexpected error occurred while searching for facilities."
+        )
+
+
 @app.get("/api/v1/facility-details/{place_id}")
-async def facility_details(place_id: str):
+async def facility_details(request: Request, place_id: str):
     """
     Get detailed information for a specific medical facility.
 
@@ -560,13 +1240,17 @@ async def facility_details(place_id: str):
     if not place_id or len(place_id.strip()) < 5:
         raise HTTPException(status_code=400, detail="Invalid place_id provided.")
 
+    await admit("places")
     try:
-        details = await get_place_details(place_id=place_id)
+        with span("places_call"):
+            details = await run_task(request, "facility-details", "places", get_place_details(place_id=place_id))
         return {
             "success": True,
             "details": details,
             "fetched_at": datetime.now().isoformat(),
         }
+    except RequestAbandoned:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except RuntimeError as e:
@@ -579,6 +1263,52 @@ async def facility_details(place_id: str):
         )
 
 
+async def _fetch_facility_photo(photo_reference: str, max_width: int) -> bytes:
+    await admit("places")
+    with span("places_call"):
+        return await fetch_place_photo(photo_reference, max_width)
+
+
+@app.get("/api/v1/facility-photo/{photo_reference}")
+async def facility_photo(
+    request: Request,
+    photo_reference: str,
+    width: int = Query(default=400, ge=16, le=1600, description="Thumbnail width in px; rounded up to a supported size"),
+):
+    """
+    Serve a facility photo (the photo_reference from nearby results) as a JPEG thumbnail.
+
+    The source image is fetched from Google once and cached on disk with its
+    resized variants; responses are immutable and honour If-None-Match.
+    """
+    if not valid_photo_reference(photo_reference):
+        raise HTTPException(status_code=400, detail="Invalid photo_reference provided.")
+
+    width = snap_width(width)
+    headers = cache_headers(photo_etag(photo_reference, width))
+    if not_modified(request.headers.get("if-none-match"), headers["ETag"]):
+        PHOTO_REQUESTS.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    try:
+        with span("photo_cache"):
+            data = await PHOTOS.get(photo_reference, width, _fetch_facility_photo)
+        return Response(content=data, media_type="image/jpeg", headers=headers)
+    except RateLimited:
+        # Places admission only happens on a cache miss, inside the try
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        print(f"Facility Photo Error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="An unexpected error occurred while fetching the facility photo."
+        )
+
+
 # ==========================================
 # SERVICE 4: AI DOCTOR CONSULTATION
 # ==========================================
@@ -589,9 +1319,10 @@ async def ai_doctor_start(data: DoctorStartRequest):
     Start a new AI Doctor consultation session.
     Returns the doctor's opening greeting and first question.
     The session history must be passed back on every subsequent call.
+    The opening is templated, so no model is called here.
     """
     try:
-        result = start_consultation()
+        result = start_consultation(language=data.language, patient_name=data.patient_name)
         return {
             "success": True,
             "session_id": result["session_id"],
@@ -599,6 +1330,7 @@ async def ai_doctor_start(data: DoctorStartRequest):
             "assessment_ready": False,
             "response": result["response"],
             "history": result["history"],
+            "language": result["language"],
         }
     except Exception as e:
         print(f"AI Doctor Start Error: {str(e)}")
@@ -606,7 +1338,7 @@ async def ai_doctor_start(data: DoctorStartRequest):
 
 
 @app.post("/api/ai-doctor/respond")
-async def ai_doctor_respond(data: DoctorContinueRequest):
+async def ai_doctor_respond(request: Request, data: DoctorContinueRequest):
     """
     Send the patient's reply and receive the next question or final assessment.
 
@@ -623,12 +1355,27 @@ async def ai_doctor_respond(data: DoctorContinueRequest):
     - red_flags
     - summary
     """
-    try:
-        result = continue_consultation(
-            patient_message=data.patient_message,
-            history=data.history,
-            turn=data.turn,
+    # A bare language choice after the templated opening needs no model call
+    result = scripted_turn(data.patient_message, data.history, data.turn, data.patient_name)
+    if result is None:
+        model = budget_model(data.patient_id, GROQ_MODEL)
+        # Admitted against the provider the route will try first (Gemini when Groq is cooling down);
+        # a red-flag symptom in this message jumps its queue
+        await admit(
+            turn_provider(model), data.patient_id or data.session_id,
+            priority=turn_priority(data.patient_message),
         )
+    try:
+        if result is None:
+            with attribute_usage(patient_id=data.patient_id, session_id=data.session_id):
+                result = await run_in_thread(request, "ai-doctor", functools.partial(
+                    continue_consultation,
+                    patient_message=data.patient_message,
+                    history=data.history,
+                    turn=data.turn,
+                    model=model,
+                    patient_name=data.patient_name,
+                ))
 
         # Enrich the assessment payload with human-readable emergency metadata
         if result["assessment_ready"]:
@@ -642,6 +1389,8 @@ async def ai_doctor_respond(data: DoctorContinueRequest):
             "response": result["response"],
             "history": result["history"],
         }
+    except RequestAbandoned:
+        raise
     except Exception as e:
         print(f"AI Doctor Respond Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI Doctor error: {str(e)}")
@@ -662,6 +1411,83 @@ async def recovery_checklist(data: RecoveryData):
 async def find_doctor(data: SpecialistSearch):
     return {"doctors": "Specialist Finder Pending"}
 
+# ==========================================
+# ASYNC JOBS
+# ==========================================
+@app.get("/api/jobs/{job_id}")
+async def job_status(
+    job_id: str,
+    wait: float = Query(default=0, ge=0, le=30, description="Long-poll up to this many seconds for completion"),
+):
+    """
+    Poll (or long-poll with `wait`) a job submitted with `?async=true` to
+    /api/medical-analysis, /api/health-tracking/scan-report or /api/health-tracking/analyze.
+    Finished jobs carry the same `result` body the synchronous endpoint would have returned.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or its result has expired.")
+
+    job = await JOBS.wait(job, wait)
+    return {"success": True, **job.to_dict()}
+
+# ==========================================
+# LLM USAGE LEDGER
+# ==========================================
+@app.get("/api/v1/usage", dependencies=[Depends(require_admin)])
+async def llm_usage(
+    group_by: str = Query(default="endpoint", description="Aggregate by 'endpoint', 'model' or 'patient'"),
+    patient_id: Optional[str] = Query(default=None, description="Patient id or AI Doctor session id"),
+    limit: int = Query(default=100, ge=1, le=1000),
+):
+    """
+    Token and latency accounting for every Gemini and Groq call made by the server (all workers).
+    Pass `patient_id` to also get that patient's recent calls and today's token total.
+    Requires the admin bearer token (ADMIN_API_TOKEN).
+    """
+    if group_by not in ("endpoint", "model", "patient"):
+        raise HTTPException(status_code=400, detail="group_by must be 'endpoint', 'model' or 'patient'.")
+
+    result = {
+        "success": True,
+        "group_by": group_by,
+        "totals": LEDGER.summary(group_by),
+    }
+    if patient_id:
+        result["patient_id"] = patient_id
+        result["tokens_today"] = LEDGER.tokens_today(patient_id)
+        result["calls"] = LEDGER.records(patient_id=patient_id, limit=limit)
+    return result
+
+@app.get("/api/v1/tool-cache")
+async def tool_cache_stats():
+    """Hit rates and per-tool latency for the memoized agent tools (e.g. web search)."""
+    return {
+        "success": True,
+        "ttl_seconds": TOOL_CACHE.ttl,
+        "max_entries": TOOL_CACHE.max_entries,
+        "tools": TOOL_CACHE.stats(),
+    }
+
+@app.get("/api/v1/llm-routes")
+async def llm_routes():
+    """Per-provider latency (p50/p95), failure streaks and availability for each LLM route."""
+    return {
+        "success": True,
+        "routes": {
+            name: {"hedge": router.hedge, "targets": router.snapshot()}
+            for name, router in ROUTES.items()
+        },
+    }
+
+# ==========================================
+# METRICS ENDPOINT
+# ==========================================
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text-format exposition of request and phase metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # ==========================================
 # HEALTH CHECK ENDPOINT
 # ==========================================
@@ -676,14 +1502,25 @@ async def health_check():
             "scan_health_report": "/api/health-tracking/scan-report",
             "health_tracking": "/api/health-tracking/analyze",
             "trend_analysis": "/api/health-tracking/trend-analysis",
+            "trend_series": "/api/health-tracking/trend-series",
             "quick_log": "/api/health-tracking/quick-log",
+            "bulk_import": "/api/health-tracking/import",
+            "export": "/api/health-tracking/export",
+            "job_status": "/api/jobs/{job_id}",
             "nearby_finder": "/api/v1/nearby-finder",
+            "nearby_finder_multi": "/api/v1/nearby-finder/multi",
             "facility_details": "/api/v1/facility-details/{place_id}",
+            "facility_photo": "/api/v1/facility-photo/{photo_reference}",
             # NEW
             "ai_doctor_start": "/api/ai-doctor/start",
             "ai_doctor_respond": "/api/ai-doctor/respond",
+            "llm_usage": "/api/v1/usage",
+            "tool_cache": "/api/v1/tool-cache",
+            "llm_routes": "/api/v1/llm-routes",
+            "metrics": "/metrics",
         }
     }
 
 if __name__ == "__main__":
+    # Single-process dev server; use `python serve.py` in production
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Offline medical-reference retrieval for the Gemini agents.
+
+A small curated corpus of reference ranges and guideline summaries
+(ICMR, WHO, ADA, AHA, KDIGO, ...) lives in ``medical_reference_corpus.json``.
+At import it is tokenised into an in-memory BM25 inverted index, so a
+lookup is a handful of dict reads instead of a live web search issued
+mid-generation.
+
+``MedicalReference`` exposes the index to phi agents as a tool.
+DuckDuckGo is only attached as a fallback when explicitly enabled:
+    ENABLE_WEB_SEARCH_FALLBACK   "true" to also give agents DuckDuckGo (default false);
+                                 its searches go through the shared tool cache
+    MEDICAL_REFERENCE_CORPUS     path to an alternative corpus JSON file
+"""
+
+import os
+import re
+import json
+import math
+import time
+import logging
+from collections import Counter as TermCounter
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Any
+
+from dotenv import load_dotenv
+from phi.tools import Toolkit
+
+from telemetry import REGISTRY
+from tool_cache import cached_toolkit
+
+load_dotenv()
+
+logger = logging.getLogger("doctorx.reference")
+
+CORPUS_PATH = os.getenv(
+    "MEDICAL_REFERENCE_CORPUS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "medical_reference_corpus.json"),
+)
+ENABLE_WEB_SEARCH_FALLBACK = os.getenv("ENABLE_WEB_SEARCH_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Title and tags are repeated into the indexed text so they weigh more than body text
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+
+REFERENCE_LOOKUPS = REGISTRY.counter(
+    "doctorx_reference_lookups_total", "Local medical-reference lookups.", ("result",),
+)
+REFERENCE_LOOKUP_DURATION = REGISTRY.histogram(
+    "doctorx_reference_lookup_seconds", "Local medical-reference lookup latency.",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+
+# Instruction line shared by every agent that gets the reference tool
+REFERENCE_TOOL_INSTRUCTION = (
+    "For reference ranges, diagnostic thresholds and guideline targets, call "
+    "`search_medical_reference` first; it is instant and curated. Only use web search "
+    "if it is available and the local reference has nothing relevant."
+)
+
+
+# ── Tokenisation ─────────────────────────────────────────────────────────────
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the to what which with "
+    "my me i normal range ranges level levels value values".split()
+)
+
+# Abbreviations and spelling variants mapped onto the corpus vocabulary
+_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "bp": ("blood", "pressure"),
+    "a1c": ("hba1c",),
+    "hb1ac": ("hba1c",),
+    "glycated": ("hba1c",),
+    "glycosylated": ("hba1c",),
+    "sugar": ("glucose",),
+    "fbs": ("fasting", "glucose"),
+    "ppbs": ("postprandial", "glucose"),
+    "rbs": ("random", "glucose"),
+    "haemoglobin": ("hemoglobin",),
+    "hgb": ("hemoglobin",),
+    "anaemia": ("anemia",),
+    "sgpt": ("alt",),
+    "sgot": ("ast",),
+    "kft": ("kidney",),
+    "rft": ("kidney",),
+    "renal": ("kidney",),
+    "lft": ("liver",),
+    "ldl": ("ldl", "cholesterol"),
+    "hdl": ("hdl", "cholesterol"),
+    "tg": ("triglycerides",),
+    "ft4": ("free", "t4"),
+    "thyroxine": ("t4",),
+    "pulse": ("heart", "rate"),
+    "hr": ("heart", "rate"),
+    "oxygen": ("spo2",),
+    "saturation": ("spo2",),
+    "fever": ("fever", "temperature"),
+    "potassium": ("potassium", "k"),
+    "sodium": ("sodium", "na"),
+    "b12": ("b12", "cobalamin"),
+    "vit": ("vitamin",),
+}
+
+
+def _stem(token: str) -> str:
+    """Very light plural stripping; enough for 'levels'/'targets'/'triglycerides'."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case, split, expand synonyms, drop stopwords and strip plurals."""
+    tokens: List[str] = []
+    for raw in _TOKEN_RE.findall(text.lower()):
+        for token in _SYNONYMS.get(raw, (raw,)):
+            if token not in _STOPWORDS:
+                tokens.append(_stem(token))
+    return tokens
+
+
+# ── Index ────────────────────────────────────────────────────────────────────
+
+@dataclass
+class ReferenceEntry:
+    id: str
+    title: str
+    source: str
+    tags: List[str]
+    text: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "title": self.title, "source": self.source, "text": self.text}
+
+
+class BM25Index:
+    """Compact in-memory inverted index: term -> [(doc, term frequency)]."""
+
+    def __init__(self, entries: List[ReferenceEntry]):
+        self.entries = entries
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+
+        for doc_id, entry in enumerate(entries):
+            fields = [entry.title] * TITLE_WEIGHT + [" ".join(entry.tags)] * TAG_WEIGHT + [entry.text]
+            terms = tokenize(" ".join(fields))
+            self.doc_lengths.append(len(terms))
+            for term, tf in TermCounter(terms).items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+
+        n_docs = len(entries)
+        self.avg_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf: Dict[str, float] = {
+            term: math.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[ReferenceEntry, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in postings:
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.entries[doc_id], score) for doc_id, score in ranked]
+
+
+def load_corpus(path: str = CORPUS_PATH) -> List[ReferenceEntry]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Medical reference corpus unavailable (%s): %s", path, e)
+        return []
+    return [
+        ReferenceEntry(
+            id=item["id"],
+            title=item["title"],
+            source=item.get("source", ""),
+            tags=list(item.get("tags", [])),
+            text=item["text"],
+        )
+        for item in raw
+    ]
+
+
+INDEX = BM25Index(load_corpus())
+
+
+def search_reference(query: str, max_results: int = 3) -> List[Dict[str, Any]]:
+    """Search the local index; returns plain dicts with a relevance score."""
+    start = time.perf_counter()
+    hits = INDEX.search(query, k=max(1, min(int(max_results), 10)))
+    REFERENCE_LOOKUP_DURATION.observe(time.perf_counter() - start)
+    REFERENCE_LOOKUPS.inc(result="hit" if hits else "miss")
+    return [entry.to_dict() | {"score": round(score, 3)} for entry, score in hits]
+
+
+# ── phi tool ─────────────────────────────────────────────────────────────────
+
+class MedicalReference(Toolkit):
+    def __init__(self):
+        super().__init__(name="medical_reference")
+        self.register(self.search_medical_reference)
+
+    def search_medical_reference(self, query: str, max_results: int = 3) -> str:
+        """Search the curated offline medical reference (ICMR, WHO, ADA, AHA, KDIGO guidelines)
+        for reference ranges, diagnostic thresholds and treatment targets.
+
+        Args:
+            query (str): What to look up, e.g. "HbA1c target diabetes" or "normal TSH range".
+            max_results (optional, default=3): Maximum number of passages to return.
+
+        Returns:
+            The matching guideline passages as JSON.
+        """
+        results = search_reference(query, max_results)
+        if not results:
+            return json.dumps({"results": [], "note": "No local reference found for this query."})
+        return json.dumps({"results": results}, ensure_ascii=False)
+
+
+def reference_tools() -> List[Any]:
+    """Tools for the analysis agents: the local reference, plus DuckDuckGo only if enabled."""
+    tools: List[Any] = [MedicalReference()]
+    if ENABLE_WEB_SEARCH_FALLBACK:
+        from phi.tools.duckduckgo import DuckDuckGo
+        tools.append(cached_toolkit(DuckDuckGo()))
+    return tools
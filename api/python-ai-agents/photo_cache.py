@@ -0,0 +1,276 @@
+"""
+Resized facility photos behind a size-bounded on-disk LRU cache.
+
+Nearby results carry raw Google ``photo_reference`` strings. The photo
+endpoint fetches each reference from Places once, keeps that source image
+on disk and derives JPEG thumbnails from it with Pillow. Requested widths
+snap up to a fixed set, so each photo has a bounded number of variants and
+a client cannot grow the cache by asking for every width in turn.
+
+A thumbnail is fully determined by (photo_reference, width, quality), so
+its ETag is derived from those rather than from the bytes: conditional
+requests are answered with 304 without touching disk or Places.
+
+Every worker keeps its own LRU order over the shared directory and
+rebuilds it from file mtimes at start-up; a file evicted by another worker
+is simply treated as a miss.
+
+Configuration:
+    PHOTO_CACHE_DIR          cache directory          (default <tmp>/doctorx_photo_cache)
+    PHOTO_CACHE_MAX_BYTES    disk budget before LRU eviction (default 268435456)
+    PHOTO_WIDTHS             allowed thumbnail widths  (default 96,200,400,800)
+    PHOTO_SOURCE_MAX_WIDTH   width requested from Places for the source (default 1600)
+    PHOTO_JPEG_QUALITY       thumbnail JPEG quality    (default 82)
+    PHOTO_MAX_AGE_SECONDS    Cache-Control max-age     (default 2592000, 30 days)
+"""
+
+import io
+import os
+import re
+import asyncio
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple, Callable, Awaitable
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+PHOTO_CACHE_DIR = os.getenv("PHOTO_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "doctorx_photo_cache")
+PHOTO_CACHE_MAX_BYTES = int(os.getenv("PHOTO_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PHOTO_WIDTHS = tuple(sorted({int(w) for w in os.getenv("PHOTO_WIDTHS", "96,200,400,800").split(",") if w.strip()}))
+PHOTO_SOURCE_MAX_WIDTH = int(os.getenv("PHOTO_SOURCE_MAX_WIDTH", "1600"))
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "82"))
+PHOTO_MAX_AGE_SECONDS = int(os.getenv("PHOTO_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+
+SOURCE_VARIANT = "source"
+
+# Google photo references are long URL-safe tokens
+_PHOTO_REFERENCE_RE = re.compile(r"^[A-Za-z0-9_\-]{8,2048}$")
+
+PHOTO_REQUESTS = REGISTRY.counter(
+    "doctorx_photo_requests_total", "Facility photo requests by cache outcome.", ("result",),
+)
+PHOTO_CACHE_BYTES = REGISTRY.gauge(
+    "doctorx_photo_cache_bytes", "Bytes held in the on-disk facility photo cache.",
+)
+PHOTO_CACHE_EVICTIONS = REGISTRY.counter(
+    "doctorx_photo_cache_evictions_total", "Photo cache files evicted to stay under PHOTO_CACHE_MAX_BYTES.",
+)
+
+PhotoFetcher = Callable[[str, int], Awaitable[bytes]]
+
+
+def valid_photo_reference(photo_reference: str) -> bool:
+    return bool(_PHOTO_REFERENCE_RE.match(photo_reference or ""))
+
+
+def snap_width(width: int) -> int:
+    """Round a requested width up to the nearest allowed one (largest if beyond)."""
+    for allowed in PHOTO_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return PHOTO_WIDTHS[-1]
+
+
+def photo_etag(photo_reference: str, width: int) -> str:
+    digest = hashlib.sha256(f"{photo_reference}|w{width}|q{PHOTO_JPEG_QUALITY}".encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={PHOTO_MAX_AGE_SECONDS}, immutable",
+    }
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, so a W/ prefix still matches."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def verify_image(data: bytes) -> None:
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise RuntimeError("Places returned a photo that could not be decoded.")
+
+
+def resize_jpeg(source: bytes, width: int) -> bytes:
+    """Scale an image down to ``width`` (never up) and re-encode it as JPEG."""
+    try:
+        with Image.open(io.BytesIO(source)) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=PHOTO_JPEG_QUALITY, optimize=True, progressive=True)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise RuntimeError("Places returned a photo that could not be decoded.")
+
+
+# ── On-disk LRU ──────────────────────────────────────────────────────────────
+
+class DiskLRU:
+    """Files under ``root`` bounded to ``max_bytes`` total, least recently used evicted first."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".jpg"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        with self._lock:
+            for _, name, size in sorted(found):
+                self._entries[name] = size
+                self._bytes += size
+        self._evict()
+
+    def _name(self, photo_reference: str, variant: str) -> str:
+        return hashlib.sha256(f"{photo_reference}|{variant}".encode("utf-8")).hexdigest()[:40] + ".jpg"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name)
+
+    def get(self, photo_reference: str, variant: str) -> Optional[bytes]:
+        name = self._name(photo_reference, variant)
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # keep the LRU order across restarts
+        except FileNotFoundError:
+            with self._lock:
+                size = self._entries.pop(name, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+            else:
+                self._entries[name] = len(data)
+                self._bytes += len(data)
+        return data
+
+    def put(self, photo_reference: str, variant: str, data: bytes) -> None:
+        name = self._name(photo_reference, variant)
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        victims = []
+        with self._lock:
+            # Never evict the entry just written, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                victims.append(name)
+            PHOTO_CACHE_BYTES.set(self._bytes)
+        for name in victims:
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+        if victims:
+            PHOTO_CACHE_EVICTIONS.inc(len(victims))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+# ── Photo service ────────────────────────────────────────────────────────────
+
+class PhotoCache:
+    """Thumbnails keyed on (photo_reference, width); each source is fetched from Places once."""
+
+    def __init__(self, disk: DiskLRU):
+        self.disk = disk
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def _fetch_source(self, photo_reference: str, fetch: PhotoFetcher) -> bytes:
+        source = await fetch(photo_reference, PHOTO_SOURCE_MAX_WIDTH)
+        # Check before caching so an error page never lands on disk as a "photo"
+        await asyncio.to_thread(verify_image, source)
+        await asyncio.to_thread(self.disk.put, photo_reference, SOURCE_VARIANT, source)
+        return source
+
+    async def _source(self, photo_reference: str, fetch: PhotoFetcher) -> Tuple[bytes, bool]:
+        source = await asyncio.to_thread(self.disk.get, photo_reference, SOURCE_VARIANT)
+        if source is not None:
+            return source, False
+        # Concurrent misses for the same photo share one Places request
+        pending = self._pending.get(photo_reference)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_source(photo_reference, fetch))
+            self._pending[photo_reference] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(photo_reference, None))
+        return await asyncio.shield(pending), True
+
+    async def get(self, photo_reference: str, width: int, fetch: PhotoFetcher) -> bytes:
+        """
+        Return the JPEG thumbnail for ``photo_reference`` at ``width`` (already
+        snapped), fetching the source through ``fetch(photo_reference, max_width)``
+        only when it is not on disk.
+        """
+        variant = f"w{width}"
+        data = await asyncio.to_thread(self.disk.get, photo_reference, variant)
+        if data is not None:
+            PHOTO_REQUESTS.inc(result="hit")
+            return data
+
+        source, fetched = await self._source(photo_reference, fetch)
+        data = await asyncio.to_thread(resize_jpeg, source, width)
+        await asyncio.to_thread(self.disk.put, photo_reference, variant, data)
+        PHOTO_REQUESTS.inc(result="miss" if fetched else "resized")
+        return data
+
+
+PHOTOS = PhotoCache(DiskLRU(PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_BYTES))
@@ -0,0 +1,400 @@
+"""
+On-demand profiling of individual production requests.
+
+Some hot spots only show up with production data — validating a huge
+``HealthTrackingData`` payload, parsing long model output — so single
+requests can be profiled in place. A request is profiled when it carries
+``X-Profile: <PROFILE_TOKEN>`` or is picked by ``PROFILE_SAMPLE_RATE``.
+Each profiled request writes, under ``PROFILE_DIR``:
+
+- ``<id>.collapsed``  stacks in collapsed format ("a;b;c 12"), ready for
+  flamegraph.pl / speedscope (PROFILE_MODE=sample), or
+  ``<id>.prof``       a cProfile dump for snakeviz / pstats (PROFILE_MODE=cprofile)
+- ``<id>.alloc.txt``  tracemalloc summary: peak traced memory and the lines
+  holding the most memory when the response started
+
+The profile id comes back in an ``X-Profile-Id`` response header.
+
+The sampler reads every thread's stack every PROFILE_INTERVAL_MS and keeps
+the event loop thread only while the request's own task is running, plus
+worker threads doing the request's work (inside a ``span`` or
+``cancellation.run_in_thread``), where the LLM calls and parsing happen.
+
+cProfile cannot be scoped like that. Before Python 3.12 a profiler only
+sees the thread that enabled it — here the event loop — so each worker
+thread the request attaches gets its own profiler and their stats are
+merged into the dump; work a thread is still doing when the response
+ends is left out. From 3.12 cProfile is built on sys.monitoring and sees
+every thread at once. Either way it also records whatever else the loop
+runs meanwhile, so only one cProfile request runs at a time and others
+fall back to sampling. tracemalloc is process-wide too, so concurrent
+profiled requests share their peak.
+
+Profile files are pruned after each write to the newest PROFILE_MAX_FILES
+profiles, none older than PROFILE_MAX_AGE_HOURS.
+
+When neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE is set the middleware
+is not installed at all.
+
+Configuration:
+    PROFILE_TOKEN               secret accepted in the X-Profile header (unset: header ignored)
+    PROFILE_SAMPLE_RATE         fraction of requests profiled without the header (default 0)
+    PROFILE_MODE                sample | cprofile                 (default sample)
+    PROFILE_INTERVAL_MS         sampling interval                 (default 5)
+    PROFILE_DIR                 output directory                  (default <tmp>/doctorx_profiles)
+    PROFILE_TRACEMALLOC_FRAMES  frames kept per allocation        (default 1)
+    PROFILE_TOP_ALLOCATIONS     lines in the allocation summary   (default 25)
+    PROFILE_MAX_FILES           profiles kept in PROFILE_DIR, 0 = no limit (default 200)
+    PROFILE_MAX_AGE_HOURS       delete profiles older than this, 0 = never (default 72)
+"""
+
+import os
+import sys
+import hmac
+import time
+import uuid
+import random
+import asyncio
+import pstats
+import cProfile
+import threading
+import tempfile
+import tracemalloc
+from collections import Counter
+from typing import Optional, Dict, List
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY, current_trace
+
+load_dotenv()
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").lower()
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "doctorx_profiles")
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "25"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("PROFILE_MAX_AGE_HOURS", "72"))
+
+if PROFILE_MODE not in ("sample", "cprofile"):
+    raise ValueError(f"PROFILE_MODE must be sample or cprofile, got {PROFILE_MODE!r}")
+
+PROFILED_REQUESTS = REGISTRY.counter(
+    "doctorx_profiled_requests_total", "Requests run under the profiler.", ("trigger", "mode"),
+)
+
+MAX_STACK_DEPTH = 128
+
+# Before 3.12 cProfile hooks only the enabling thread; from 3.12 one profiler sees them all
+_PER_THREAD_CPROFILE = sys.version_info < (3, 12)
+
+# Files written for one profile
+_PROFILE_SUFFIXES = (".collapsed", ".prof", ".alloc.txt")
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name: str) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+# ── Per-request profile ──────────────────────────────────────────────────────
+
+class RequestProfile:
+    """Stacks and allocations collected for one profiled request."""
+
+    def __init__(self, profile_id: str, method: str, path: str, mode: str):
+        self.profile_id = profile_id
+        self.method = method
+        self.path = path
+        self.mode = mode
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.loop_thread = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: Dict[int, int] = {}   # worker thread ident -> span depth
+        self._lock = threading.Lock()
+        self.cprofile: Optional[cProfile.Profile] = None
+        self._thread_cprofiles: Dict[int, cProfile.Profile] = {}
+        self.finished_cprofiles: List[cProfile.Profile] = []
+        self.alloc_start = None
+        self.alloc_response = None
+        self.memory_start = 0
+        self.started = time.perf_counter()
+
+    # Called from telemetry.span / attach_thread in whatever thread runs the work
+    def enter_thread(self) -> None:
+        ident = threading.get_ident()
+        if ident == self.loop_thread:
+            return
+        with self._lock:
+            depth = self._threads[ident] = self._threads.get(ident, 0) + 1
+            if depth == 1 and self.cprofile is not None and _PER_THREAD_CPROFILE:
+                thread_profile = self._thread_cprofiles[ident] = cProfile.Profile()
+                thread_profile.enable()
+
+    def exit_thread(self) -> None:
+        ident = threading.get_ident()
+        if ident == self.loop_thread:
+            return
+        with self._lock:
+            depth = self._threads.get(ident, 0) - 1
+            if depth > 0:
+                self._threads[ident] = depth
+                return
+            self._threads.pop(ident, None)
+            thread_profile = self._thread_cprofiles.pop(ident, None)
+        if thread_profile is not None:
+            thread_profile.disable()
+            with self._lock:
+                self.finished_cprofiles.append(thread_profile)
+
+    def sample(self, frames: Dict[int, object], names: Dict[int, str]) -> None:
+        taken = 0
+        # The loop thread is shared by every request; only count it while ours runs
+        if asyncio.current_task(self.loop) is self.task and self.loop_thread in frames:
+            self.stacks[_collapse(frames[self.loop_thread], names.get(self.loop_thread, "loop"))] += 1
+            taken += 1
+        with self._lock:
+            workers = list(self._threads)
+        for ident in workers:
+            frame = frames.get(ident)
+            if frame is not None:
+                self.stacks[_collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+                taken += 1
+        self.samples += taken
+
+    def snapshot_allocations(self) -> None:
+        if self.alloc_response is None and tracemalloc.is_tracing():
+            self.alloc_response = tracemalloc.take_snapshot()
+
+
+# ── Sampler thread ───────────────────────────────────────────────────────────
+
+class _Sampler:
+    """One background thread sampling stacks for every active request profile."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            frames.pop(me, None)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for profile in profiles:
+                profile.sample(frames, names)
+            del frames
+            time.sleep(self.interval)
+
+
+_SAMPLER = _Sampler(PROFILE_INTERVAL_MS / 1000.0)
+
+# cProfile is process-wide, so one request at a time
+_cprofile_lock = threading.Lock()
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _tracemalloc_acquire() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        _tracemalloc_users += 1
+
+
+def _tracemalloc_release() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+# ── Output ───────────────────────────────────────────────────────────────────
+
+def _allocation_summary(profile: RequestProfile, status: int, elapsed: float, peak: int) -> str:
+    lines = [
+        f"{profile.method} {profile.path} -> {status} in {elapsed * 1000:.1f} ms (mode={profile.mode})",
+        f"peak traced memory: {(peak - profile.memory_start) / 1024:.1f} KiB above the start of the request",
+    ]
+    if profile.alloc_start is not None and profile.alloc_response is not None:
+        exclude = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        stats = profile.alloc_response.filter_traces(exclude).compare_to(
+            profile.alloc_start.filter_traces(exclude), "lineno",
+        )
+        grown = [s for s in stats if s.size_diff > 0]
+        total = sum(s.size_diff for s in grown)
+        lines.append(f"held when the response started: {total / 1024:.1f} KiB in {sum(s.count_diff for s in grown)} blocks")
+        lines.append("")
+        lines.append(f"{'KiB':>10} {'blocks':>8}  line")
+        for stat in grown[:PROFILE_TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 1024:>10.1f} {stat.count_diff:>8}  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_profile(profile: RequestProfile, status: int) -> None:
+    elapsed = time.perf_counter() - profile.started
+    peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.profile_id)
+    if profile.cprofile is not None:
+        stats = pstats.Stats(profile.cprofile)
+        for thread_profile in profile.finished_cprofiles:
+            stats.add(thread_profile)
+        stats.dump_stats(base + ".prof")
+    else:
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in profile.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    with open(base + ".alloc.txt", "w", encoding="utf-8") as f:
+        f.write(_allocation_summary(profile, status, elapsed, peak))
+    _prune_profiles()
+
+
+def _prune_profiles() -> None:
+    """Keep the newest PROFILE_MAX_FILES profiles and drop those older than PROFILE_MAX_AGE_HOURS."""
+    groups: Dict[str, List[str]] = {}
+    for name in os.listdir(PROFILE_DIR):
+        for suffix in _PROFILE_SUFFIXES:
+            if name.endswith(suffix):
+                groups.setdefault(name[:-len(suffix)], []).append(os.path.join(PROFILE_DIR, name))
+                break
+    written = {}
+    for profile_id, paths in groups.items():
+        try:
+            written[profile_id] = max(os.path.getmtime(path) for path in paths)
+        except OSError:   # removed by a concurrent prune
+            continue
+    ordered = sorted(written, key=written.get, reverse=True)
+    keep = ordered[:PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else ordered
+    if PROFILE_MAX_AGE_HOURS > 0:
+        cutoff = time.time() - PROFILE_MAX_AGE_HOURS * 3600.0
+        keep = [profile_id for profile_id in keep if written[profile_id] >= cutoff]
+    kept = set(keep)
+    stale = [profile_id for profile_id in ordered if profile_id not in kept]
+    for profile_id in stale:
+        for path in groups[profile_id]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# ── ASGI middleware ──────────────────────────────────────────────────────────
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware. Install it inside ``TelemetryMiddleware`` so the
+    request trace exists and spans can attach worker threads.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope) -> Optional[str]:
+        if PROFILE_TOKEN:
+            for name, value in scope.get("headers", []):
+                if name == b"x-profile":
+                    if hmac.compare_digest(value, PROFILE_TOKEN.encode("latin-1")):
+                        return "header"
+                    break
+        if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope.get("method", "GET"), scope.get("path", "")
+        slug = "".join(c if c.isalnum() else "_" for c in path.strip("/"))[:60] or "root"
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{slug}_{uuid.uuid4().hex[:8]}"
+        mode = PROFILE_MODE
+        if mode == "cprofile" and not _cprofile_lock.acquire(blocking=False):
+            mode = "sample"
+        profile = RequestProfile(profile_id, method, path, mode)
+        PROFILED_REQUESTS.inc(trigger=trigger, mode=mode)
+
+        trace = current_trace()
+        if trace is not None:
+            trace.profile = profile
+        status_holder = {"status": 500}
+
+        async def profiled_send(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                profile.snapshot_allocations()
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        _tracemalloc_acquire()
+        profile.memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        profile.alloc_start = tracemalloc.take_snapshot()
+        if mode == "cprofile":
+            profile.cprofile = cProfile.Profile()
+            profile.cprofile.enable()
+        else:
+            _SAMPLER.add(profile)
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            if profile.cprofile is not None:
+                profile.cprofile.disable()
+                _cprofile_lock.release()
+            else:
+                _SAMPLER.remove(profile)
+            profile.snapshot_allocations()
+            try:
+                await asyncio.to_thread(_write_profile, profile, status_holder["status"])
+            except OSError as e:
+                print(f"Could not write profile {profile_id}: {e}")
+            finally:
+                _tracemalloc_release()
+                if trace is not None:
+                    trace.profile = None
@@ -0,0 +1,214 @@
+"""
+Provider-side caching of the large, static agent instructions.
+
+The analysis agents send the same instruction block (a long output spec)
+with every request, and AI Doctor resends SYSTEM_PROMPT with every turn.
+Where the provider can keep that prefix it is uploaded once:
+
+- Gemini: ``CachedGemini`` puts the system instruction and tool
+  declarations in an explicit ``CachedContent`` and sends only the
+  conversation, referencing the cache by name. Instructions below the
+  provider's minimum cache size, and any cache error, fall back to the
+  plain prompt (which Gemini 2.5 may still cache implicitly).
+- Groq: prompt caching is automatic on the models that support it; the
+  system prompt is always the first message, so the prefix is stable and
+  nothing needs to be sent differently.
+
+Only the health-tracking analysis instructions (~1600 tokens) are above
+Gemini's explicit-cache minimum. The lab, trend and report-extraction
+agents (~300-500 tokens) always get "too_small" and go out as plain
+prompts; they stay wired through ``CachedGemini`` so they start caching
+once their instructions grow past PROMPT_CACHE_MIN_TOKENS.
+
+Explicit caching is switched off while a provider cassette is installed
+(cassettes.py): the cache calls bypass the cassette transport, and a
+recording that names a cache could never be replayed.
+
+Cache names are versioned by a hash of the model, instructions and tools,
+so editing an agent's instructions starts a new cache instead of serving
+a stale one; the old cache simply expires. Before creating a cache a
+worker looks for one another worker already created under the same name.
+
+Cached-token share and the latency of calls that hit a cache are recorded
+by usage.py for every provider, implicit caching included.
+
+Configuration:
+    PROMPT_CACHE                auto | off                                   (default auto)
+    PROMPT_CACHE_TTL_SECONDS    Gemini cache lifetime, renewed while in use  (default 3600)
+    PROMPT_CACHE_MIN_TOKENS     smallest instruction block worth caching     (default 1024)
+    PROMPT_CACHE_RETRY_SECONDS  wait before retrying a cache that failed     (default 600)
+"""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+
+from dotenv import load_dotenv
+import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
+from phi.model.google import Gemini
+from phi.model.google.gemini import Metrics
+from phi.model.message import Message
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "auto").lower()
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_RETRY_SECONDS = float(os.getenv("PROMPT_CACHE_RETRY_SECONDS", "600"))
+
+if PROMPT_CACHE not in ("auto", "off"):
+    raise ValueError(f"PROMPT_CACHE must be auto or off, got {PROMPT_CACHE!r}")
+
+# Renew a cache once less than this much of its TTL is left
+RENEW_MARGIN = timedelta(seconds=min(300, PROMPT_CACHE_TTL_SECONDS // 4))
+
+PROMPT_CACHE_LOOKUPS = REGISTRY.counter(
+    "doctorx_prompt_cache_lookups_total", "Explicit prompt cache lookups by outcome.", ("provider", "result"),
+)
+
+
+def instruction_key(model: str, system_text: str, tools: Any = None) -> str:
+    """Cache name for an instruction block: changes whenever model, text or tools change."""
+    payload = json.dumps([model, system_text, tools], sort_keys=True, default=str)
+    return f"doctorx-{model}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _estimated_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+class GeminiContextCache:
+    """Explicit Gemini context caches, one per instruction key, shared by all agents in the process."""
+
+    def __init__(self):
+        self._entries: Dict[str, caching.CachedContent] = {}
+        self._failed_until: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _find(self, key: str) -> Optional[caching.CachedContent]:
+        now = datetime.now(timezone.utc)
+        for cached in caching.CachedContent.list():
+            if cached.display_name == key and cached.expire_time - now > RENEW_MARGIN:
+                return cached
+        return None
+
+    def get(self, key: str, model: str, system_text: str, tools: Optional[list]) -> Optional[caching.CachedContent]:
+        """
+        The cache for ``key``, created or renewed as needed; None means send
+        the plain prompt. Never raises: cache trouble only costs the saving.
+        """
+        if PROMPT_CACHE == "off":
+            return None
+        if _estimated_tokens(system_text) < PROMPT_CACHE_MIN_TOKENS:
+            PROMPT_CACHE_LOOKUPS.inc(provider="gemini", result="too_small")
+            return None
+
+        with self._key_lock(key):
+            now = datetime.now(timezone.utc)
+            if self._failed_until.get(key, 0.0) > now.timestamp():
+                PROMPT_CACHE_LOOKUPS.inc(provider="gemini", result="fallback")
+                return None
+            try:
+                cached = self._entries.get(key)
+                if cached is not None and cached.expire_time - now > RENEW_MARGIN:
+                    result = "hit"
+                elif cached is not None:
+                    cached.update(ttl=timedelta(seconds=PROMPT_CACHE_TTL_SECONDS))
+                    result = "renewed"
+                else:
+                    cached, result = self._find(key), "shared"
+                    if cached is None:
+                        cached = caching.CachedContent.create(
+                            model=model,
+                            display_name=key,
+                            system_instruction=system_text,
+                            tools=tools,
+                            ttl=timedelta(seconds=PROMPT_CACHE_TTL_SECONDS),
+                        )
+                        result = "created"
+            except Exception as e:
+                print(f"Prompt cache unavailable for {key}, sending plain prompts: {e}")
+                self._entries.pop(key, None)
+                self._failed_until[key] = now.timestamp() + PROMPT_CACHE_RETRY_SECONDS
+                PROMPT_CACHE_LOOKUPS.inc(provider="gemini", result="error")
+                return None
+            self._entries[key] = cached
+            PROMPT_CACHE_LOOKUPS.inc(provider="gemini", result=result)
+            return cached
+
+    def invalidate(self, key: str) -> None:
+        """Forget a cache the provider no longer has (expired, or deleted elsewhere)."""
+        with self._key_lock(key):
+            self._entries.pop(key, None)
+
+
+GEMINI_CONTEXT_CACHE = GeminiContextCache()
+
+
+def _split_system(messages: List[Message]) -> Tuple[str, List[Message]]:
+    system = [m for m in messages if m.role in ("system", "developer")]
+    rest = [m for m in messages if m.role not in ("system", "developer")]
+    return "\n\n".join(m.get_content_string() for m in system), rest
+
+
+class CachedGemini(Gemini):
+    """phi Gemini model that sends its system instruction and tools through a context cache."""
+
+    def _tool_signature(self) -> list:
+        return [
+            [f.name, f.description, f.parameters]
+            for f in (self.functions or {}).values()
+        ]
+
+    def _cached_request(self, messages: List[Message]) -> Optional[Tuple[str, Any, List[Message]]]:
+        system_text, rest = _split_system(messages)
+        if not system_text or not rest:
+            return None
+        # Configures the API key used by the caching client as well
+        self.get_client()
+        model = f"models/{self.id}"
+        key = instruction_key(self.id, system_text, self._tool_signature())
+        cached = GEMINI_CONTEXT_CACHE.get(key, model, system_text, self.request_kwargs.get("tools"))
+        if cached is None:
+            return None
+        client = genai.GenerativeModel.from_cached_content(
+            cached, generation_config=self.generation_config, safety_settings=self.safety_settings,
+        )
+        return key, client, rest
+
+    def invoke(self, messages: List[Message]):
+        request = self._cached_request(messages)
+        if request is None:
+            return super().invoke(messages)
+        key, client, rest = request
+        try:
+            return client.generate_content(contents=self.format_messages(rest))
+        except (google_exceptions.NotFound, google_exceptions.PermissionDenied):
+            GEMINI_CONTEXT_CACHE.invalidate(key)
+            return super().invoke(messages)
+
+    def invoke_stream(self, messages: List[Message]):
+        request = self._cached_request(messages)
+        if request is None:
+            yield from super().invoke_stream(messages)
+            return
+        _, client, rest = request
+        yield from client.generate_content(contents=self.format_messages(rest), stream=True)
+
+    def update_usage_metrics(self, assistant_message: Message, usage=None, metrics: Optional[Metrics] = None) -> None:
+        super().update_usage_metrics(assistant_message, usage, metrics or Metrics())
+        if usage is not None:
+            # Counts explicit and implicit cache hits alike
+            assistant_message.metrics["cached_tokens"] = getattr(usage, "cached_content_token_count", 0) or 0
@@ -0,0 +1,448 @@
+"""
+Admission control — token-bucket rate limiting in front of provider quotas.
+
+Two layers:
+- Per client (IP) and per patient/session buckets that reject immediately.
+- Global per-provider buckets (gemini, groq, places) with a small bounded
+  wait queue, so short bursts are smoothed instead of fanning out into
+  provider 429s.
+
+Provider calls are admitted by priority class:
+- ``emergency``: AI Doctor turns whose message names a red-flag symptom,
+  emergency facility searches. May use the whole
+  bucket, jumps every queue and waits longest. It has its own bounded
+  queue, so it is not turned away when other classes fill theirs, but a
+  burst of emergency traffic cannot grow it without limit;
+- ``interactive`` (default): ordinary AI Doctor turns and facility lookups.
+  Leaves the emergency reserve untouched;
+- ``routine``: health-tracking, trend and report analyses, and background
+  jobs. Also leaves a headroom for interactive traffic, so it is the first
+  to be throttled when the provider gets busy.
+
+Waiters are served highest class first, then in arrival order.
+
+When capacity is exhausted a ``RateLimited`` error is raised, which the
+API turns into a fast ``429`` with a ``Retry-After`` header.
+
+Bucket levels are kept in shared_state.py, so every worker process draws
+from the same buckets and the limits hold for the server as a whole. Wait
+queues are per worker: priority order is exact among one worker's waiters,
+and the per-class floors keep the emergency reserve across workers. A bucket
+row is deleted once it would have refilled completely, so the table only
+holds recently active clients and patients.
+
+Clients are identified by the peer address in the ASGI scope, which
+uvicorn/gunicorn already rewrite for proxies in FORWARDED_ALLOW_IPS (see
+serve.py). ``X-Forwarded-For`` is only read when the peer itself is in
+RATE_LIMIT_TRUSTED_PROXIES; anyone else could forge it to dodge their own
+bucket or drain someone else's.
+
+Configuration (0 disables a limit):
+    RATE_LIMIT_CLIENT_RPM        requests/minute per client IP        (default 120)
+    RATE_LIMIT_PATIENT_RPM       LLM/Places calls/minute per patient  (default 30)
+    GEMINI_RPS / GROQ_RPS / PLACES_RPS   sustained provider calls/second
+    PROVIDER_MAX_QUEUE           callers allowed to wait per provider (default 32)
+    PROVIDER_MAX_WAIT_SECONDS    longest a caller may wait for a slot (default 2)
+    PRIORITY_EMERGENCY_RESERVE   share of each bucket only emergency calls may use (default 0.2)
+    PRIORITY_ROUTINE_HEADROOM    further share routine calls leave for interactive ones (default 0.3)
+    PRIORITY_EMERGENCY_MAX_WAIT_SECONDS   longest an emergency call may wait (default 10)
+    PRIORITY_EMERGENCY_MAX_QUEUE emergency callers allowed to wait per provider (default 32)
+    RATE_LIMIT_TRUSTED_PROXIES   proxy IPs/CIDRs whose X-Forwarded-For is honoured (default none)
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import ipaddress
+import itertools
+import threading
+from typing import Optional, Dict, Tuple, List
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from shared_state import SharedDB
+
+load_dotenv()
+
+RATE_LIMIT_CLIENT_RPM = float(os.getenv("RATE_LIMIT_CLIENT_RPM", "120"))
+RATE_LIMIT_PATIENT_RPM = float(os.getenv("RATE_LIMIT_PATIENT_RPM", "30"))
+PROVIDER_MAX_QUEUE = int(os.getenv("PROVIDER_MAX_QUEUE", "32"))
+PROVIDER_MAX_WAIT_SECONDS = float(os.getenv("PROVIDER_MAX_WAIT_SECONDS", "2"))
+PRIORITY_EMERGENCY_RESERVE = float(os.getenv("PRIORITY_EMERGENCY_RESERVE", "0.2"))
+PRIORITY_ROUTINE_HEADROOM = float(os.getenv("PRIORITY_ROUTINE_HEADROOM", "0.3"))
+PRIORITY_EMERGENCY_MAX_WAIT_SECONDS = float(os.getenv("PRIORITY_EMERGENCY_MAX_WAIT_SECONDS", "10"))
+PRIORITY_EMERGENCY_MAX_QUEUE = int(os.getenv("PRIORITY_EMERGENCY_MAX_QUEUE", "32"))
+
+# Priority classes, most urgent first
+PRIORITIES = ("emergency", "interactive", "routine")
+
+# provider -> (sustained calls/second, burst size)
+PROVIDER_LIMITS: Dict[str, Tuple[float, int]] = {
+    "gemini": (float(os.getenv("GEMINI_RPS", "5")), int(os.getenv("GEMINI_BURST", "10"))),
+    "groq": (float(os.getenv("GROQ_RPS", "10")), int(os.getenv("GROQ_BURST", "20"))),
+    "places": (float(os.getenv("PLACES_RPS", "20")), int(os.getenv("PLACES_BURST", "40"))),
+}
+
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if entry.strip()
+]
+
+# How often full buckets are deleted from the shared table
+_PRUNE_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key     TEXT PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL,
+    full_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at);
+"""
+
+_DB = SharedDB("ratelimit", _SCHEMA)
+
+RATE_LIMITED_TOTAL = REGISTRY.counter(
+    "doctorx_rate_limited_total", "Requests rejected by admission control.", ("scope",),
+)
+PROVIDER_QUEUE_DEPTH = REGISTRY.gauge(
+    "doctorx_provider_queue_depth", "Callers currently waiting for a provider slot.", ("provider", "priority"),
+)
+PROVIDER_QUEUE_WAIT = REGISTRY.histogram(
+    "doctorx_provider_queue_wait_seconds", "Time spent waiting for a provider slot.", ("provider", "priority"),
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0),
+)
+
+
+class RateLimited(Exception):
+    """Raised when a request cannot be admitted; carries the suggested retry delay."""
+
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            f"Too many requests ({scope}). Please retry in {self.retry_after} seconds."
+        )
+
+
+_last_prune = 0.0
+
+
+def _prune(now: float) -> None:
+    """Delete buckets that have refilled completely; a missing row reads as a full bucket."""
+    global _last_prune
+    if now - _last_prune < _PRUNE_INTERVAL_SECONDS:
+        return
+    _last_prune = now
+    _DB.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+
+
+class TokenBucket:
+    """
+    Classic token bucket, stored under ``key`` in the shared table. ``floor``
+    lets a caller take a token only while that many would remain, which is
+    how lower priority classes leave capacity for higher ones.
+    """
+
+    def __init__(self, key: str, rate: float, burst: int):
+        self.key = key
+        self.rate = rate
+        self.capacity = float(burst)
+
+    def _level(self, db, now: float) -> float:
+        # ``db`` is the shared DB, or the connection of an open transaction
+        row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (self.key,)).fetchone()
+        if row is None:
+            return self.capacity
+        tokens, updated = row
+        # Wall-clock time is shared by the workers; never refill backwards
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def try_acquire(self, floor: float = 0.0) -> float:
+        """Take a token if one is available above ``floor``. Returns 0.0 on success, else seconds until one is."""
+        now = time.time()
+        _prune(now)
+        with _DB.transaction() as conn:
+            tokens = self._level(conn, now)
+            if tokens - 1.0 < floor:
+                return (floor + 1.0 - tokens) / self.rate
+            tokens -= 1.0
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (self.key, tokens, now, now + (self.capacity - tokens) / self.rate),
+            )
+        return 0.0
+
+    def retry_after(self) -> float:
+        tokens = self._level(_DB, time.time())
+        return max(0.0, (1.0 - tokens) / self.rate)
+
+
+class KeyedBuckets:
+    """One bucket per key (client IP, patient id), named ``<name>:<key>`` in the shared table."""
+
+    def __init__(self, name: str, rate_per_minute: float):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, int(rate_per_minute // 6))   # ~10 s worth of burst
+
+    def check(self, key: str, scope: str) -> None:
+        if self.rate <= 0 or not key:
+            return
+        wait = TokenBucket(f"{self.name}:{key}", self.rate, self.burst).try_acquire()
+        if wait > 0:
+            RATE_LIMITED_TOTAL.inc(scope=scope)
+            raise RateLimited(scope, wait)
+
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "priority", "granted", "event", "loop")
+
+    def __init__(self, rank: int, seq: int, priority: str):
+        self.rank = rank
+        self.seq = seq
+        self.priority = priority
+        self.granted = False
+        self.event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def wake(self) -> None:
+        self.loop.call_soon_threadsafe(self.event.set)
+
+
+class ProviderLimiter:
+    """
+    Global bucket for one upstream provider with a bounded priority wait
+    queue. Each class may only take a token while its floor would remain.
+    """
+
+    def __init__(
+        self, name: str, rate: float, burst: int, max_queue: int, max_wait: float,
+        max_emergency_queue: int = PRIORITY_EMERGENCY_MAX_QUEUE,
+    ):
+        self.name = name
+        self.bucket = TokenBucket(f"provider:{name}", rate, burst) if rate > 0 else None
+        self.max_queue = max_queue
+        # Emergency waiters are counted separately, so routine floods can't crowd them out
+        self.max_emergency_queue = max_emergency_queue
+        # Floors are clamped so every class can still get a token from a full bucket
+        top = max(0.0, burst - 1.0)
+        reserve = min(top, burst * PRIORITY_EMERGENCY_RESERVE)
+        self.floors = {
+            "emergency": 0.0,
+            "interactive": reserve,
+            "routine": min(top, reserve + burst * PRIORITY_ROUTINE_HEADROOM),
+        }
+        self.max_waits = {
+            "emergency": max(max_wait, PRIORITY_EMERGENCY_MAX_WAIT_SECONDS),
+            "interactive": max_wait,
+            "routine": max_wait,
+        }
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _dispatch(self) -> float:
+        """
+        Grant tokens to waiters in priority order; the head blocks everyone
+        behind it. Returns seconds until the head could be served (0 if empty).
+        Caller holds ``_lock``.
+        """
+        while self._waiters:
+            head = self._waiters[0]
+            wait = self.bucket.try_acquire(self.floors[head.priority])
+            if wait > 0:
+                return wait
+            heapq.heappop(self._waiters)
+            head.granted = True
+            head.wake()
+        return 0.0
+
+    def _publish_depth(self) -> None:
+        counts = {p: 0 for p in PRIORITIES}
+        for w in self._waiters:
+            counts[w.priority] += 1
+        for priority, count in counts.items():
+            PROVIDER_QUEUE_DEPTH.set(count, provider=self.name, priority=priority)
+
+    def _reject(self, priority: str) -> RateLimited:
+        RATE_LIMITED_TOTAL.inc(scope=f"provider:{self.name}")
+        return RateLimited(f"provider:{self.name}", max(self.bucket.retry_after(), 1.0 / self.bucket.rate))
+
+    def try_acquire(self, priority: str = "routine") -> bool:
+        """Take a token only if one is free now and nobody of this class or above waits; never queues."""
+        if self.bucket is None:
+            return True
+        rank = PRIORITIES.index(priority)
+        with self._lock:
+            if any(w.rank <= rank for w in self._waiters):
+                return False
+            return self.bucket.try_acquire(self.floors[priority]) == 0.0
+
+    async def acquire(self, priority: str = "interactive") -> None:
+        if self.bucket is None:
+            return
+        rank = PRIORITIES.index(priority)
+        start = time.monotonic()
+
+        with self._lock:
+            # Nobody of this class or above is queued: try for a token right away
+            if not any(w.rank <= rank for w in self._waiters):
+                if self.bucket.try_acquire(self.floors[priority]) == 0.0:
+                    PROVIDER_QUEUE_WAIT.observe(0.0, provider=self.name, priority=priority)
+                    return
+            if priority == "emergency":
+                if sum(w.priority == "emergency" for w in self._waiters) >= self.max_emergency_queue:
+                    raise self._reject(priority)
+            elif len(self._waiters) >= self.max_queue:
+                raise self._reject(priority)
+            waiter = _Waiter(rank, next(self._seq), priority)
+            heapq.heappush(self._waiters, waiter)
+            self._publish_depth()
+
+        deadline = start + self.max_waits[priority]
+        try:
+            while True:
+                with self._lock:
+                    eta = self._dispatch()
+                if waiter.granted:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._reject(priority)
+                # Sleep until the head should be servable (or we're woken when granted)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout=min(remaining, max(eta, 0.005)))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                self._publish_depth()
+        PROVIDER_QUEUE_WAIT.observe(time.monotonic() - start, provider=self.name, priority=priority)
+
+
+CLIENT_BUCKETS = KeyedBuckets("client", RATE_LIMIT_CLIENT_RPM)
+PATIENT_BUCKETS = KeyedBuckets("patient", RATE_LIMIT_PATIENT_RPM)
+PROVIDERS: Dict[str, ProviderLimiter] = {
+    name: ProviderLimiter(name, rate, burst, PROVIDER_MAX_QUEUE, PROVIDER_MAX_WAIT_SECONDS)
+    for name, (rate, burst) in PROVIDER_LIMITS.items()
+}
+
+
+def admit_subject(subject: Optional[str]) -> None:
+    """Charge one call to a patient/session bucket; raises RateLimited if exhausted."""
+    if subject:
+        PATIENT_BUCKETS.check(subject, "patient")
+
+
+async def admit(provider: str, subject: Optional[str] = None, priority: str = "interactive") -> None:
+    """
+    Admit one outbound provider call for ``subject`` (patient id or session id)
+    in priority class ``priority`` (see ``PRIORITIES``).
+
+    Raises:
+        RateLimited: If the patient or the provider is out of capacity.
+    """
+    admit_subject(subject)
+    await PROVIDERS[provider].acquire(priority)
+
+
+def try_admit(provider: str, priority: str = "routine") -> bool:
+    """
+    Non-blocking ``admit`` for optional calls (e.g. enrichment): True if the
+    call may go ahead now; False means skip it rather than wait or fail.
+    """
+    return PROVIDERS[provider].try_acquire(priority)
+
+
+async def wait_for_provider(provider: str, priority: str = "routine") -> None:
+    """
+    Background variant of ``admit`` for queued jobs: no socket is held
+    open, so instead of rejecting it keeps waiting until a slot frees up.
+    """
+    while True:
+        try:
+            await PROVIDERS[provider].acquire(priority)
+            return
+        except RateLimited as exc:
+            await asyncio.sleep(exc.retry_after)
+
+
+# ── ASGI middleware ──────────────────────────────────────────────────────────
+
+def _trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(scope) -> str:
+    """
+    Client identity: the peer address, or — when the peer is a trusted
+    proxy — the nearest X-Forwarded-For hop that isn't one.
+    """
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if not _trusted_proxy(peer):
+        return peer
+    hops = []
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+    # Right to left: each trusted proxy vouches for the hop before it
+    for hop in reversed(hops):
+        if hop and not _trusted_proxy(hop):
+            return hop
+    return peer
+
+
+class RateLimitMiddleware:
+    """
+    Per-client limit applied before the request body is read, so a
+    rejected upload never ties up a socket. Only ``/api/`` paths count.
+    """
+
+    def __init__(self, app, path_prefix: str = "/api/"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        try:
+            CLIENT_BUCKETS.check(client_key(scope), "client")
+        except RateLimited as exc:
+            await send_rate_limited(send, exc)
+            return
+        await self.app(scope, receive, send)
+
+
+async def send_rate_limited(send, exc: RateLimited) -> None:
+    body = ('{"success": false, "detail": "%s"}' % str(exc)).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(exc.retry_after).encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
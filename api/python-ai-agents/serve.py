@@ -0,0 +1,192 @@
+"""
+Production entry point for the DoctorX Care API.
+
+    python serve.py
+
+Runs one worker process per usable CPU, so CPU work (validation, JSON
+encoding, prompt building, image handling) spreads across cores:
+
+- With gunicorn installed (Linux/macOS) the app is imported once in the
+  master (``preload_app``), so agent modules, instruction strings, the
+  medical-reference index and the OpenAPI schema are built before forking
+  and shared copy-on-write. Workers are Uvicorn workers, which pick up
+  uvloop and httptools when installed.
+- Otherwise (e.g. Windows) it falls back to uvicorn's own multi-process
+  supervisor with the same settings; each worker then imports the app itself.
+
+Any worker may get a client's next request, so the state requests share
+lives in SQLite under SHARED_STATE_DIR (see shared_state.py), not in a
+worker:
+- jobs and their results;
+- rate-limit buckets;
+- the usage ledger and token budgets;
+- analysis snapshots;
+- anomaly baselines.
+A job is polled on any worker, and limits and budgets hold for the server
+as a whole. What stays per worker is either a cache that any worker can
+rebuild (chart series, facility photos, tool results) or a queue of that
+worker's own waiting requests and jobs. The /metrics registry is also per
+worker, so a scrape describes the worker that answered it.
+
+SIGTERM drains gracefully: listeners close, in-flight requests and queued
+jobs get up to GRACEFUL_TIMEOUT seconds to finish. Workers are recycled
+after MAX_REQUESTS (+ jitter) requests to cap memory growth. Shared state
+is unaffected; a recycled worker drains its jobs like any other shutdown.
+
+Configuration:
+    HOST / PORT             bind address                       (0.0.0.0:8000)
+    WEB_CONCURRENCY         worker processes                   (usable CPUs)
+    MAX_REQUESTS            requests before a worker recycles  (1000, 0 = never)
+    MAX_REQUESTS_JITTER     each worker recycles after up to this many extra
+                            requests, so they don't all restart at once (100)
+    GRACEFUL_TIMEOUT        seconds to drain on shutdown       (30)
+    WORKER_TIMEOUT          seconds before a silent worker is killed (180)
+    KEEPALIVE               keep-alive seconds                 (5)
+    LOG_LEVEL               (info)
+"""
+
+import os
+import sys
+import logging
+import importlib.util
+from typing import Dict, Any
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+logger = logging.getLogger("doctorx.serve")
+
+
+def usable_cpus() -> int:
+    """CPUs this process may run on (respects affinity / container cpusets)."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _has(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Uvicorn workers are async, so one per core already keeps each core busy
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(usable_cpus())))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "1000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "100"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "180"))   # LLM calls can take a while
+KEEPALIVE = int(os.getenv("KEEPALIVE", "5"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info").lower()
+
+# uvicorn's "auto" already prefers these; named explicitly so a missing
+# dependency shows up in the startup log rather than as a silent slowdown
+LOOP = "uvloop" if _has("uvloop") else "asyncio"
+HTTP = "httptools" if _has("httptools") else "h11"
+
+
+def preload():
+    """
+    Import the app and build everything that is the same in every worker,
+    so forked workers share it instead of rebuilding it per process.
+    """
+    import main
+
+    # Agent configs: one construction per factory pulls in phi's model,
+    # tool and instruction machinery. Missing API keys only skip the warm-up.
+    for factory in (
+        main.get_medical_agent,
+        main.get_health_tracking_agent,
+        main.get_trend_visualization_agent,
+        main.get_report_extraction_agent,
+    ):
+        try:
+            factory()
+        except Exception as e:
+            logger.warning("Skipping warm-up of %s: %s", factory.__name__, e)
+
+    # FastAPI builds the OpenAPI schema lazily on first /docs hit
+    main.app.openapi()
+    return main.app
+
+
+# ── gunicorn ─────────────────────────────────────────────────────────────────
+
+def _uvicorn_worker_class() -> str:
+    # uvicorn.workers is deprecated in favour of the standalone uvicorn-worker package
+    if _has("uvicorn_worker"):
+        return "uvicorn_worker.UvicornWorker"
+    return "uvicorn.workers.UvicornWorker"
+
+
+def run_gunicorn() -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class DoctorXApplication(BaseApplication):
+        def __init__(self, options: Dict[str, Any]):
+            self.options = options
+            self.application = None
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            if self.application is None:
+                self.application = preload()
+            return self.application
+
+    options = {
+        "bind": f"{HOST}:{PORT}",
+        "workers": WEB_CONCURRENCY,
+        "worker_class": _uvicorn_worker_class(),
+        "preload_app": True,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "loglevel": LOG_LEVEL,
+        "accesslog": "-",
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    }
+    DoctorXApplication(options).run()
+
+
+# ── uvicorn fallback ─────────────────────────────────────────────────────────
+
+def run_uvicorn() -> None:
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        loop=LOOP,
+        http=HTTP,
+        limit_max_requests=MAX_REQUESTS or None,
+        limit_max_requests_jitter=MAX_REQUESTS_JITTER,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE,
+        log_level=LOG_LEVEL,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL.upper())
+    server = "gunicorn" if _has("gunicorn") and os.name != "nt" else "uvicorn"
+    logger.info(
+        "Starting %s with %d workers on %s:%d (loop=%s, http=%s, max_requests=%d)",
+        server, WEB_CONCURRENCY, HOST, PORT, LOOP, HTTP, MAX_REQUESTS,
+    )
+    if server == "gunicorn":
+        run_gunicorn()
+    else:
+        run_uvicorn()
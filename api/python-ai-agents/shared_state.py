@@ -0,0 +1,89 @@
+"""
+SQLite-backed state shared by every worker process of one server.
+
+serve.py runs several worker processes on one socket, and a client's next
+request may reach any of them. Anything a request has to see from earlier
+ones lives in SQLite files under SHARED_STATE_DIR rather than in a worker's
+memory:
+- jobs and their results (jobs.py);
+- rate-limit buckets (ratelimit.py);
+- the usage ledger and daily token budgets (usage.py);
+- analysis snapshots (analysis_snapshots.py);
+- the anomaly detector's per-stream baselines (anomaly.py).
+
+Each of those modules owns one file, so the rate-limit write made on every
+request never queues behind a job or ledger write. Files use WAL mode, so
+readers don't wait for a writer. Every write is a transaction of a few rows.
+
+The files outlive the processes. Finished job results, budgets, snapshots
+and baselines survive a worker being recycled or the server restarting.
+Point SHARED_STATE_DIR at an empty directory for a clean start, as the
+benchmark does. All workers must run on one host, because SQLite locking is
+not reliable over network filesystems.
+
+Configuration:
+    SHARED_STATE_DIR   directory of the state files (default <tmp>/doctorx_state)
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Sequence, Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARED_STATE_DIR = os.getenv(
+    "SHARED_STATE_DIR",
+    os.path.join("/tmp" if os.path.exists("/tmp") else ".", "doctorx_state"),
+)
+
+
+class SharedDB:
+    """One SQLite file of shared state; one connection per thread (and per process)."""
+
+    def __init__(self, name: str, schema: str, directory: str = SHARED_STATE_DIR):
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self.schema = schema
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialised = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited through fork (gunicorn preload) must not be reused
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Autocommit; transactions are opened explicitly by ``transaction``
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialised:
+                    conn.executescript(self.schema)
+                    self._initialised = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+        """Run one statement in its own transaction."""
+        return self._conn().execute(sql, params)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        ``BEGIN IMMEDIATE`` ... ``COMMIT``: the block's reads and writes see no
+        other worker's writes in between. Keep it short; it holds the file's
+        write lock.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
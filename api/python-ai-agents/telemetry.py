@@ -0,0 +1,334 @@
+"""
+Request telemetry — per-request phase spans, Prometheus metrics and
+Server-Timing headers.
+
+Handlers wrap the expensive parts of their work in ``span("phase")``;
+``TelemetryMiddleware`` collects those spans for the current request,
+records them into histograms exposed at ``/metrics``, adds a
+``Server-Timing`` header for the frontend, and logs slow requests with
+the full phase breakdown.
+"""
+
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Tuple, Iterator
+
+logger = logging.getLogger("doctorx.telemetry")
+
+# Requests slower than this are logged with their phase breakdown
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "5000"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+
+# ── Metric primitives ────────────────────────────────────────────────────────
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Point-in-time value with optional labels."""
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in seconds, Prometheus style."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.label_names)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            series[idx] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, inf)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds every metric rendered at ``/metrics``."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, label_names)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.counter(
+    "doctorx_http_requests_total", "HTTP requests handled.", ("method", "endpoint", "status"),
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "doctorx_http_request_duration_seconds", "End-to-end HTTP request latency.", ("method", "endpoint"),
+)
+PHASE_DURATION = REGISTRY.histogram(
+    "doctorx_phase_duration_seconds", "Time spent in each request phase.", ("endpoint", "phase"),
+)
+SLOW_REQUESTS_TOTAL = REGISTRY.counter(
+    "doctorx_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("endpoint",),
+)
+
+
+# ── Request traces & spans ───────────────────────────────────────────────────
+
+class RequestTrace:
+    """Phase timings collected for a single in-flight request."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.endpoint = path
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}   # phase -> seconds (accumulated)
+        self.profile = None   # set by ProfilingMiddleware for profiled requests
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"{_token(name)};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def _token(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("doctorx_request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """Return the trace for the request being handled, if any."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    """
+    Time a block of work as a named phase of the current request.
+    Safe to use outside a request (e.g. from the benchmark suite) — it
+    simply records nothing.
+    """
+    trace = _current_trace.get()
+    profile = trace.profile if trace is not None else None
+    if profile is not None:
+        profile.enter_thread()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add(phase, time.perf_counter() - start)
+        if profile is not None:
+            profile.exit_thread()
+
+
+@contextmanager
+def attach_thread() -> Iterator[None]:
+    """
+    Mark the current worker thread as doing the current request's work, so
+    a profiled request's samples include it. Spans do this implicitly.
+    """
+    trace = _current_trace.get()
+    profile = trace.profile if trace is not None else None
+    if profile is None:
+        yield
+        return
+    profile.enter_thread()
+    try:
+        yield
+    finally:
+        profile.exit_thread()
+
+
+# ── ASGI middleware ──────────────────────────────────────────────────────────
+
+class TelemetryMiddleware:
+    """
+    Pure ASGI middleware so the trace is live for the whole request,
+    including multipart body upload, and the Server-Timing header can be
+    injected into the response start message.
+    """
+
+    def __init__(self, app, metrics_path: str = "/metrics"):
+        self.app = app
+        self.metrics_path = metrics_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") == self.metrics_path:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope.get("method", "GET"), scope.get("path", ""))
+        token = _current_trace.set(trace)
+        status_holder = {"status": 500}
+
+        async def timed_receive():
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                trace.add("upload", trace.elapsed())
+            return message
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                trace.endpoint = _route_template(scope)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing(trace.elapsed()).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, timed_receive, timed_send)
+        finally:
+            _current_trace.reset(token)
+            _record(trace, status_holder["status"], scope)
+
+
+def _route_template(scope) -> str:
+    """Use the route's path template as the metric label to bound cardinality."""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path or "unmatched"
+
+
+def _record(trace: RequestTrace, status: int, scope) -> None:
+    total = trace.elapsed()
+    endpoint = _route_template(scope)
+    trace.endpoint = endpoint
+
+    REQUESTS_TOTAL.inc(method=trace.method, endpoint=endpoint, status=str(status))
+    REQUEST_DURATION.observe(total, method=trace.method, endpoint=endpoint)
+    for phase, seconds in trace.phases.items():
+        PHASE_DURATION.observe(seconds, endpoint=endpoint, phase=phase)
+
+    if total * 1000 >= SLOW_REQUEST_MS:
+        SLOW_REQUESTS_TOTAL.inc(endpoint=endpoint)
+        breakdown = ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in sorted(trace.phases.items(), key=lambda kv: -kv[1]))
+        logger.warning(
+            "Slow request %s %s -> %s in %.0fms [%s]",
+            trace.method, trace.path, status, total * 1000, breakdown or "no spans",
+        )
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition of every registered metric."""
+    return REGISTRY.render()
@@ -0,0 +1,185 @@
+"""
+Memoizing layer for phi agent tools.
+
+The analysis agents tend to repeat the same lookups ("normal TSH range",
+"HbA1c targets") across requests. Wrapping a toolkit with ``cached_toolkit``
+routes every tool call through one process-wide cache keyed on the tool
+name and its normalised arguments, so repeats skip the network round trip.
+Word order is part of the key: "high TSH low T4" and "low TSH high T4" are
+different questions. News tools ("latest news") get a much shorter TTL.
+
+Configuration:
+    TOOL_CACHE_TTL_SECONDS        how long a result stays fresh  (default 86400)
+    TOOL_CACHE_NEWS_TTL_SECONDS   the same for *_news tools, 0 = never cached (default 900)
+    TOOL_CACHE_MAX_ENTRIES        LRU bound on cached results    (default 2048)
+"""
+
+import os
+import re
+import time
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Tuple, List
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+TOOL_CACHE_TTL_SECONDS = float(os.getenv("TOOL_CACHE_TTL_SECONDS", "86400"))
+TOOL_CACHE_NEWS_TTL_SECONDS = float(os.getenv("TOOL_CACHE_NEWS_TTL_SECONDS", "900"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "2048"))
+
+TOOL_CACHE_REQUESTS = REGISTRY.counter(
+    "doctorx_tool_cache_requests_total", "Agent tool calls by cache outcome.", ("tool", "result"),
+)
+TOOL_CALL_DURATION = REGISTRY.histogram(
+    "doctorx_tool_call_duration_seconds", "Agent tool call latency, including cache hits.", ("tool", "cache"),
+)
+TOOL_CACHE_ENTRIES = REGISTRY.gauge(
+    "doctorx_tool_cache_entries", "Results currently held in the tool cache.",
+)
+
+
+# ── Normalisation ────────────────────────────────────────────────────────────
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s./%<>=+-]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(value: str) -> str:
+    """
+    Canonical form of a free-text query: case, punctuation and spacing are
+    ignored, so "Normal TSH range?" and "normal  tsh range" share one cache
+    entry. Word order is kept, since it carries meaning.
+    """
+    text = _PUNCTUATION_RE.sub(" ", value.casefold())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def _cache_key(tool: str, kwargs: Dict[str, Any]) -> Tuple:
+    return (tool,) + tuple(
+        (name, normalize_query(value) if isinstance(value, str) else repr(value))
+        for name, value in sorted(kwargs.items())
+    )
+
+
+# ── Cache ────────────────────────────────────────────────────────────────────
+
+class ToolCache:
+    """Thread-safe LRU with per-entry expiry plus per-tool hit/latency stats."""
+
+    def __init__(self, ttl: float = TOOL_CACHE_TTL_SECONDS, max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+        # tool -> {"hits", "misses", "hit_seconds", "miss_seconds"}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def ttl_for(self, tool: str) -> float:
+        """News results go stale in minutes, not a day."""
+        return TOOL_CACHE_NEWS_TTL_SECONDS if tool.rsplit(".", 1)[-1].endswith("_news") else self.ttl
+
+    def put(self, key: Tuple, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            size = len(self._entries)
+        TOOL_CACHE_ENTRIES.set(size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+        TOOL_CACHE_ENTRIES.set(0)
+
+    def _observe(self, tool: str, hit: bool, seconds: float) -> None:
+        result = "hit" if hit else "miss"
+        with self._lock:
+            stats = self._stats.setdefault(tool, {"hits": 0, "misses": 0, "hit_seconds": 0.0, "miss_seconds": 0.0})
+            stats["hits" if hit else "misses"] += 1
+            stats[result + "_seconds"] += seconds
+        TOOL_CACHE_REQUESTS.inc(tool=tool, result=result)
+        TOOL_CALL_DURATION.observe(seconds, tool=tool, cache=result)
+
+    def call(self, tool: str, fn: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+        """Return the cached result for ``tool(**kwargs)``, calling ``fn`` on a miss."""
+        start = time.perf_counter()
+        key = _cache_key(tool, kwargs)
+        hit, value = self.get(key)
+        if not hit:
+            value = fn(**kwargs)
+            # Exceptions propagate uncached; only real results are memoized
+            self.put(key, value, self.ttl_for(tool))
+        self._observe(tool, hit, time.perf_counter() - start)
+        return value
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(tool, dict(values)) for tool, values in self._stats.items()]
+        rows = []
+        for tool, s in items:
+            calls = s["hits"] + s["misses"]
+            rows.append({
+                "tool": tool,
+                "calls": int(calls),
+                "hits": int(s["hits"]),
+                "misses": int(s["misses"]),
+                "hit_rate": round(s["hits"] / calls, 3) if calls else 0.0,
+                "avg_hit_ms": round(s["hit_seconds"] * 1000.0 / s["hits"], 3) if s["hits"] else None,
+                "avg_miss_ms": round(s["miss_seconds"] * 1000.0 / s["misses"], 1) if s["misses"] else None,
+            })
+        return sorted(rows, key=lambda r: -r["calls"])
+
+
+TOOL_CACHE = ToolCache()
+
+
+# ── phi integration ──────────────────────────────────────────────────────────
+
+def memoize_tool(tool: str, fn: Callable[..., Any], cache: Optional[ToolCache] = None) -> Callable[..., Any]:
+    """
+    Wrap one tool function. ``functools.wraps`` keeps the name, docstring and
+    annotations so phi still derives the same JSON schema for the model.
+    """
+    cache = cache or TOOL_CACHE
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Bind so positional and keyword spellings of one call share a key
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return cache.call(tool, fn, dict(bound.arguments))
+
+    return wrapper
+
+
+def cached_toolkit(toolkit, cache: Optional[ToolCache] = None):
+    """Route every function registered on a phi ``Toolkit`` through the shared cache."""
+    for name, function in toolkit.functions.items():
+        if function.entrypoint is not None:
+            function.entrypoint = memoize_tool(f"{toolkit.name}.{name}", function.entrypoint, cache)
+    return toolkit
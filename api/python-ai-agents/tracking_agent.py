@@ -1,13 +1,115 @@
 import os
 from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.duckduckgo import DuckDuckGo
 from dotenv import load_dotenv
 
+# Offline guideline lookup (DuckDuckGo only as an opt-in fallback)
+from medical_reference import reference_tools, REFERENCE_TOOL_INSTRUCTION
+
+# Builds Gemini or Groq models from a router target ("provider:model")
+from llm_router import agent_model
+
 # Load environment variables
 load_dotenv()
 
-def get_health_tracking_agent():
+# Default Gemini model (callers may pass a cheaper one when degrading,
+# or a "provider:model" target when the LLM router fails over)
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# ── Reference ranges ─────────────────────────────────────────────────────────
+# Single source for the thresholds quoted to the tracking agent below and for
+# the chart zones built by vitals_series. A value v is in a zone when
+# low <= v < high, or low <= v <= high for zones flagged high_inclusive
+# (so the next zone starts strictly above high); None means unbounded.
+# Hypertensive crisis is ">180 / >120", so Stage 2 includes 180 and 120.
+
+BP_ELEVATED_SYSTOLIC = 120
+BP_STAGE1_SYSTOLIC, BP_STAGE1_DIASTOLIC = 130, 80
+BP_STAGE2_SYSTOLIC, BP_STAGE2_DIASTOLIC = 140, 90
+BP_CRISIS_SYSTOLIC, BP_CRISIS_DIASTOLIC = 180, 120          # emergency above these
+
+GLUCOSE_SEVERE_HYPO = 54                                    # mg/dL, emergency below
+GLUCOSE_HYPO = 70
+FASTING_PREDIABETES, FASTING_DIABETES = 100, 126
+POST_MEAL_PREDIABETES, POST_MEAL_DIABETES = 140, 200
+
+TSH_HYPERTHYROID, TSH_LOW, TSH_HIGH, TSH_HYPOTHYROID = 0.1, 0.4, 4.0, 10.0   # mIU/L
+
+# Resting heart rate (bpm) and SpO2 (%), per the medical-reference corpus
+HR_SEVERE_LOW, HR_LOW, HR_HIGH, HR_SEVERE_HIGH = 40, 60, 100, 120
+SPO2_HYPOXEMIA, SPO2_LOW, SPO2_NORMAL = 90, 92, 95           # emergency below hypoxemia
+
+# (label, low, high, level, high_inclusive) per chartable series, checked in order; level drives the colour band
+REFERENCE_ZONES = {
+    "systolic": [
+        ("Normal", None, BP_ELEVATED_SYSTOLIC, "normal", False),
+        ("Elevated", BP_ELEVATED_SYSTOLIC, BP_STAGE1_SYSTOLIC, "watch", False),
+        ("Stage 1 Hypertension", BP_STAGE1_SYSTOLIC, BP_STAGE2_SYSTOLIC, "warning", False),
+        ("Stage 2 Hypertension", BP_STAGE2_SYSTOLIC, BP_CRISIS_SYSTOLIC, "alert", True),
+        ("Hypertensive Crisis", BP_CRISIS_SYSTOLIC, None, "emergency", False),
+    ],
+    "diastolic": [
+        ("Normal", None, BP_STAGE1_DIASTOLIC, "normal", False),
+        ("Stage 1 Hypertension", BP_STAGE1_DIASTOLIC, BP_STAGE2_DIASTOLIC, "warning", False),
+        ("Stage 2 Hypertension", BP_STAGE2_DIASTOLIC, BP_CRISIS_DIASTOLIC, "alert", True),
+        ("Hypertensive Crisis", BP_CRISIS_DIASTOLIC, None, "emergency", False),
+    ],
+    "blood_glucose": [
+        ("Severe Hypoglycemia", None, GLUCOSE_SEVERE_HYPO, "emergency", False),
+        ("Hypoglycemia", GLUCOSE_SEVERE_HYPO, GLUCOSE_HYPO, "alert", False),
+        ("Normal (fasting)", GLUCOSE_HYPO, FASTING_PREDIABETES, "normal", False),
+        ("Prediabetes (fasting)", FASTING_PREDIABETES, FASTING_DIABETES, "warning", False),
+        ("Diabetes (fasting)", FASTING_DIABETES, None, "alert", False),
+    ],
+    "blood_glucose_post_meal": [
+        ("Severe Hypoglycemia", None, GLUCOSE_SEVERE_HYPO, "emergency", False),
+        ("Hypoglycemia", GLUCOSE_SEVERE_HYPO, GLUCOSE_HYPO, "alert", False),
+        ("Normal (2h post-meal)", GLUCOSE_HYPO, POST_MEAL_PREDIABETES, "normal", False),
+        ("Prediabetes (2h post-meal)", POST_MEAL_PREDIABETES, POST_MEAL_DIABETES, "warning", False),
+        ("Diabetes (2h post-meal)", POST_MEAL_DIABETES, None, "alert", False),
+    ],
+    "tsh": [
+        ("Hyperthyroidism range", None, TSH_HYPERTHYROID, "alert", False),
+        ("Subclinical Hyperthyroidism range", TSH_HYPERTHYROID, TSH_LOW, "warning", False),
+        ("Normal", TSH_LOW, TSH_HIGH, "normal", False),
+        ("Subclinical Hypothyroidism range", TSH_HIGH, TSH_HYPOTHYROID, "warning", False),
+        ("Hypothyroidism", TSH_HYPOTHYROID, None, "alert", False),
+    ],
+    "heart_rate": [
+        ("Marked Bradycardia", None, HR_SEVERE_LOW, "alert", False),
+        ("Bradycardia", HR_SEVERE_LOW, HR_LOW, "watch", False),
+        ("Normal", HR_LOW, HR_HIGH, "normal", False),
+        ("Tachycardia", HR_HIGH, HR_SEVERE_HIGH, "watch", False),
+        ("Marked Tachycardia", HR_SEVERE_HIGH, None, "alert", False),
+    ],
+    "oxygen_saturation": [
+        ("Hypoxemia", None, SPO2_HYPOXEMIA, "emergency", False),
+        ("Low", SPO2_HYPOXEMIA, SPO2_LOW, "alert", False),
+        ("Borderline", SPO2_LOW, SPO2_NORMAL, "watch", False),
+        ("Normal", SPO2_NORMAL, None, "normal", False),
+    ],
+}
+
+REFERENCE_UNITS = {
+    "systolic": "mmHg",
+    "diastolic": "mmHg",
+    "blood_glucose": "mg/dL",
+    "blood_glucose_post_meal": "mg/dL",
+    "tsh": "mIU/L",
+    "heart_rate": "bpm",
+    "oxygen_saturation": "%",
+}
+
+
+def in_zone(value: float, low, high, high_inclusive: bool = False) -> bool:
+    """Whether ``value`` falls in a REFERENCE_ZONES band."""
+    if low is not None and value < low:
+        return False
+    if high is None:
+        return True
+    return value <= high if high_inclusive else value < high
+
+
+def get_health_tracking_agent(model_id: str = GEMINI_MODEL):
     """
     Advanced AI Agent for Chronic Care & Health Trend Analysis
     Specializes in analyzing vital signs, detecting trends, and providing personalized recommendations
@@ -19,8 +121,8 @@ def get_health_tracking_agent():
         raise ValueError("Error: 'TRACKING_SERVICE_API_KEY' not found in .env file. Please check spelling.")
 
     return Agent(
-        model=Gemini(id="gemini-2.5-flash", api_key=api_key),
-        tools=[DuckDuckGo()],
+        model=agent_model(model_id, api_key),
+        tools=reference_tools(),
         markdown=True,
         name="Chronic Care Health Analyst",
         description="Expert AI assistant specializing in chronic disease management, vital sign analysis, and personalized health trend monitoring for conditions like Diabetes, Hypertension, and Thyroid disorders.",
@@ -28,6 +130,7 @@ def get_health_tracking_agent():
         instructions=[
             "Role: You are an empathetic, clinical-grade AI Health Analyst specializing in chronic disease management.",
             "Your primary focus is analyzing quantitative health data and providing actionable insights.",
+            REFERENCE_TOOL_INSTRUCTION,
             "",
             "### CORE RESPONSIBILITIES:",
             "1. Analyze vital signs and biomarkers for chronic conditions (Diabetes, Hypertension, Thyroid)",
@@ -39,28 +142,28 @@ def get_health_tracking_agent():
             "### DATA ANALYSIS FRAMEWORK:",
             "",
             "**For Blood Pressure (BP):**",
-            "- Normal: Systolic <120 AND Diastolic <80 mmHg",
-            "- Elevated: Systolic 120-129 AND Diastolic <80 mmHg",
-            "- Stage 1 Hypertension: Systolic 130-139 OR Diastolic 80-89 mmHg",
-            "- Stage 2 Hypertension: Systolic ≥140 OR Diastolic ≥90 mmHg",
-            "- Hypertensive Crisis (EMERGENCY): Systolic >180 OR Diastolic >120 mmHg",
+            f"- Normal: Systolic <{BP_ELEVATED_SYSTOLIC} AND Diastolic <{BP_STAGE1_DIASTOLIC} mmHg",
+            f"- Elevated: Systolic {BP_ELEVATED_SYSTOLIC}-{BP_STAGE1_SYSTOLIC - 1} AND Diastolic <{BP_STAGE1_DIASTOLIC} mmHg",
+            f"- Stage 1 Hypertension: Systolic {BP_STAGE1_SYSTOLIC}-{BP_STAGE2_SYSTOLIC - 1} OR Diastolic {BP_STAGE1_DIASTOLIC}-{BP_STAGE2_DIASTOLIC - 1} mmHg",
+            f"- Stage 2 Hypertension: Systolic ≥{BP_STAGE2_SYSTOLIC} OR Diastolic ≥{BP_STAGE2_DIASTOLIC} mmHg",
+            f"- Hypertensive Crisis (EMERGENCY): Systolic >{BP_CRISIS_SYSTOLIC} OR Diastolic >{BP_CRISIS_DIASTOLIC} mmHg",
             "",
             "**For Blood Glucose:**",
-            "- Fasting Normal: 70-100 mg/dL (3.9-5.6 mmol/L)",
-            "- Fasting Prediabetes: 100-125 mg/dL (5.6-6.9 mmol/L)",
-            "- Fasting Diabetes: ≥126 mg/dL (≥7.0 mmol/L)",
-            "- 2-Hour Post-Meal Normal: <140 mg/dL (<7.8 mmol/L)",
-            "- 2-Hour Post-Meal Prediabetes: 140-199 mg/dL (7.8-11.0 mmol/L)",
-            "- 2-Hour Post-Meal Diabetes: ≥200 mg/dL (≥11.1 mmol/L)",
-            "- Hypoglycemia Alert: <70 mg/dL (<3.9 mmol/L)",
-            "- Severe Hypoglycemia (EMERGENCY): <54 mg/dL (<3.0 mmol/L)",
+            f"- Fasting Normal: {GLUCOSE_HYPO}-{FASTING_PREDIABETES} mg/dL (3.9-5.6 mmol/L)",
+            f"- Fasting Prediabetes: {FASTING_PREDIABETES}-{FASTING_DIABETES - 1} mg/dL (5.6-6.9 mmol/L)",
+            f"- Fasting Diabetes: ≥{FASTING_DIABETES} mg/dL (≥7.0 mmol/L)",
+            f"- 2-Hour Post-Meal Normal: <{POST_MEAL_PREDIABETES} mg/dL (<7.8 mmol/L)",
+            f"- 2-Hour Post-Meal Prediabetes: {POST_MEAL_PREDIABETES}-{POST_MEAL_DIABETES - 1} mg/dL (7.8-11.0 mmol/L)",
+            f"- 2-Hour Post-Meal Diabetes: ≥{POST_MEAL_DIABETES} mg/dL (≥11.1 mmol/L)",
+            f"- Hypoglycemia Alert: <{GLUCOSE_HYPO} mg/dL (<3.9 mmol/L)",
+            f"- Severe Hypoglycemia (EMERGENCY): <{GLUCOSE_SEVERE_HYPO} mg/dL (<3.0 mmol/L)",
             "",
             "**For Thyroid (TSH):**",
-            "- Normal TSH: 0.4-4.0 mIU/L",
-            "- Subclinical Hypothyroidism: TSH 4.0-10 mIU/L with normal T4",
-            "- Hypothyroidism: TSH >10 mIU/L",
-            "- Subclinical Hyperthyroidism: TSH <0.4 mIU/L with normal T4/T3",
-            "- Hyperthyroidism: TSH <0.1 mIU/L with elevated T4/T3",
+            f"- Normal TSH: {TSH_LOW}-{TSH_HIGH} mIU/L",
+            f"- Subclinical Hypothyroidism: TSH {TSH_HIGH}-{TSH_HYPOTHYROID:g} mIU/L with normal T4",
+            f"- Hypothyroidism: TSH >{TSH_HYPOTHYROID:g} mIU/L",
+            f"- Subclinical Hyperthyroidism: TSH <{TSH_LOW} mIU/L with normal T4/T3",
+            f"- Hyperthyroidism: TSH <{TSH_HYPERTHYROID} mIU/L with elevated T4/T3",
             "",
             "### OUTPUT FORMAT (STRICTLY FOLLOW):",
             "",
@@ -185,7 +288,7 @@ def get_health_tracking_agent():
     )
 
 
-def get_trend_visualization_agent():
+def get_trend_visualization_agent(model_id: str = GEMINI_MODEL):
     """
     Specialized agent for generating trend insights and chart recommendations
     """
@@ -196,8 +299,8 @@ def get_trend_visualization_agent():
         raise ValueError("Error: 'TRACKING_SERVICE_API_KEY' not found in .env file.")
 
     return Agent(
-        model=Gemini(id="gemini-2.5-flash", api_key=api_key),
-        tools=[DuckDuckGo()],
+        model=agent_model(model_id, api_key),
+        tools=reference_tools(),
         markdown=True,
         name="Health Trend Visualization Expert",
         description="Specializes in analyzing health data patterns and providing visualization insights.",
@@ -205,6 +308,7 @@ def get_trend_visualization_agent():
         instructions=[
             "Role: You are a data visualization expert for health metrics.",
             "Your task is to analyze time-series health data and provide structured insights.",
+            REFERENCE_TOOL_INSTRUCTION,
             "",
             "### OUTPUT FORMAT:",
             "",
@@ -234,7 +338,7 @@ def get_trend_visualization_agent():
     )
 
 
-def get_report_extraction_agent():
+def get_report_extraction_agent(model_id: str = GEMINI_MODEL):
     """
     Specialized agent for extracting structured data from scanned health reports
     """
@@ -245,7 +349,7 @@ def get_report_extraction_agent():
         raise ValueError("Error: 'TRACKING_SERVICE_API_KEY' not found in .env file.")
 
     return Agent(
-        model=Gemini(id="gemini-2.5-flash", api_key=api_key),
+        model=agent_model(model_id, api_key),
         tools=[],
         markdown=True,
         name="Medical Report Data Extractor",
@@ -0,0 +1,383 @@
+"""
+LLM usage ledger — token and latency accounting for every Gemini and
+Groq call, aggregated per endpoint, model and patient/session.
+
+Prompt tokens served from a provider-side cache (Gemini context caching,
+Groq prompt caching) are counted separately so the cached share and the
+latency difference for cache hits can be watched (see prompt_cache.py).
+
+Also enforces optional per-patient daily token budgets:
+    PATIENT_DAILY_TOKEN_BUDGET  tokens per patient per UTC day (0 = unlimited;
+                                otherwise budgeted routes require a patient_id)
+    TOKEN_BUDGET_MODE           "reject" (HTTP 429) or "degrade" (cheaper model)
+
+The ledger lives in shared_state.py, so every worker process adds to the
+same totals and the same daily counts; a budget is enforced for the server
+as a whole. Per-patient totals are capped at USAGE_MAX_SUBJECTS (least
+recently active dropped first) and daily counts from earlier UTC days are
+deleted; both are trimmed once a minute.
+"""
+
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Iterator
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY, current_trace
+from shared_state import SharedDB
+
+load_dotenv()
+
+PATIENT_DAILY_TOKEN_BUDGET = int(os.getenv("PATIENT_DAILY_TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_MODE = os.getenv("TOKEN_BUDGET_MODE", "reject").lower()
+
+# Model to fall back to when a patient is over budget in "degrade" mode
+DEGRADED_MODELS = {
+    "gemini-2.5-flash": "gemini-2.5-flash-lite",
+    "llama-3.3-70b-versatile": "llama-3.1-8b-instant",
+}
+
+# How many individual call records to keep for the query endpoint
+MAX_RECENT_RECORDS = int(os.getenv("USAGE_MAX_RECENT_RECORDS", "5000"))
+# How many patients/sessions to keep totals for
+MAX_SUBJECTS = int(os.getenv("USAGE_MAX_SUBJECTS", "100000"))
+
+# How often old days and surplus patients are trimmed from the shared tables
+_TRIM_INTERVAL_SECONDS = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS totals (
+    grp                  TEXT NOT NULL,
+    key                  TEXT NOT NULL,
+    calls                INTEGER NOT NULL,
+    prompt_tokens        INTEGER NOT NULL,
+    cached_prompt_tokens INTEGER NOT NULL,
+    completion_tokens    INTEGER NOT NULL,
+    latency_ms           REAL NOT NULL,
+    updated              REAL NOT NULL,
+    PRIMARY KEY (grp, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS totals_updated ON totals (grp, updated);
+CREATE TABLE IF NOT EXISTS daily (
+    day     TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    tokens  INTEGER NOT NULL,
+    PRIMARY KEY (day, subject)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS records (
+    id         INTEGER PRIMARY KEY,
+    patient_id TEXT,
+    session_id TEXT,
+    record     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_patient ON records (patient_id);
+CREATE INDEX IF NOT EXISTS records_session ON records (session_id);
+"""
+
+_DB = SharedDB("usage", _SCHEMA)
+
+LLM_TOKENS = REGISTRY.counter(
+    "doctorx_llm_tokens_total", "LLM tokens consumed.", ("endpoint", "model", "kind"),
+)
+LLM_CALLS = REGISTRY.counter(
+    "doctorx_llm_calls_total", "LLM calls made.", ("endpoint", "model", "provider"),
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "doctorx_llm_call_duration_seconds", "LLM call latency.", ("provider", "model"),
+)
+LLM_PROMPT_CACHE_TOKENS = REGISTRY.counter(
+    "doctorx_llm_prompt_cache_tokens_total", "Prompt tokens by whether the provider served them from its cache.",
+    ("provider", "model", "kind"),
+)
+# Whole-call latency (calls are not streamed), split by prompt-cache outcome
+LLM_LATENCY_BY_CACHE = REGISTRY.histogram(
+    "doctorx_llm_call_duration_by_prompt_cache_seconds",
+    "LLM call latency, by whether any prompt tokens were cached.",
+    ("provider", "model", "prompt_cache"),
+)
+BUDGET_ACTIONS = REGISTRY.counter(
+    "doctorx_token_budget_actions_total", "Requests rejected or degraded by token budgets.", ("action",),
+)
+
+
+class PatientIdRequired(ValueError):
+    """Raised when budgets are enforced and a budgeted request names no patient."""
+
+    def __init__(self):
+        super().__init__("patient_id is required while daily token budgets are enforced.")
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when a patient has used up their daily token budget in reject mode."""
+
+    def __init__(self, patient_id: str, used: int, budget: int):
+        self.patient_id = patient_id
+        self.used = used
+        self.budget = budget
+        super().__init__(
+            f"Daily token budget exhausted for '{patient_id}' ({used}/{budget} tokens). "
+            "Please try again tomorrow."
+        )
+
+
+@dataclass
+class UsageRecord:
+    timestamp: str
+    endpoint: str
+    provider: str
+    model: str
+    patient_id: Optional[str]
+    session_id: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+    latency_ms: float
+    cached_prompt_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+# ── Attribution ──────────────────────────────────────────────────────────────
+
+_attribution: ContextVar[Dict[str, Optional[str]]] = ContextVar("doctorx_usage_attribution", default={})
+
+
+@contextmanager
+def attribute_usage(patient_id: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[None]:
+    """Attribute every LLM call inside the block to a patient and/or session."""
+    token = _attribution.set({"patient_id": patient_id, "session_id": session_id})
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def _current_endpoint() -> str:
+    trace = current_trace()
+    return trace.path if trace is not None else "background"
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+# ── Ledger ───────────────────────────────────────────────────────────────────
+
+class UsageLedger:
+    """Thread- and process-safe ledger of LLM usage, kept in the shared usage tables."""
+
+    def __init__(self, max_recent: int = MAX_RECENT_RECORDS, max_subjects: int = MAX_SUBJECTS):
+        self.max_recent = max_recent
+        self.max_subjects = max_subjects
+        self._last_trim = 0.0
+
+    def _trim(self, conn, now: float) -> None:
+        # Budgets only read today's counts; the "patient" totals are bounded by recency
+        if now - self._last_trim < _TRIM_INTERVAL_SECONDS:
+            return
+        self._last_trim = now
+        conn.execute("DELETE FROM daily WHERE day < ?", (_today(),))
+        conn.execute(
+            "DELETE FROM totals WHERE grp = 'patient' AND key IN "
+            "(SELECT key FROM totals WHERE grp = 'patient' ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_subjects,),
+        )
+
+    def record(self, record: UsageRecord) -> None:
+        day = record.timestamp[:10]
+        subject = record.patient_id or record.session_id
+        now = time.time()
+        with _DB.transaction() as conn:
+            conn.execute(
+                "INSERT INTO records (patient_id, session_id, record) VALUES (?, ?, ?)",
+                (record.patient_id, record.session_id, json.dumps(asdict(record))),
+            )
+            conn.execute(
+                "DELETE FROM records WHERE id <= (SELECT MAX(id) FROM records) - ?", (self.max_recent,),
+            )
+            for group, key in (
+                ("endpoint", record.endpoint),
+                ("model", record.model),
+                ("patient", subject or "anonymous"),
+            ):
+                conn.execute(
+                    "INSERT INTO totals VALUES (?, ?, 1, ?, ?, ?, ?, ?) ON CONFLICT (grp, key) DO UPDATE SET "
+                    "calls = calls + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                    "cached_prompt_tokens = cached_prompt_tokens + excluded.cached_prompt_tokens, "
+                    "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                    "latency_ms = latency_ms + excluded.latency_ms, updated = excluded.updated",
+                    (
+                        group, key, record.prompt_tokens, record.cached_prompt_tokens,
+                        record.completion_tokens, record.latency_ms, now,
+                    ),
+                )
+            if subject:
+                conn.execute(
+                    "INSERT INTO daily VALUES (?, ?, ?) ON CONFLICT (day, subject) DO UPDATE SET "
+                    "tokens = tokens + excluded.tokens",
+                    (day, subject, record.total_tokens),
+                )
+            self._trim(conn, now)
+
+        LLM_CALLS.inc(endpoint=record.endpoint, model=record.model, provider=record.provider)
+        LLM_TOKENS.inc(record.prompt_tokens, endpoint=record.endpoint, model=record.model, kind="prompt")
+        LLM_TOKENS.inc(record.completion_tokens, endpoint=record.endpoint, model=record.model, kind="completion")
+        LLM_LATENCY.observe(record.latency_ms / 1000.0, provider=record.provider, model=record.model)
+        cached = min(record.cached_prompt_tokens, record.prompt_tokens)
+        LLM_PROMPT_CACHE_TOKENS.inc(cached, provider=record.provider, model=record.model, kind="cached")
+        LLM_PROMPT_CACHE_TOKENS.inc(record.prompt_tokens - cached, provider=record.provider, model=record.model, kind="uncached")
+        LLM_LATENCY_BY_CACHE.observe(
+            record.latency_ms / 1000.0, provider=record.provider, model=record.model,
+            prompt_cache="hit" if cached else "miss",
+        )
+
+    def tokens_today(self, subject: str) -> int:
+        row = _DB.execute("SELECT tokens FROM daily WHERE day = ? AND subject = ?", (_today(), subject)).fetchone()
+        return row[0] if row else 0
+
+    def summary(self, group_by: str = "endpoint") -> List[Dict[str, Any]]:
+        cursor = _DB.execute(
+            "SELECT key, calls, prompt_tokens, cached_prompt_tokens, completion_tokens, latency_ms "
+            "FROM totals WHERE grp = ?", (group_by,),
+        )
+        rows = [
+            {
+                group_by: key, "calls": calls, "prompt_tokens": prompt, "cached_prompt_tokens": cached,
+                "completion_tokens": completion, "latency_ms": latency,
+            }
+            for key, calls, prompt, cached, completion, latency in cursor.fetchall()
+        ]
+        for row in rows:
+            row["total_tokens"] = row["prompt_tokens"] + row["completion_tokens"]
+            row["cached_prompt_share"] = round(row["cached_prompt_tokens"] / row["prompt_tokens"], 3) if row["prompt_tokens"] else 0.0
+            row["avg_latency_ms"] = round(row.pop("latency_ms") / row["calls"], 1) if row["calls"] else 0.0
+        return sorted(rows, key=lambda r: -r["total_tokens"])
+
+    def records(self, patient_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        if patient_id:
+            cursor = _DB.execute(
+                "SELECT record FROM records WHERE patient_id = ? OR session_id = ? ORDER BY id DESC LIMIT ?",
+                (patient_id, patient_id, limit),
+            )
+        else:
+            cursor = _DB.execute("SELECT record FROM records ORDER BY id DESC LIMIT ?", (limit,))
+        records = [UsageRecord(**json.loads(data)) for (data,) in reversed(cursor.fetchall())]
+        return [asdict(r) | {"total_tokens": r.total_tokens} for r in records]
+
+
+LEDGER = UsageLedger()
+
+
+# ── Recording helpers ────────────────────────────────────────────────────────
+
+def record_llm_call(
+    provider: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    latency_seconds: float,
+    cached_prompt_tokens: int = 0,
+) -> UsageRecord:
+    """Record one LLM call against the current endpoint and attribution."""
+    attribution = _attribution.get()
+    record = UsageRecord(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        endpoint=_current_endpoint(),
+        provider=provider,
+        model=model,
+        patient_id=attribution.get("patient_id"),
+        session_id=attribution.get("session_id"),
+        prompt_tokens=int(prompt_tokens or 0),
+        completion_tokens=int(completion_tokens or 0),
+        latency_ms=round(latency_seconds * 1000.0, 1),
+        cached_prompt_tokens=int(cached_prompt_tokens or 0),
+    )
+    LEDGER.record(record)
+    return record
+
+
+def record_groq_completion(completion: Any, model: str, latency_seconds: float) -> None:
+    """Record usage from a Groq ``ChatCompletion`` (``completion.usage``)."""
+    usage = getattr(completion, "usage", None)
+    # Only models with prompt caching report prompt_tokens_details
+    details = getattr(usage, "prompt_tokens_details", None)
+    record_llm_call(
+        provider="groq",
+        model=getattr(completion, "model", None) or model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=getattr(usage, "completion_tokens", 0),
+        latency_seconds=latency_seconds,
+        cached_prompt_tokens=getattr(details, "cached_tokens", 0) or 0,
+    )
+
+
+def record_agent_run(response: Any, model: str, latency_seconds: float, provider: str = "gemini") -> None:
+    """
+    Record usage from a phi ``RunResponse``. phi aggregates metrics per
+    assistant message into lists, so tool-calling runs are summed.
+    ``provider`` is "groq" when the router has failed an agent over to Groq.
+    """
+    metrics = getattr(response, "metrics", None) or {}
+
+    def _sum(name: str) -> int:
+        value = metrics.get(name, 0)
+        if isinstance(value, (list, tuple)):
+            return int(sum(v or 0 for v in value))
+        return int(value or 0)
+
+    record_llm_call(
+        provider=provider,
+        model=getattr(response, "model", None) or model,
+        prompt_tokens=_sum("input_tokens"),
+        completion_tokens=_sum("output_tokens"),
+        latency_seconds=latency_seconds,
+        # Filled in by prompt_cache.CachedGemini
+        cached_prompt_tokens=_sum("cached_tokens"),
+    )
+
+
+@contextmanager
+def timed() -> Iterator[Dict[str, float]]:
+    """Tiny stopwatch: ``with timed() as t: ...; t["seconds"]``."""
+    result = {"seconds": 0.0}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result["seconds"] = time.perf_counter() - start
+
+
+# ── Budgets ──────────────────────────────────────────────────────────────────
+
+def budget_model(patient_id: Optional[str], model: str) -> str:
+    """
+    Return the model a request may use given the patient's daily budget.
+    The budget is per patient, never per session, so starting a new session
+    does not reset it.
+
+    Raises:
+        PatientIdRequired: If budgets are enforced and ``patient_id`` is missing.
+        TokenBudgetExceeded: If over budget and TOKEN_BUDGET_MODE is "reject".
+    """
+    if PATIENT_DAILY_TOKEN_BUDGET <= 0:
+        return model
+    if not patient_id:
+        raise PatientIdRequired()
+
+    used = LEDGER.tokens_today(patient_id)
+    if used < PATIENT_DAILY_TOKEN_BUDGET:
+        return model
+
+    if TOKEN_BUDGET_MODE == "degrade" and model in DEGRADED_MODELS:
+        BUDGET_ACTIONS.inc(action="degraded")
+        return DEGRADED_MODELS[model]
+
+    BUDGET_ACTIONS.inc(action="rejected")
+    raise TokenBudgetExceeded(patient_id, used, PATIENT_DAILY_TOKEN_BUDGET)
@@ -0,0 +1,236 @@
+"""
+Bulk export of a patient's vitals and stored reports as Parquet, Arrow IPC
+or CSV.
+
+Exports are streamed. Rows are read from the vitals store in batches of
+EXPORT_ROW_GROUP_ROWS vitals or EXPORT_REPORT_BATCH_ROWS reports (each
+report carries its summary and JSON data, so its batches are much
+smaller); each batch becomes one Parquet row group (or Arrow record batch,
+or block of CSV lines) and its bytes are sent before the next batch is
+read. Memory stays at about one batch however many years of
+readings are exported. Metric / report-kind and date-range filters are
+pushed down into the SQLite query, which walks the (patient_id, metric, ts)
+key, so filtered-out rows are never read. Parquet row groups carry min/max
+statistics, so readers can skip them by metric and time in turn.
+
+Datasets:
+    vitals    patient_id, metric, ts, value, unit, context, source
+    reports   patient_id, kind, ts, condition, filename, summary, data (JSON)
+
+Formats:
+    parquet   zstd-compressed Parquet        (needs pyarrow)
+    arrow     Arrow IPC streaming format     (needs pyarrow)
+    csv       CSV, always available
+
+``ts`` is the wall-clock time as stored (timestamp without time zone).
+Both ``start`` and ``end`` are inclusive, to the second.
+"blood_pressure" selects the systolic and diastolic rows.
+
+Configuration:
+    EXPORT_ROW_GROUP_ROWS     vitals rows per row group / record batch   (default 65536)
+    EXPORT_REPORT_BATCH_ROWS  reports per row group / record batch       (default 256)
+"""
+
+import io
+import os
+import re
+import csv
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, List, Iterator, Sequence
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from vitals_store import STORE, VitalsStore, to_ts, to_iso
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:   # optional; CSV export works without it
+    pa = None
+
+load_dotenv()
+
+EXPORT_ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "65536"))
+EXPORT_REPORT_BATCH_ROWS = int(os.getenv("EXPORT_REPORT_BATCH_ROWS", "256"))
+
+# format -> (media type, file extension)
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+}
+DATASETS = ("vitals", "reports")
+
+# Metrics stored as more than one row per reading
+METRIC_ALIASES = {"blood_pressure": ("systolic", "diastolic")}
+
+EXPORTS = REGISTRY.counter(
+    "doctorx_exports_total", "Bulk exports started, by dataset and format.", ("dataset", "format"),
+)
+EXPORT_ROWS = REGISTRY.counter(
+    "doctorx_export_rows_total", "Rows written by bulk exports.", ("dataset", "format"),
+)
+
+_COLUMNS = {
+    "vitals": ("patient_id", "metric", "ts", "value", "unit", "context", "source"),
+    "reports": ("patient_id", "kind", "ts", "condition", "filename", "summary", "data"),
+}
+
+
+class ExportError(ValueError):
+    """Bad export parameters, or a format whose library isn't installed."""
+
+
+def _schema(dataset: str) -> "pa.Schema":
+    if dataset == "vitals":
+        return pa.schema([
+            ("patient_id", pa.string()), ("metric", pa.string()), ("ts", pa.timestamp("s")),
+            ("value", pa.float64()), ("unit", pa.string()), ("context", pa.string()), ("source", pa.string()),
+        ])
+    return pa.schema([
+        ("patient_id", pa.string()), ("kind", pa.string()), ("ts", pa.timestamp("s")),
+        ("condition", pa.string()), ("filename", pa.string()), ("summary", pa.string()), ("data", pa.string()),
+    ])
+
+
+def parse_bound(text: Optional[str], end: bool = False) -> Optional[int]:
+    """
+    Store timestamp for a ``start``/``end`` query value (YYYY-MM-DD or ISO
+    datetime). For ``end`` it is the exclusive upper bound the store
+    expects: a date-only ``end`` includes that whole day, a datetime
+    includes its own second.
+    """
+    if not text:
+        return None
+    try:
+        parsed = datetime.fromisoformat(text.strip())
+    except ValueError:
+        raise ExportError(f"Invalid date {text!r}; use YYYY-MM-DD or an ISO datetime.")
+    if not end:
+        return to_ts(parsed)
+    if len(text.strip()) == 10:
+        return to_ts(parsed + timedelta(days=1))
+    # Stored times are whole seconds
+    return to_ts(parsed) + 1
+
+
+# ── Writers ──────────────────────────────────────────────────────────────────
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that collects what pyarrow writes until it is drained."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _record_batch(schema: "pa.Schema", patient_id: str, rows: List[tuple]) -> "pa.RecordBatch":
+    columns = list(zip(*rows))
+    arrays = [pa.array([patient_id] * len(rows), pa.string())] + [
+        pa.array(values, field.type) for values, field in zip(columns, list(schema)[1:])
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _arrow_chunks(fmt: str, dataset: str, patient_id: str, batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    schema = _schema(dataset)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = lambda batch: writer.write_batch(batch, row_group_size=batch.num_rows)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    for rows in batches:
+        write(_record_batch(schema, patient_id, rows))
+        EXPORT_ROWS.inc(len(rows), dataset=dataset, format=fmt)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _csv_chunks(dataset: str, patient_id: str, batches: Iterator[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_COLUMNS[dataset])
+    for rows in batches:
+        # ts is the second column of every stored row
+        writer.writerows((patient_id, row[0], to_iso(row[1]), *row[2:]) for row in rows)
+        EXPORT_ROWS.inc(len(rows), dataset=dataset, format="csv")
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+# ── Export ───────────────────────────────────────────────────────────────────
+
+@dataclass
+class Export:
+    chunks: Iterator[bytes]
+    media_type: str
+    filename: str
+
+
+def open_export(
+    patient_id: str,
+    dataset: str = "vitals",
+    fmt: str = "parquet",
+    select: Optional[Sequence[str]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    store: VitalsStore = STORE,
+) -> Export:
+    """
+    Validate an export request and return its byte stream. ``select`` holds
+    metrics for "vitals" and report kinds for "reports". Nothing is read
+    until ``chunks`` is iterated.
+
+    Raises:
+        ExportError: On an unknown dataset/format, a bad date, or a
+            pyarrow format when pyarrow isn't installed.
+    """
+    if dataset not in DATASETS:
+        raise ExportError(f"Unknown dataset {dataset!r}; use one of {', '.join(DATASETS)}.")
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}; use one of {', '.join(FORMATS)}.")
+    if fmt != "csv" and pa is None:
+        raise ExportError(f"{fmt} export needs the 'pyarrow' package (pip install pyarrow); or use format=csv.")
+    first, last = parse_bound(start), parse_bound(end, end=True)
+    if first is not None and last is not None and first >= last:
+        raise ExportError("start must not be after end.")
+
+    wanted: List[str] = []
+    for name in select or ():
+        wanted.extend(METRIC_ALIASES.get(name, (name,)) if dataset == "vitals" else (name,))
+    if dataset == "vitals":
+        batches = store.iter_readings(patient_id, wanted, first, last, batch_size=EXPORT_ROW_GROUP_ROWS)
+    else:
+        batches = store.iter_reports(patient_id, wanted, first, last, batch_size=EXPORT_REPORT_BATCH_ROWS)
+
+    EXPORTS.inc(dataset=dataset, format=fmt)
+    chunks = _csv_chunks(dataset, patient_id, batches) if fmt == "csv" else _arrow_chunks(fmt, dataset, patient_id, batches)
+    media_type, extension = FORMATS[fmt]
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", patient_id)[:64]
+    return Export(chunks, media_type, f"{safe_id}-{dataset}.{extension}")
@@ -0,0 +1,312 @@
+"""
+Chart-ready vitals series for the trend views.
+
+Long ranges (90/365 days of CGM-style glucose, daily BP) are too many points
+to ship to and draw in the browser, so ``build_chart`` reduces a reading list
+to:
+
+- an LTTB (Largest-Triangle-Three-Buckets) downsample to the requested point
+  count; it keeps the visual shape, including isolated spikes, and every
+  returned point is an original reading;
+- min/avg/max bands per equal-width time bucket, so what LTTB drops is still
+  visible as an envelope;
+- threshold zones from the tracking agent's reference ranges
+  (``tracking_agent.REFERENCE_ZONES``), so chart colours match the analysis.
+
+Everything after parsing is NumPy. Results are cached per
+(patient, metric, range); a cached entry is reused only while the readings
+and output options are unchanged.
+
+Configuration:
+    VITALS_SERIES_CACHE_ENTRIES   cached (patient, metric, range) series (default 1024)
+    VITALS_SERIES_MAX_POINTS      largest point count a client may request (default 2000)
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+from http_encoding import dumps
+from tracking_agent import REFERENCE_ZONES, REFERENCE_UNITS
+
+load_dotenv()
+
+VITALS_SERIES_CACHE_ENTRIES = int(os.getenv("VITALS_SERIES_CACHE_ENTRIES", "1024"))
+VITALS_SERIES_MAX_POINTS = int(os.getenv("VITALS_SERIES_MAX_POINTS", "2000"))
+
+SERIES_REQUESTS = REGISTRY.counter(
+    "doctorx_vitals_series_requests_total", "Chart series requests by cache outcome.", ("result",),
+)
+SERIES_BUILD_DURATION = REGISTRY.histogram(
+    "doctorx_vitals_series_build_seconds", "Time to parse, downsample and band one chart request.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+
+# Metrics whose readings carry several values; everything else uses "value"
+_SERIES_FIELDS = {
+    "blood_pressure": ("systolic", "diastolic"),
+}
+
+_MGDL_PER_MMOL_GLUCOSE = 18.0
+_EPOCH = datetime(1970, 1, 1)
+
+
+# ── Parsing ──────────────────────────────────────────────────────────────────
+
+def _epoch_seconds(value: Any) -> Optional[float]:
+    """
+    Seconds since the epoch for an ISO date. Naive dates stay in their own
+    wall-clock time (no local-zone shift); aware ones are converted to UTC.
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH).total_seconds()
+
+
+def _iso(seconds: float) -> str:
+    return (_EPOCH + timedelta(seconds=float(seconds))).isoformat(timespec="seconds")
+
+
+def parse_series(readings: List[Dict[str, Any]], field: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Time-sorted ``(seconds, values, source_index)`` for one field, dropping
+    readings with a missing date or non-numeric value.
+    """
+    times, values, index = [], [], []
+    for i, reading in enumerate(readings):
+        value = reading.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        seconds = _epoch_seconds(reading.get("date"))
+        if seconds is None:
+            continue
+        times.append(seconds)
+        values.append(value)
+        index.append(i)
+
+    x = np.asarray(times, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+    idx = np.asarray(index, dtype=np.int64)
+    finite = np.isfinite(y)
+    x, y, idx = x[finite], y[finite], idx[finite]
+    order = np.argsort(x, kind="stable")
+    return x[order], y[order], idx[order]
+
+
+# ── Downsampling ─────────────────────────────────────────────────────────────
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept; each bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the mean of the next bucket. ``x`` must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket boundaries over the interior points 1 .. n-2
+    edges = (np.floor(np.arange(threshold - 1) * ((n - 2) / (threshold - 2))) + 1).astype(np.int64)
+    edges[-1] = n - 1
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        xa, ya = x[a], y[a]
+        area = np.abs((xa - avg_x) * (y[start:end] - ya) - (xa - x[start:end]) * (avg_y - ya))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def bucket_bands(x: np.ndarray, y: np.ndarray, buckets: int) -> List[Dict[str, Any]]:
+    """
+    Min/avg/max per equal-width time bucket. Empty buckets are omitted so
+    gaps in monitoring show up as gaps rather than as interpolated bands.
+    """
+    if len(x) == 0 or buckets < 1:
+        return []
+    t0, t1 = x[0], x[-1]
+    width = (t1 - t0) / buckets if t1 > t0 else 1.0
+    slot = np.minimum(((x - t0) / width).astype(np.int64), buckets - 1)
+
+    counts = np.bincount(slot, minlength=buckets)
+    sums = np.bincount(slot, weights=y, minlength=buckets)
+    filled = np.flatnonzero(counts)
+    # x is sorted, so each bucket is one contiguous run starting at its first index
+    starts = np.searchsorted(slot, filled)
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+
+    return [
+        {
+            "start": _iso(t0 + b * width),
+            "end": _iso(t0 + (b + 1) * width),
+            "min": round(float(lo), 2),
+            "avg": round(float(total / count), 2),
+            "max": round(float(hi), 2),
+            "count": int(count),
+        }
+        for b, lo, hi, total, count in zip(filled, mins, maxs, sums[filled], counts[filled])
+    ]
+
+
+# ── Threshold zones ──────────────────────────────────────────────────────────
+
+def zone_key(metric: str, field: str, context: Optional[str] = None) -> str:
+    if field != "value":
+        return field
+    if metric == "blood_glucose" and context and "post" in context.lower():
+        return "blood_glucose_post_meal"
+    return metric
+
+
+def threshold_zones(key: str, unit: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reference-range bands for a series, converted to mmol/L for glucose if the readings use it."""
+    zones = REFERENCE_ZONES.get(key)
+    if not zones:
+        return []
+    zone_unit = REFERENCE_UNITS.get(key)
+    scale = 1.0
+    if key.startswith("blood_glucose") and unit and unit.replace(" ", "").lower() == "mmol/l":
+        scale, zone_unit = 1.0 / _MGDL_PER_MMOL_GLUCOSE, unit
+
+    def bound(v):
+        return None if v is None else round(v * scale, 1 if scale != 1.0 else 2)
+
+    return [
+        # max_inclusive: the band includes its max and the next band starts strictly above it
+        {"label": label, "min": bound(low), "max": bound(high), "max_inclusive": high_inclusive, "level": level, "unit": zone_unit}
+        for label, low, high, level, high_inclusive in zones
+    ]
+
+
+# ── Chart assembly ───────────────────────────────────────────────────────────
+
+def _series_unit(readings: List[Dict[str, Any]]) -> Optional[str]:
+    for reading in readings:
+        unit = reading.get("unit")
+        if unit:
+            return unit
+    return None
+
+
+def build_chart(
+    readings: List[Dict[str, Any]],
+    metric: str,
+    time_range: int,
+    points: int,
+    buckets: int,
+    context: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Downsampled points, bands and zones for each series of ``metric`` over the
+    last ``time_range`` days of the readings (anchored at the newest reading,
+    so historical uploads chart the same way as live ones; 0 = everything).
+    """
+    unit = _series_unit(readings)
+    series: Dict[str, Any] = {}
+    for field in _SERIES_FIELDS.get(metric, ("value",)):
+        x, y, source = parse_series(readings, field)
+        if len(x) == 0:
+            continue
+        if time_range > 0:
+            keep = x >= x[-1] - time_range * 86400.0
+            x, y, source = x[keep], y[keep], source[keep]
+
+        kept = lttb(x, y, points)
+        series[field] = {
+            "unit": unit,
+            "total_points": int(len(x)),
+            "returned_points": int(len(kept)),
+            "points": [
+                {"date": readings[int(source[i])]["date"], "value": float(y[i])}
+                for i in kept
+            ],
+            "bands": bucket_bands(x, y, buckets),
+            "zones": threshold_zones(zone_key(metric, field, context), unit),
+            "statistics": {
+                "average": round(float(y.mean()), 2),
+                "min": round(float(y.min()), 2),
+                "max": round(float(y.max()), 2),
+            },
+        }
+    return series
+
+
+# ── Cache ────────────────────────────────────────────────────────────────────
+
+class SeriesCache:
+    """LRU of built charts, one slot per (patient, metric, range)."""
+
+    def __init__(self, max_entries: int = VITALS_SERIES_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, int], Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(
+        self,
+        patient_id: str,
+        metric: str,
+        time_range: int,
+        readings: List[Dict[str, Any]],
+        points: int,
+        buckets: int,
+        context: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Return ``(series, cached)``; rebuilds when the readings or options changed."""
+        key = (patient_id, metric, time_range)
+        fingerprint = hashlib.blake2b(
+            dumps([points, buckets, context, readings]), digest_size=16,
+        ).hexdigest()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                SERIES_REQUESTS.inc(result="hit")
+                return entry[1], True
+
+        start = time.perf_counter()
+        series = build_chart(readings, metric, time_range, points, buckets, context)
+        SERIES_BUILD_DURATION.observe(time.perf_counter() - start)
+        SERIES_REQUESTS.inc(result="miss")
+
+        with self._lock:
+            self._entries[key] = (fingerprint, series)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return series, False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+SERIES_CACHE = SeriesCache()
@@ -0,0 +1,237 @@
+"""
+On-disk store for patients' vital readings.
+
+Readings arrive from quick-log one at a time and from bulk imports in large
+batches, so the store is a single SQLite table written with ``executemany``
+inside one transaction per batch (WAL mode, so readers don't block the
+importer). Each row is one value in the service's canonical unit:
+
+    blood_glucose      mg/dL        heart_rate   bpm
+    systolic/diastolic mmHg         weight       kg
+    oxygen_saturation  %            tsh/t3/t4    as reported
+
+Blood pressure is stored as separate "systolic" and "diastolic" rows with
+the same timestamp. Timestamps are the reading's local wall-clock time as
+seconds since 1970-01-01 (no time-zone shift), matching how dates are shown
+to patients. Re-importing the same export is idempotent: a second row for
+the same (patient, metric, timestamp) is ignored.
+
+Reports extracted by scan-report and chronic-care analyses are kept
+alongside in a ``reports`` table (one row per result, the full result as
+JSON) so they can be exported with the readings.
+
+Configuration:
+    VITALS_DB_PATH   SQLite file (default <tmp>/doctorx_vitals.sqlite3)
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Sequence
+
+from dotenv import load_dotenv
+
+from telemetry import REGISTRY
+
+load_dotenv()
+
+VITALS_DB_PATH = os.getenv(
+    "VITALS_DB_PATH",
+    os.path.join("/tmp" if os.path.exists("/tmp") else ".", "doctorx_vitals.sqlite3"),
+)
+
+CANONICAL_UNITS = {
+    "blood_glucose": "mg/dL",
+    "heart_rate": "bpm",
+    "systolic": "mmHg",
+    "diastolic": "mmHg",
+    "weight": "kg",
+    "oxygen_saturation": "%",
+}
+
+VITALS_ROWS_WRITTEN = REGISTRY.counter(
+    "doctorx_vitals_rows_written_total", "Vital readings written to the store.", ("source", "result"),
+)
+
+# (patient_id, metric, ts, value, unit, context, source)
+Row = Tuple[str, str, int, float, Optional[str], Optional[str], Optional[str]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vitals (
+    patient_id TEXT NOT NULL,
+    metric     TEXT NOT NULL,
+    ts         INTEGER NOT NULL,
+    value      REAL NOT NULL,
+    unit       TEXT,
+    context    TEXT,
+    source     TEXT,
+    PRIMARY KEY (patient_id, metric, ts)
+) WITHOUT ROWID
+"""
+
+_REPORTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    patient_id TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    ts         INTEGER NOT NULL,
+    condition  TEXT,
+    filename   TEXT,
+    summary    TEXT,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_patient_ts ON reports (patient_id, ts)
+"""
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_ts(dt: datetime) -> int:
+    """Wall-clock seconds for a datetime; an attached time zone is ignored, not applied."""
+    return int((dt.replace(tzinfo=None) - _EPOCH).total_seconds())
+
+
+def to_iso(ts: int) -> str:
+    return (_EPOCH + timedelta(seconds=ts)).isoformat()
+
+
+class VitalsStore:
+    """Thin SQLite wrapper; one connection per thread."""
+
+    def __init__(self, path: str = VITALS_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialised = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialised:
+                    conn.execute(_SCHEMA)
+                    conn.executescript(_REPORTS_SCHEMA)
+                    conn.commit()
+                    self._initialised = True
+            self._local.conn = conn
+        return conn
+
+    def write_batch(self, rows: List[Row], source: str = "import") -> int:
+        """Insert rows in one transaction; returns how many were new."""
+        if not rows:
+            return 0
+        conn = self._conn()
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO vitals (patient_id, metric, ts, value, unit, context, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        inserted = conn.total_changes - before
+        VITALS_ROWS_WRITTEN.inc(inserted, source=source, result="inserted")
+        if inserted < len(rows):
+            VITALS_ROWS_WRITTEN.inc(len(rows) - inserted, source=source, result="duplicate")
+        return inserted
+
+    def save_report(
+        self,
+        patient_id: str,
+        kind: str,
+        ts: int,
+        data: Dict[str, Any],
+        condition: Optional[str] = None,
+        filename: Optional[str] = None,
+        summary: Optional[str] = None,
+    ) -> None:
+        """Keep one extracted report or analysis result (``kind`` e.g. "scan-report")."""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO reports (patient_id, kind, ts, condition, filename, summary, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (patient_id, kind, ts, condition, filename, summary, json.dumps(data, default=str)),
+            )
+
+    def _scan(self, sql: str, params: List[Any], batch_size: int) -> Iterator[List[tuple]]:
+        # Own connection: a streaming response may resume the generator on any thread
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            self._conn()   # make sure the tables exist
+            cursor = conn.execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _where(
+        patient_id: str,
+        column: str,
+        values: Optional[Sequence[str]],
+        start: Optional[int],
+        end: Optional[int],
+    ) -> Tuple[str, List[Any]]:
+        sql = " WHERE patient_id = ?"
+        params: List[Any] = [patient_id]
+        if values:
+            sql += f" AND {column} IN ({', '.join('?' * len(values))})"
+            params.extend(values)
+        if start is not None:
+            sql += " AND ts >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND ts < ?"
+            params.append(end)
+        return sql, params
+
+    def iter_readings(
+        self,
+        patient_id: str,
+        metrics: Optional[Sequence[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[List[Tuple[str, int, float, Optional[str], Optional[str], Optional[str]]]]:
+        """
+        Yield ``(metric, ts, value, unit, context, source)`` rows in batches,
+        ordered by metric then time. The filters run in SQLite on the primary
+        key, so only matching rows are read.
+        """
+        where, params = self._where(patient_id, "metric", metrics, start, end)
+        sql = "SELECT metric, ts, value, unit, context, source FROM vitals" + where + " ORDER BY metric, ts"
+        return self._scan(sql, params, batch_size)
+
+    def iter_reports(
+        self,
+        patient_id: str,
+        kinds: Optional[Sequence[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        batch_size: int = 500,
+    ) -> Iterator[List[Tuple[str, int, Optional[str], Optional[str], Optional[str], str]]]:
+        """Yield ``(kind, ts, condition, filename, summary, data_json)`` rows in batches, oldest first."""
+        where, params = self._where(patient_id, "kind", kinds, start, end)
+        sql = "SELECT kind, ts, condition, filename, summary, data FROM reports" + where + " ORDER BY ts, rowid"
+        return self._scan(sql, params, batch_size)
+
+    def summary(self, patient_id: str) -> Dict[str, Dict[str, Any]]:
+        """Per-metric count and date range for a patient."""
+        rows = self._conn().execute(
+            "SELECT metric, COUNT(*), MIN(ts), MAX(ts) FROM vitals WHERE patient_id = ? GROUP BY metric",
+            (patient_id,),
+        ).fetchall()
+        return {
+            metric: {"count": count, "first_date": to_iso(first), "last_date": to_iso(last)}
+            for metric, count, first, last in rows
+        }
+
+
+STORE = VitalsStore()
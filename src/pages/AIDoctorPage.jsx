@@ -203,6 +203,7 @@ export default function AIDoctorPage() {
   const isLoadingRef = useRef(false);
   const isMutedRef = useRef(false);
   const historyRef = useRef([]);
+  const sessionIdRef = useRef(null);
   const turnRef = useRef(0);
   const phaseRef = useRef("idle");
   const bottomRef = useRef(null);
@@ -346,6 +347,9 @@ export default function AIDoctorPage() {
           patient_message: msg,
           history: historyRef.current,
           turn: turnRef.current,
+          session_id: sessionIdRef.current,
+          patient_id: 'demo_patient_001',
+          patient_name: "Patient",
         }),
       });
       const data = await res.json();
@@ -411,6 +415,7 @@ export default function AIDoctorPage() {
       if (!data.success) throw new Error(data.detail || "Start failed");
 
       historyRef.current = data.history;
+      sessionIdRef.current = data.session_id;
       turnRef.current = data.turn;
       setTurnDisplay(data.turn);
       addMessage("doctor", data.response?.question || "Hello! Which language do you prefer — English or Hindi (हिंदी)?");